@@ -1,3 +1,5 @@
+import argparse
+import threading
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -5,6 +7,12 @@ from matplotlib import cm
 from matplotlib.colors import Normalize
 import serial
 
+# Command line options
+parser = argparse.ArgumentParser(description="Magnetic intensity vector map with live location matching")
+parser.add_argument("--blit", action="store_true",
+                    help="Draw the static map once and only redraw the highlight arrow (low CPU)")
+args = parser.parse_args()
+
 # Step 1: Load the data
 location_data = pd.read_csv('e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Locations_&_Tile_Coordinates.csv')  # Modify with the actual file path
 magnetic_data = pd.read_csv('e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Locations_&_Magnetic_Data.csv')  # Modify with the actual file path
@@ -59,11 +67,23 @@ ax.set_ylim([y_coords.min() - padding, y_coords.max() + padding])
 # Optional: Make sure the aspect ratio is equal to avoid distortion
 ax.set_aspect('equal')
 
-# Step 12: Compute the Euclidean distance for each location's magnetic intensity
-def calculate_distance(real_time_data, location_data):
-    test_x, test_y, test_z = real_time_data
-    distances = np.sqrt((location_data['M_X'] - test_x)**2 + (location_data['M_Y'] - test_y)**2 + (location_data['M_Z'] - test_z)**2)
-    return distances
+# Step 12: Contiguous arrays shared by the matcher and the plot, plus preallocated scratch buffers
+fingerprints = np.ascontiguousarray(merged_data[['M_X', 'M_Y', 'M_Z']].to_numpy(dtype=float))
+coordinates = np.ascontiguousarray(merged_data[['X', 'Y']].to_numpy(dtype=float))
+location_names = merged_data['Location'].to_numpy()
+query_buffer = np.empty(3)
+diff_buffer = np.empty_like(fingerprints)
+distance_buffer = np.empty(len(fingerprints))
+
+def find_best_match_index(real_time_data):
+    """Index of the closest fingerprint, computed in place in the scratch buffers (no allocations)"""
+    query_buffer[0] = real_time_data[0]
+    query_buffer[1] = real_time_data[1]
+    query_buffer[2] = real_time_data[2]
+    np.subtract(fingerprints, query_buffer, out=diff_buffer)
+    # Squared distances rank the same as distances
+    np.einsum('ij,ij->i', diff_buffer, diff_buffer, out=distance_buffer)
+    return int(distance_buffer.argmin())
 
 # Global variable to store the previous best match location
 previous_best_match_location = None
@@ -73,18 +93,16 @@ def plot_real_time(real_time_data):
 
     # Step 13: Find the location with the minimum distance (best match)
     
-    distances = calculate_distance(real_time_data, merged_data)
-    best_match_index = np.argmin(distances)
-    best_match_location = merged_data['Location'].iloc[best_match_index]
-    print(f"The location that matches the test data is: {best_match_location}")
+    best_match_index = find_best_match_index(real_time_data)
+    best_match_location = location_names[best_match_index]
+    print(f"The location that matches the test data is: {best_match_location} (index {best_match_index})")
 
     # Update the plot only if the location changes
     if best_match_location != previous_best_match_location:
         previous_best_match_location = best_match_location
 
         # Step 14: Highlight the matching location with bold red color
-        matching_x = x_coords.iloc[best_match_index]
-        matching_y = y_coords.iloc[best_match_index]
+        matching_x, matching_y = coordinates[best_match_index]
         matching_u = real_time_data[0]
         matching_v = real_time_data[1]
 
@@ -98,6 +116,18 @@ def plot_real_time(real_time_data):
         # Step 15: Show the plot
         plt.draw()  # Update the plot
 
+def parse_real_time_data(raw_data):
+    """Convert a serial line to the list of values used for matching"""
+    # Split the data and convert to float
+    real_time_data = [float(item) for item in raw_data.split(',')]
+
+    # Indices to remove
+    indices_to_remove = [3, 4, 5]  # Example indices to remove
+    values = [item for idx, item in enumerate(real_time_data) if idx not in indices_to_remove]
+    if len(values) < 3:
+        raise ValueError(f"expected at least 3 values, got {len(values)}")
+    return values
+
 def read_serial_data():
     # print("Reading serial data")
     global previous_location
@@ -105,20 +135,99 @@ def read_serial_data():
         real_time_data = ser.readline().decode('utf-8').rstrip()
         print(f"Raw serial data: {real_time_data}")
 
-        # Split the data and convert to float
         try:
-            real_time_data = [float(item) for item in real_time_data.split(',')]
-            # print(f"Processed real-time data: {real_time_data}")
-
-            # Indices to remove
-            indices_to_remove = [3, 4, 5]  # Example indices to remove
-            real_time_data = [item for idx, item in enumerate(real_time_data) if idx not in indices_to_remove]
+            real_time_data = parse_real_time_data(real_time_data)
             print(f"Processed real-time data: {real_time_data}")
             # Plot the real-time data
             plot_real_time(real_time_data)
         except ValueError as e:
             print(f"Error processing serial data: {e}")
 
+#----------------------------Blitted Viewer Section----------------------------
+
+class BlittedVectorMap:
+    """Vector map viewer that renders the static field once and blits the highlight arrow
+
+    The quiver, labels, grid and colorbar are drawn once into a cached
+    background. Serial data is read and matched in a separate thread that only
+    publishes the latest best match; a GUI timer restores the background and
+    redraws the single highlight artist when the match changed.
+    """
+
+    def __init__(self, serial_port, interval_ms=50):
+        self.serial_port = serial_port
+        self.background = None
+        self.stop_event = threading.Event()
+
+        # Latest match published by the ingestion thread: (index, u, v)
+        self.lock = threading.Lock()
+        self.latest = None
+        self.shown = None
+
+        # The highlight arrow is animated, so full redraws leave it out of the background
+        self.highlight = ax.quiver([x_coords.iloc[0]], [y_coords.iloc[0]], [0], [0], angles='xy',
+                                   scale_units='xy', scale=50, color='red', width=0.01, animated=True)
+        self.highlight.set_visible(False)
+
+        fig.canvas.mpl_connect('draw_event', self.on_draw)
+        fig.canvas.mpl_connect('close_event', lambda event: self.stop_event.set())
+        self.timer = fig.canvas.new_timer(interval=interval_ms)
+        self.timer.add_callback(self.refresh)
+
+    def on_draw(self, event):
+        """Cache the static background after every full redraw (first show, resize, zoom)"""
+        self.background = fig.canvas.copy_from_bbox(ax.bbox)
+        self.draw_highlight()
+
+    def ingest(self):
+        """Ingestion thread: read, parse and match serial data, publish the latest match"""
+        global previous_best_match_location
+        while not self.stop_event.is_set():
+            # Blocking read with the port timeout, no busy polling
+            raw_data = self.serial_port.readline().decode('utf-8').rstrip()
+            if not raw_data:
+                continue
+            try:
+                real_time_data = parse_real_time_data(raw_data)
+                best_match_index = find_best_match_index(real_time_data)
+            except ValueError as e:
+                print(f"Error processing serial data: {e}")
+                continue
+
+            best_match_location = location_names[best_match_index]
+            if best_match_location != previous_best_match_location:
+                previous_best_match_location = best_match_location
+                print(f"The location that matches the test data is: {best_match_location} (index {best_match_index})")
+                with self.lock:
+                    self.latest = (best_match_index, real_time_data[0], real_time_data[1])
+
+    def refresh(self):
+        """GUI timer: redraw the highlight only if a new match was published"""
+        with self.lock:
+            latest = self.latest
+        if latest is None or latest == self.shown or self.background is None:
+            return
+        self.shown = latest
+
+        best_match_index, matching_u, matching_v = latest
+        self.highlight.set_offsets(coordinates[best_match_index:best_match_index + 1])
+        self.highlight.set_UVC([matching_u], [matching_v])
+        self.highlight.set_visible(True)
+
+        fig.canvas.restore_region(self.background)
+        self.draw_highlight()
+        fig.canvas.blit(ax.bbox)
+
+    def draw_highlight(self):
+        if self.highlight.get_visible():
+            ax.draw_artist(self.highlight)
+
+    def run(self):
+        threading.Thread(target=self.ingest, daemon=True).start()
+        self.timer.start()
+        plt.show()  # Idle in the GUI event loop
+        self.stop_event.set()
+
 #----------------------------Serial Port Section----------------------------
 
 # Configure the serial port
@@ -131,9 +240,12 @@ print("Serial port configured to COM10!")
 
 #----------------------------Serial Port Section End----------------------------
 
-plt.ion()  # Enable interactive mode
+if args.blit:
+    BlittedVectorMap(ser).run()
+else:
+    plt.ion()  # Enable interactive mode
 
-# Continuously read and process serial data
-while True:
-    read_serial_data()
-    plt.pause(0.001)  # Pause to allow the plot to update
\ No newline at end of file
+    # Continuously read and process serial data
+    while True:
+        read_serial_data()
+        plt.pause(0.001)  # Pause to allow the plot to update
@@ -0,0 +1,329 @@
+"""Localization benchmark harness
+
+Runs the localization pipeline of the GUI (serial parser, template window
+selection, matching) headless over traces of measurements with known ground
+truth and reports per-stage latency percentiles, throughput, memory peak and
+accuracy as JSON:
+
+    python benchmark.py --sizes 96,10000 --samples 2000 -o results.json
+    python benchmark.py --compare baseline.json results.json
+
+Maps are the surveyed map (from the CSV files, when they are present) and
+synthetic maps of the given sizes with a smooth magnetic field. Traces are
+seeded random walks over the map with Gaussian sensor noise, or recorded
+traces given with --trace (CSV with M_X, M_Y, M_Z and the true Location).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from map_catalog import LoadedMap
+from serial_parser import parse_serial_line
+
+try:
+    import resource
+except ImportError:
+    # Unix only, the peak RSS is left out of the report on Windows
+    resource = None
+
+ALGORITHMS = [
+    "Euclidean Distance", "Manhattan Distance", "Weighted Average", "KNN (K=3)",
+    "Mahalanobis Distance", "Max Likelihood", "Particle Filter",
+]
+STAGES = ["parse", "select", "match"]
+PERCENTILES = [50, 90, 99, 99.9]
+
+SURVEY_FILES = (
+    "Locations_&_Tile_Coordinates.csv",
+    "Map_Image_Pixel_Coordinates_for_Locations.csv",
+    "Locations_&_Magnetic_Data.csv",
+)
+
+
+def synthetic_map(tiles, seed=0):
+    """Square-ish grid map with a smooth random magnetic field"""
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(tiles)))
+    index = np.arange(tiles)
+    x, y = index % cols + 1, index // cols + 1
+    names = np.array([f"data_location_{i + 1}" for i in index], dtype=object)
+
+    # Sum of a few random plane waves per axis, similar in scale to the survey (tens of uT)
+    field = np.zeros((tiles, 3))
+    for axis in range(3):
+        for _ in range(4):
+            kx, ky = rng.normal(0, 0.6, 2)
+            field[:, axis] += rng.uniform(5, 20) * np.sin(kx * x + ky * y + rng.uniform(0, 2 * np.pi))
+        field[:, axis] += rng.uniform(-40, 40)
+
+    tile_coordinates = pd.DataFrame({'Location': names, 'X': x, 'Y': y})
+    pixel_coordinates = pd.DataFrame({'Location': names, 'X': x * 40, 'Y': y * 40})
+    magnetic_data = pd.DataFrame({'Location': names, 'M_X': field[:, 0], 'M_Y': field[:, 1], 'M_Z': field[:, 2]})
+    return LoadedMap(f"synthetic-{tiles}", tile_coordinates, pixel_coordinates, magnetic_data)
+
+
+def survey_map(directory):
+    """The surveyed map, if its CSV files are present"""
+    paths = [os.path.join(directory, name) for name in SURVEY_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    tiles, pixels, magnetic = (pd.read_csv(path) for path in paths)
+    return LoadedMap("survey-96", tiles, pixels, magnetic)
+
+
+def random_walk_trace(loaded, samples, noise=2.0, dwell=5, seed=1):
+    """Measurements along a random walk over neighbouring tiles
+
+    Returns:
+        DataFrame with M_X, M_Y, M_Z, the serial line and the true Location
+    """
+    rng = np.random.default_rng(seed)
+    table = loaded.location_table
+    names = table.names
+    means = loaded.ref_data.groupby('Location')[['M_X', 'M_Y', 'M_Z']].mean()
+
+    current = names[rng.integers(len(names))]
+    truth = []
+    for i in range(samples):
+        if i and i % dwell == 0:
+            x, y = table.tile(current)
+            neighbours = list(table.names_within(x, y, 1))
+            current = neighbours[rng.integers(len(neighbours))]
+        truth.append(current)
+
+    vectors = means.loc[truth].to_numpy() + rng.normal(0, noise, (samples, 3))
+    lines = [f"{x:.2f},{y:.2f},{z:.2f}" for x, y, z in vectors]
+    return pd.DataFrame({
+        'M_X': vectors[:, 0], 'M_Y': vectors[:, 1], 'M_Z': vectors[:, 2], 'Line': lines, 'Location': truth,
+    })
+
+
+def recorded_trace(path):
+    """Recorded trace (M_X, M_Y, M_Z, Location); the serial line is rebuilt if missing"""
+    trace = pd.read_csv(path)
+    if 'Line' not in trace:
+        trace['Line'] = [f"{x},{y},{z}" for x, y, z in trace[['M_X', 'M_Y', 'M_Z']].to_numpy()]
+    return trace
+
+
+def headless_app(loaded, algorithm, start_location, template_size=5):
+    """The GUI's localization state without any Tk widgets"""
+    # The GUI module is only needed for the pipeline runs, the map and trace helpers work without tkinter
+    from combine import CombinedLocationVisualization
+    from log_sink import LogSink
+
+    app = CombinedLocationVisualization.__new__(CombinedLocationVisualization)
+    app.log_sink = LogSink()
+    app.map_lock = threading.Lock()
+    loaded.particle_filter = None
+    app._set_map_data(loaded)
+    app.template_size = template_size
+    app.matched_location = start_location
+    app.template_override = None
+    app.current_algorithm = algorithm
+    app.last_filtered_data_size = 0
+    return app
+
+
+def run_trace(app, trace):
+    """Localize every sample of a trace, timing each stage
+
+    Returns:
+        Tuple (stage -> array of latencies in seconds, predicted locations)
+    """
+    samples = len(trace)
+    timings = {stage: np.empty(samples) for stage in STAGES}
+    predictions = []
+    clock = time.perf_counter
+
+    for i, line in enumerate(trace['Line']):
+        t0 = clock()
+        vector = parse_serial_line(line)[:3]
+        t1 = clock()
+        window = app.select_template_window(template_size=app.template_size)
+        t2 = clock()
+        location = app.find_closest_location(vector, window)
+        t3 = clock()
+
+        timings["parse"][i] = t1 - t0
+        timings["select"][i] = t2 - t1
+        timings["match"][i] = t3 - t2
+        predictions.append(location)
+
+        # Track like the GUI: the next template window is centered on this match
+        if location is not None:
+            app.matched_location = location
+    return timings, predictions
+
+
+def latency_summary(latencies):
+    """Percentiles, mean and max in microseconds"""
+    micros = latencies * 1e6
+    summary = {f"p{p:g}": float(np.percentile(micros, p)) for p in PERCENTILES}
+    summary["mean"] = float(micros.mean())
+    summary["max"] = float(micros.max())
+    return summary
+
+
+def accuracy_summary(loaded, predictions, truth):
+    """Exact tile hit rate and tile distance errors"""
+    table = loaded.location_table
+    hits = 0
+    errors = []
+    for predicted, actual in zip(predictions, truth):
+        hits += predicted == actual
+        p, a = table.tile(predicted) if predicted is not None else None, table.tile(actual)
+        if p is not None and a is not None:
+            errors.append(np.hypot(p[0] - a[0], p[1] - a[1]))
+    errors = np.array(errors) if errors else np.array([np.nan])
+    return {
+        "hit_rate": hits / len(truth),
+        "mean_error_tiles": float(np.mean(errors)),
+        "p90_error_tiles": float(np.percentile(errors, 90)),
+    }
+
+
+def benchmark(loaded, trace, trace_name, algorithm, memory_samples):
+    """Benchmark one algorithm on one map and trace"""
+    start = trace['Location'].iloc[0]
+
+    # Timed run
+    # (the particle filter prints on resets, which would otherwise be timed as well)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = headless_app(loaded, algorithm, start)
+        wall_start = time.perf_counter()
+        timings, predictions = run_trace(app, trace)
+        wall = time.perf_counter() - wall_start
+
+        # Separate short run under tracemalloc, so its overhead doesn't skew the latencies
+        app = headless_app(loaded, algorithm, start)
+        tracemalloc.start()
+        run_trace(app, trace.iloc[:memory_samples])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    total = sum(timings.values())
+    return {
+        "map": loaded.name,
+        "map_tiles": len(loaded.location_table),
+        "fingerprints": len(loaded.matcher),
+        "trace": trace_name,
+        "algorithm": algorithm,
+        "samples": len(trace),
+        "latency_us": {**{stage: latency_summary(timings[stage]) for stage in STAGES},
+                       "total": latency_summary(total)},
+        "throughput_per_s": len(trace) / wall,
+        "memory": {"peak_traced_bytes": peak},
+        "accuracy": accuracy_summary(loaded, predictions, trace['Location']),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline_path, current_path):
+    """Print the change of p50/p99 total latency and accuracy between two result files"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["map"], r["trace"], r["algorithm"]): r for r in json.load(f)["results"]}
+    with open(current_path, "r", encoding="utf-8") as f:
+        current = json.load(f)["results"]
+
+    print(f"{'map':<18}{'algorithm':<22}{'p50 us':>12}{'p99 us':>12}{'hit rate':>16}")
+    for result in current:
+        key = (result["map"], result["trace"], result["algorithm"])
+        old = baseline.get(key)
+        if old is None:
+            continue
+        cells = []
+        for stat in ("p50", "p99"):
+            before, after = old["latency_us"]["total"][stat], result["latency_us"]["total"][stat]
+            cells.append(f"{after:8.1f} {after / before - 1:+4.0%}" if before else f"{after:12.1f}")
+        hit_before, hit_after = old["accuracy"]["hit_rate"], result["accuracy"]["hit_rate"]
+        print(f"{result['map']:<18}{result['algorithm']:<22}{cells[0]:>12}{cells[1]:>12}"
+              f"{hit_after:10.3f} {hit_after - hit_before:+.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the localization pipeline")
+    parser.add_argument("--sizes", default="96,10000,1000000",
+                        help="Comma separated synthetic map sizes in tiles")
+    parser.add_argument("--algorithms", default=",".join(ALGORITHMS), help="Comma separated algorithm names")
+    parser.add_argument("--samples", type=int, default=2000, help="Samples per synthetic trace")
+    parser.add_argument("--noise", type=float, default=2.0, help="Sensor noise of synthetic traces (uT)")
+    parser.add_argument("--memory-samples", type=int, default=200, help="Samples of the memory-traced run")
+    parser.add_argument("--trace", action="append", default=[],
+                        help="Recorded trace CSV for the surveyed map (can be repeated)")
+    parser.add_argument("--no-survey", action="store_true", help="Skip the surveyed map")
+    parser.add_argument("--gmm-components", type=int, default=0,
+                        help="Gaussian mixture components of the per-location models (0: one Gaussian)")
+    parser.add_argument("--label", help="Version label stored in the results (default: git describe)")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    algorithms = [name.strip() for name in args.algorithms.split(",") if name.strip()]
+    workloads = []
+    if not args.no_survey:
+        loaded = survey_map(os.path.dirname(os.path.abspath(__file__)))
+        if loaded is not None:
+            loaded.gmm_components = args.gmm_components
+            workloads.append((loaded, "random-walk", random_walk_trace(loaded, args.samples, args.noise)))
+            for path in args.trace:
+                workloads.append((loaded, os.path.basename(path), recorded_trace(path)))
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        build_start = time.perf_counter()
+        loaded = synthetic_map(size)
+        loaded.gmm_components = args.gmm_components
+        print(f"Built {loaded.name} in {time.perf_counter() - build_start:.1f} s")
+        workloads.append((loaded, "random-walk", random_walk_trace(loaded, args.samples, args.noise)))
+
+    results = []
+    for loaded, trace_name, trace in workloads:
+        for algorithm in algorithms:
+            result = benchmark(loaded, trace, trace_name, algorithm, args.memory_samples)
+            results.append(result)
+            total = result["latency_us"]["total"]
+            print(f"{loaded.name:<18}{trace_name:<14}{algorithm:<22}"
+                  f"p50 {total['p50']:9.1f} us  p99 {total['p99']:9.1f} us  "
+                  f"{result['throughput_per_s']:9.0f}/s  hit {result['accuracy']['hit_rate']:.3f}")
+
+    report = {
+        "version": args.label or git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "gmm_components": args.gmm_components,
+        "results": results,
+    }
+    if resource is not None:
+        report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+from collections import deque
+
+# Edits remembered per table; readers further behind refresh everything
+CHANGE_LOG_SIZE = 4096
+
+
+class ChangeLog:
+    """Names touched by the most recent edits of a versioned table
+
+    Caches derived per location (template windows, tile models) remember the
+    version they were built at and ask for the names edited since, so a single
+    edit only invalidates what it touches. When a reader is further behind than
+    the log reaches, :meth:`since` returns None and the reader refreshes
+    everything.
+    """
+
+    def __init__(self, size=CHANGE_LOG_SIZE):
+        # (version, name) of the latest edits, oldest first
+        self._entries = deque(maxlen=size)
+
+    def record(self, version, name):
+        self._entries.append((version, name))
+
+    def since(self, version, current):
+        """Names edited after `version` (the table is at `current`), or None if no longer known"""
+        if version >= current:
+            return set()
+        if not self._entries or self._entries[0][0] > version + 1:
+            return None
+        names = set()
+        for entry_version, name in reversed(self._entries):
+            if entry_version <= version:
+                break
+            names.add(name)
+        return names
@@ -1,6 +1,6 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, Toplevel
-from PIL import Image, ImageTk
+from PIL import Image
 import numpy as np
 import pandas as pd
 import serial
@@ -11,9 +11,46 @@ from matplotlib.animation import FuncAnimation
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os  # Add this to your imports at the top
+from ui_queue import UIUpdateQueue
+from log_sink import LogSink
+from location_table import location_label
+from tile_viewer import TiledMapViewer
+from map_bundle import BUNDLE_SUFFIX, MapBundle, bundle_path_for
+from map_catalog import LoadedMap, MapCatalog
+from file_watcher import FileWatcher
+from tile_models import MODEL_ALGORITHMS
+from fingerprint_matcher import METRICS, register_metric
+from metric import QuadraticMetric
+from survey import SurveyRecorder, SurveyStore, compile_survey
+from latency import PipelineStats
+from profiler import SamplingProfiler
+from metrics_server import MetricsServer
+from sharded_matcher import ShardedMatcher
+from particle_filter import ParticleFilter
+from serial_parser import parse_serial_line
+from robot_sessions import FORWARD_COMMAND, REVERSE_COMMAND, STOP_COMMAND, RobotSessionManager
+
+# On-disk cache for the map tile pyramids
+MAP_TILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".map_tiles")
+
+# Directory scanned for compiled map bundles (*.magmap)
+MAP_BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps")
+
+# Metric learned offline with metric.py, offered as the "Learned Metric" algorithm
+LEARNED_METRIC_PATH = os.path.join(MAP_BUNDLE_DIR, "learned_metric.json")
+
+# Budget for the time from a frame's arrival to the target-reached stop command
+STOP_COMMAND_BUDGET_MS = 50
+
+# Default length of a profiling run started from the GUI
+PROFILE_SECONDS = 30
+
+# Candidate sets from this many fingerprints on are searched by the sharded worker pool (--match-workers)
+SHARDED_MATCH_MIN_ROWS = 200000
 
 class CombinedLocationVisualization:
-    def __init__(self, root):
+    def __init__(self, root, log_file=None, latency_stats=False, stop_budget_ms=STOP_COMMAND_BUDGET_MS,
+                 metrics_port=None, match_workers=0, log_level="info", gmm_components=0):
         self.root = root
         self.root.title("Magnetic Vector Visualization & Control")
         
@@ -34,6 +71,8 @@ class CombinedLocationVisualization:
         # Initialize global variables
         self.matched_location = ''
         self.previous_location = None
+        # (center, size) of a template pinned from the Template Settings tab
+        self.template_override = None
         self.vector = [0, 0, 0]
         self.history = []
         self.max_history = 100
@@ -54,6 +93,53 @@ class CombinedLocationVisualization:
         # Initialize the log_text as a None value
         self.log_text = None
         
+        # Leveled log sink, flushed to the log panel in batches
+        self.log_sink = LogSink(level=log_level)
+        if log_file:
+            self.log_sink.enable_file(log_file)
+        
+        # Per-stage latency histograms of the sample pipeline (off unless enabled)
+        self.latency_stats = PipelineStats(enabled=latency_stats)
+        self.latency_stats.set_budget("stop_command", stop_budget_ms)
+        self.latency_window = None
+        
+        # Worker pool for very large maps: (map, ShardedMatcher) once built, 0 workers keeps it off
+        self.match_workers = match_workers
+        self.sharded_matcher = None
+        self._sharded_build = None
+        
+        # Mixture components of the per-location models (Mahalanobis / Max Likelihood), 0 for one Gaussian
+        self.gmm_components = gmm_components
+        
+        # Sequence number of the last frame read from the serial port
+        self.frame_seq = 0
+        
+        # Session counters, exported by the metrics endpoint
+        self.parse_errors = 0
+        self.location_changes = 0
+        self.serial_connects = 0
+        self.serial_errors = 0
+        
+        # Queue for handing updates from the serial thread to the Tk thread
+        self.ui_thread = threading.current_thread()
+        self.ui_queue = UIUpdateQueue()
+        self.ui_queue.register("vector", self._apply_vector_readout)
+        self.ui_queue.register("robot_position", self._render_robot_position)
+        self.ui_queue.register("particles", self._update_particle_visualization)
+        self.ui_queue.register("target_reached", self._show_target_reached)
+        self.ui_queue.register("map_reloaded", self._swap_in_map_data)
+        self.ui_queue.register("profile_finished", self._show_profile_finished)
+        self.ui_queue.register("fleet_positions", self._draw_fleet_positions)
+        
+        # Sampling profiler of the Tk and serial threads
+        self.profiler = SamplingProfiler(
+            lambda: {"tk": self.ui_thread, "serial": self.serial_thread},
+            on_finished=lambda paths: self.ui_queue.post_event("profile_finished", paths),
+        )
+        
+        # Plain copy of the template size so the serial thread never reads the Tk variable
+        self.template_size = 5
+        
         # Line graph initialization
         self.line_graph_data = {'x': [], 'y': [], 'z': [], 'time': []}
         self.line_graph_time = 0
@@ -72,10 +158,31 @@ class CombinedLocationVisualization:
 
         self.current_map = "Default Map"
         self.current_algorithm = "Euclidean Distance"
+        self.applied_algorithm = "Euclidean Distance"
+        
+        # Incremented whenever a new map image is loaded; cached map layers are keyed by it
+        self.map_version = 0
+        self.all_locations_version = None
+        self.all_locations_visible = False
+        
+        # Survey mode recorder (None while not surveying)
+        self.survey = None
         
         # Load data
         self.load_data()
         
+        # Additional robots, each with its own serial link and filter state, sharing the map index
+        self.robots = RobotSessionManager(
+            lambda: self.active_map,
+            self.map_lock,
+            parse_serial_line,
+            lambda filtered_data: ParticleFilter(filtered_data, num_particles=200, sensor_noise=2.0, motion_noise=2.0),
+            on_position=lambda session, location: self.ui_queue.add_to_batch("fleet_positions", (session.name, location)),
+            on_target_reached=self._on_fleet_target_reached,
+            log=self.log_message,
+        )
+        self.fleet_window = None
+        
         # Create main container
         self.main_container = ttk.Frame(root)
         self.main_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -133,7 +240,19 @@ class CombinedLocationVisualization:
 
         # Initialize the particle button state
         self.toggle_particle_button_state()
-
+        
+        # Start draining updates posted by the serial thread
+        self.ui_queue.start(self.root)
+        
+        # Reload the fingerprint data in the background when its files change
+        self.data_watcher = FileWatcher(self._on_map_data_file_changed)
+        self._watch_active_map_files()
+        self.data_watcher.start()
+        
+        # Optional Prometheus endpoint for long-running sessions
+        self.metrics_server = None
+        if metrics_port:
+            self.start_metrics_server(metrics_port)
         
     
     def toggle_particle_button_state(self):
@@ -204,8 +323,9 @@ class CombinedLocationVisualization:
         self.map_status_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=5, pady=5)
         
         # Show all locations button
-        ttk.Button(self.map_status_frame, text="Show All Locations", 
-                  command=self.show_all_locations).pack(side=tk.LEFT, padx=5, pady=5)
+        self.show_all_btn = ttk.Button(self.map_status_frame, text="Show All Locations", 
+                                       command=self.show_all_locations)
+        self.show_all_btn.pack(side=tk.LEFT, padx=5, pady=5)
         
         # Current location display
         ttk.Label(self.map_status_frame, text="Current Location:").pack(side=tk.LEFT, padx=(20, 5), pady=5)
@@ -221,36 +341,262 @@ class CombinedLocationVisualization:
     def load_data(self):
         """Load all required data files"""
         try:
-            # Load location map coordinates for distance calculation
-            self.distances = pd.read_csv("e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Locations_&_Tile_Coordinates.csv")
+            # Catalog of compiled map bundles, keeps recently used maps indexed
+            self.map_catalog = MapCatalog(MAP_BUNDLE_DIR, gmm_components=self.gmm_components)
+            
+            # Guards swapping the active map while the serial thread is matching
+            self.map_lock = threading.Lock()
             
-            # Load location map coordinates for mapping
-            self.coordinates = pd.read_csv("e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Map_Image_Pixel_Coordinates_for_Locations.csv")
+            # Offer a metric learned from labeled runs, if one was trained
+            if os.path.exists(LEARNED_METRIC_PATH):
+                register_metric("Learned Metric", QuadraticMetric.load(LEARNED_METRIC_PATH))
+                self.log_message(f"Loaded learned metric: {LEARNED_METRIC_PATH}")
             
             # Store the default magnetic data path
             self.current_magnetic_data_path = self.magnetic_data_paths["Default Map"]
             
-            # Load reference location dataset for Euclidean distance calculation
-            self.ref_data = pd.read_csv(self.current_magnetic_data_path)
+            # Prefer a compiled map bundle next to the CSV (memory-mapped, no parsing)
+            bundle_path = bundle_path_for(self.current_magnetic_data_path)
+            if os.path.exists(bundle_path):
+                loaded = LoadedMap.from_bundle("Default Map", bundle_path, self.gmm_components)
+                loaded.image_path = loaded.image_path or self.map_paths["Default Map"]
+                tile_coordinates = loaded.tile_coordinates
+                pixel_coordinates = loaded.pixel_coordinates
+                self.log_message(f"Loaded map bundle: {bundle_path}")
+            else:
+                # Load location map coordinates for distance calculation
+                tile_coordinates = pd.read_csv("e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Locations_&_Tile_Coordinates.csv")
+                
+                # Load location map coordinates for mapping
+                pixel_coordinates = pd.read_csv("e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Location Identifier/Map_Image_Pixel_Coordinates_for_Locations.csv")
+                
+                # Load reference location dataset for Euclidean distance calculation
+                ref_data = pd.read_csv(self.current_magnetic_data_path)
+                
+                # Index the map (tile -> pixel lookup, template windows, matcher)
+                loaded = LoadedMap("Default Map", tile_coordinates, pixel_coordinates, ref_data,
+                                   image_path=self.map_paths["Default Map"], gmm_components=self.gmm_components)
+            
+            # The CSV based maps share these coordinates
+            self.legacy_tile_coordinates = tile_coordinates
+            self.legacy_pixel_coordinates = pixel_coordinates
+            
+            # Keep the map warm
+            self.active_map = loaded
+            self.map_catalog.put("Default Map", self.active_map)
+            self._set_map_data(self.active_map)
         except Exception as e:
             messagebox.showerror("Data Loading Error", f"Failed to load data files: {str(e)}")
             raise
     
+    def _set_map_data(self, loaded):
+        """Make a loaded map the one used for matching and drawing"""
+        with self.map_lock:
+            self.active_map = loaded
+            self.location_table = loaded.location_table
+            self.template_service = loaded.template_service
+            self.window_matcher = loaded.window_matcher
+            self.matcher = loaded.matcher
+            self.particle_filter = loaded.particle_filter
+            # Fleet robots rebuild their filters on the new data
+            if hasattr(self, 'robots'):
+                self.robots.reset_filters()
+    
+    @property
+    def distances(self):
+        """Tile coordinates of the active map"""
+        return self.active_map.tile_coordinates
+    
+    @property
+    def coordinates(self):
+        """Map pixel coordinates of the active map"""
+        return self.active_map.pixel_coordinates
+    
+    @property
+    def ref_data(self):
+        """Magnetic reference data of the active map"""
+        return self.active_map.ref_data
+    
+    def update_location_fingerprints(self, location, fingerprints=None, tile=None, pixel=None):
+        """Patch one location of the active map in place (no re-indexing)
+        
+        Args:
+            location: Location name
+            fingerprints: New [x, y, z] fingerprints, an empty list deletes the location
+            tile: New (x, y) on the tile grid, if it moved
+            pixel: New (x, y) in map image pixels, if it moved
+        """
+        removed = fingerprints is not None and len(fingerprints) == 0
+        with self.map_lock:
+            if removed:
+                self.active_map.remove_location(location)
+            else:
+                self.active_map.set_location(location, tile=tile, pixel=pixel, fingerprints=fingerprints)
+        
+        # The all-locations layer has to be redrawn if coordinates changed
+        if removed or tile is not None or pixel is not None:
+            self.all_locations_version = None
+            if self.all_locations_visible:
+                self._draw_all_locations_layer()
+                self.map_canvas.itemconfigure("all_locations", state=tk.NORMAL)
+    
+    def recalibrate_matched_location(self):
+        """Replace the fingerprints of the matched location by the current measurement"""
+        if not self.matched_location:
+            messagebox.showinfo("Recalibrate", "No matched location yet.")
+            return
+        
+        vector = [float(v) for v in self.vector]
+        self.update_location_fingerprints(self.matched_location, fingerprints=[vector])
+        self.log_message(f"Recalibrated {self.matched_location} to "
+                         f"[{vector[0]:.2f}, {vector[1]:.2f}, {vector[2]:.2f}]")
+        self.update_template_info()
+    
+    def _read_magnetic_data(self, mag_data_path):
+        """Read magnetic reference data, from the compiled bundle next to the CSV if there is one"""
+        bundle_path = bundle_path_for(mag_data_path)
+        if os.path.exists(bundle_path):
+            bundle = MapBundle.open(bundle_path)
+            if bundle.is_delta:
+                # Variants are stored as differences to a base map
+                return LoadedMap.from_bundle(mag_data_path, bundle_path).ref_data
+            return bundle.magnetic_data()
+        if os.path.exists(mag_data_path):
+            return pd.read_csv(mag_data_path)
+        return None
+    
+    def _load_map(self, name):
+        """Loaded map for a map name, from the warm cache, a map bundle or the CSV files"""
+        if name in self.map_catalog:
+            return self.map_catalog.get(name)
+        
+        map_path = self.map_paths.get(name)
+        if not map_path or not os.path.exists(map_path):
+            self.log_message(f"Warning: Map file not found at {map_path}")
+            return None
+        
+        # Load corresponding magnetic data file, a compiled (possibly delta) bundle if there is one
+        mag_data_path = self.magnetic_data_paths.get(name)
+        if mag_data_path and os.path.exists(bundle_path_for(mag_data_path)):
+            loaded = LoadedMap.from_bundle(name, bundle_path_for(mag_data_path), self.gmm_components)
+            loaded.image_path = map_path
+            self.map_catalog.put(name, loaded)
+            return loaded
+        
+        ref_data = self._read_magnetic_data(mag_data_path) if mag_data_path else None
+        if ref_data is None:
+            self.log_message(f"Warning: Magnetic data file for {name} not found")
+            ref_data = self.ref_data
+        
+        loaded = LoadedMap(name, self.legacy_tile_coordinates, self.legacy_pixel_coordinates, ref_data,
+                           image_path=map_path, gmm_components=self.gmm_components)
+        self.map_catalog.put(name, loaded)
+        return loaded
+    
+    def _switch_to_map(self, loaded):
+        """Swap in another loaded map without rebuilding any index"""
+        # Keep the filter state with the map we are leaving
+        self.active_map.particle_filter = self.particle_filter
+        
+        self._set_map_data(loaded)
+        if loaded.name in self.magnetic_data_paths:
+            self.current_magnetic_data_path = self.magnetic_data_paths[loaded.name]
+        
+        # Reload the map in the map window (also redraws the markers)
+        if loaded.image_path and os.path.exists(loaded.image_path):
+            self.reload_map(loaded.image_path)
+        else:
+            self.log_message(f"Warning: No map image for {loaded.name}, keeping the current image")
+        
+        # Update template info if available
+        if hasattr(self, 'template_info_text'):
+            self.update_template_info()
+        
+        # Hot reload follows the active map
+        if hasattr(self, 'data_watcher'):
+            self._watch_active_map_files()
+    
+    def _map_data_files(self, loaded):
+        """Files the fingerprint data of a loaded map comes from"""
+        if loaded.source_paths:
+            return list(loaded.source_paths)
+        return [self.current_magnetic_data_path, bundle_path_for(self.current_magnetic_data_path)]
+    
+    def _watch_active_map_files(self):
+        """Point the data watcher at the files of the active map"""
+        self.data_watcher.set_paths(self._map_data_files(self.active_map))
+    
+    def _build_reloaded_map(self, previous):
+        """Load and index fresh fingerprint data for a map, without touching the live one"""
+        if previous.bundle_path:
+            loaded = LoadedMap.from_bundle(previous.name, previous.bundle_path, previous.gmm_components)
+            if not loaded.image_path:
+                loaded.image_path = previous.image_path
+            return loaded
+        
+        ref_data = self._read_magnetic_data(self.current_magnetic_data_path)
+        if ref_data is None:
+            raise FileNotFoundError(self.current_magnetic_data_path)
+        return LoadedMap(previous.name, previous.tile_coordinates, previous.pixel_coordinates, ref_data,
+                         image_path=previous.image_path, gmm_components=previous.gmm_components)
+    
+    def _on_map_data_file_changed(self, path):
+        """Runs in the watcher thread: build the new index and hand it to the Tk thread"""
+        previous = self.active_map
+        self.log_message(f"Fingerprint data changed: {path}, rebuilding index...")
+        try:
+            loaded = self._build_reloaded_map(previous)
+        except Exception as e:
+            # A half written or broken file, keep localizing with the current data
+            self.log_message(f"Error reloading magnetic data: {str(e)}", "warning")
+            return
+        self.ui_queue.post_event("map_reloaded", previous, loaded)
+    
+    def _swap_in_map_data(self, previous, loaded):
+        """Replace the data of a map by a freshly indexed copy, keeping the filter belief"""
+        # The previous index stays untouched, readers holding it finish undisturbed
+        self.map_catalog.put(loaded.name, loaded)
+        if self.active_map is not previous:
+            # The user switched maps while the index was built, it is picked up on the next switch
+            previous.particle_filter = None
+            self.log_message(f"Reloaded magnetic data for {loaded.name}")
+            return
+        
+        # Carry the particles over by location id, on a copy: the serial thread keeps updating
+        # the live filter until the new map is swapped in, and the previous map keeps its own
+        with self.map_lock:
+            particle_filter = self.particle_filter.copy() if self.particle_filter is not None else None
+        if particle_filter is not None:
+            locations = set(particle_filter.locations_data['Location'])
+            filtered_data = loaded.ref_data[loaded.ref_data['Location'].isin(locations)]
+            if len(filtered_data) > 0:
+                particle_filter.migrate(filtered_data)
+                loaded.particle_filter = particle_filter
+        
+        self._set_map_data(loaded)
+        if loaded.particle_filter is not None:
+            self.last_filtered_data_size = len(loaded.particle_filter.locations_data)
+        self.log_message(f"Reloaded magnetic data for {loaded.name}: {len(loaded.ref_data)} fingerprints"
+                         + (", particle belief kept" if loaded.particle_filter is not None else ""))
+        
+        # Update template info if available
+        if hasattr(self, 'template_info_text'):
+            self.update_template_info()
+    
     def setup_map_panel(self):
-        """Set up the map visualization panel showing full-size map with scrollbars"""
+        """Set up the map visualization panel showing a tiled, zoomable map with scrollbars"""
         self.map_inner_frame = ttk.Frame(self.map_frame)
         self.map_inner_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.map_viewer = None
         
         try:
-            # Load the map image
-            self.map_image = Image.open("e:/University/University lectures/4. Final Year/Semester 8/1. Research Project/Codes/Map_Marker/map.png")
+            # Open the map image (only the header is read, pixels come from the tile pyramid)
+            map_path = self.map_paths["Default Map"]
+            self.map_image = Image.open(map_path)
             
             # Get the original dimensions
             original_width, original_height = self.map_image.width, self.map_image.height
             
-            # Create the photo image without resizing
-            self.map_photo = ImageTk.PhotoImage(self.map_image)
-            
             # Create a frame for scrollbars
             scroll_frame = ttk.Frame(self.map_inner_frame)
             scroll_frame.pack(fill=tk.BOTH, expand=True)
@@ -263,13 +609,13 @@ class CombinedLocationVisualization:
             screen_width = self.map_window.winfo_screenwidth() * 0.8  # 80% of screen width
             screen_height = self.map_window.winfo_screenheight() * 0.8  # 80% of screen height
             
-            # Create canvas with scrollbars
+            # Create canvas with scrollbars, rendering newly exposed tiles whenever the view moves
             self.map_canvas = tk.Canvas(
                 scroll_frame,
                 width=min(original_width, screen_width),
                 height=min(original_height, screen_height),
-                xscrollcommand=h_scrollbar.set,
-                yscrollcommand=v_scrollbar.set
+                xscrollcommand=lambda *args: (h_scrollbar.set(*args), self._on_map_view_changed()),
+                yscrollcommand=lambda *args: (v_scrollbar.set(*args), self._on_map_view_changed())
             )
             
             # Configure scrollbars
@@ -281,16 +627,32 @@ class CombinedLocationVisualization:
             v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
             self.map_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
             
-            # Add the image to the canvas
-            self.map_canvas.create_image(0, 0, anchor=tk.NW, image=self.map_photo)
-            
-            # Set the scroll region to the size of the image
-            self.map_canvas.config(scrollregion=(0, 0, original_width, original_height))
+            # Show the visible tiles of the map pyramid (sets the scroll region too)
+            self.map_viewer = TiledMapViewer(self.map_canvas, MAP_TILE_CACHE_DIR)
+            self.map_viewer.load(map_path)
+            self.map_canvas.bind("<Configure>", self._on_map_view_changed)
+            self.map_canvas.bind("<Control-MouseWheel>", self._on_map_zoom_wheel)
+            self.map_canvas.bind("<Control-Button-4>", lambda event: self.map_viewer.zoom_in())
+            self.map_canvas.bind("<Control-Button-5>", lambda event: self.map_viewer.zoom_out())
+            
+            # Zoom controls
+            zoom_frame = ttk.Frame(self.map_inner_frame)
+            zoom_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=2)
+            ttk.Button(zoom_frame, text="Zoom In", command=self.map_viewer.zoom_in).pack(side=tk.LEFT, padx=5)
+            ttk.Button(zoom_frame, text="Zoom Out", command=self.map_viewer.zoom_out).pack(side=tk.LEFT, padx=5)
+            ttk.Button(zoom_frame, text="Actual Size", command=lambda: self.map_viewer.set_zoom(1.0)).pack(side=tk.LEFT, padx=5)
+            
+            # Survey mode: click a tile to record fingerprints for it
+            self.survey_btn = ttk.Button(zoom_frame, text="Start Survey", command=self.toggle_survey)
+            self.survey_btn.pack(side=tk.RIGHT, padx=5)
+            self.survey_status = ttk.Label(zoom_frame, text="")
+            self.survey_status.pack(side=tk.RIGHT, padx=5)
+            self.map_canvas.bind("<Button-1>", self._on_map_click)
             
             # Add a prominent instruction label
             instruction_label = ttk.Label(
                 self.map_inner_frame, 
-                text="Use scrollbars to navigate the map if needed", 
+                text="Use scrollbars to navigate the map, Ctrl + mouse wheel to zoom", 
                 font=('TkDefaultFont', 10, 'italic'),
                 foreground='blue'
             )
@@ -304,6 +666,130 @@ class CombinedLocationVisualization:
             self.map_canvas.create_text(400, 300, text="Map image not found or could not be loaded", 
                                       font=('Arial', 14, 'bold'), fill='red')
     
+    def toggle_survey(self):
+        """Start survey mode, or stop it and compile the recorded fingerprints into a map bundle"""
+        if self.survey is None:
+            try:
+                os.makedirs(MAP_BUNDLE_DIR, exist_ok=True)
+                store_path = os.path.join(MAP_BUNDLE_DIR, f"survey_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+                self.survey = SurveyRecorder(SurveyStore(store_path))
+            except Exception as e:
+                messagebox.showerror("Survey Error", f"Failed to start survey: {str(e)}")
+                return
+            self.survey_btn.config(text="Stop Survey")
+            self.survey_status.config(text="Click the tile you are standing on")
+            self.log_message(f"Survey started, recording to {store_path}")
+            return
+        
+        survey, self.survey = self.survey, None
+        self._log_survey_summary(survey.close())
+        self.map_canvas.delete("survey_current")
+        self.survey_btn.config(text="Start Survey")
+        self.survey_status.config(text="")
+        if not survey.surveyed:
+            self.log_message("Survey stopped, no tiles recorded")
+            return
+        
+        # Compile the store into a bundle next to it and offer it as a map
+        store_path = survey.store.path
+        bundle_path = os.path.splitext(store_path)[0] + BUNDLE_SUFFIX
+        try:
+            count = compile_survey(store_path, self.distances, self.coordinates, bundle_path,
+                                   {"image": self.active_map.image_path} if self.active_map.image_path else None)
+        except Exception as e:
+            self.log_message(f"Error compiling survey: {str(e)}", "error")
+            messagebox.showerror("Survey Error", f"Failed to compile survey: {str(e)}")
+            return
+        
+        self.map_catalog.refresh()
+        self.map_options += [name for name in self.map_catalog.names() if name not in self.map_options]
+        self.map_combo.config(values=self.map_options)
+        self.log_message(f"Survey stopped: {len(survey.surveyed)} tiles, {count} fingerprints written to {bundle_path}")
+    
+    def _on_map_click(self, event):
+        """In survey mode, mark the clicked tile as the one being surveyed"""
+        if self.survey is None:
+            return
+        
+        x, y = self.map_viewer.to_image(self.map_canvas.canvasx(event.x), self.map_canvas.canvasy(event.y))
+        name = self._survey_location_at(x, y)
+        if name is None:
+            return
+        entry = self.location_table.get(name)
+        
+        self._log_survey_summary(self.survey.start_tile(name))
+        self.survey_status.config(text=f"Surveying {entry.label} ({len(self.survey.surveyed)} tiles done)")
+        
+        # Mark the tile being surveyed and the finished ones
+        self.map_canvas.delete("survey_current")
+        for name in self.survey.surveyed:
+            if not self.map_canvas.find_withtag(f"survey_done_{name}"):
+                done = self.location_table.pixel(name)
+                self.map_canvas.create_rectangle(done[0]-6, done[1]-6, done[0]+6, done[1]+6, outline="green",
+                                                 width=2, tags=("survey_done", f"survey_done_{name}"))
+                self._reproject_map_items(f"survey_done_{name}")
+        self.map_canvas.create_oval(entry.pixel_x-8, entry.pixel_y-8, entry.pixel_x+8, entry.pixel_y+8,
+                                    outline="magenta", width=3, tags="survey_current")
+        self._reproject_map_items("survey_current")
+    
+    def _survey_location_at(self, x, y):
+        """Location surveyed by a click at map pixel (x, y): the one on the clicked tile, or a new one
+        
+        The tile under the click comes from the affine tile <-> pixel fit of the map's
+        locations. An unsurveyed tile gets a new location (named after its tile
+        coordinates, like the densified ones), so it is written with the survey bundle.
+        """
+        table = self.location_table
+        tile = table.tile_at_pixel(x, y)
+        if tile is None:
+            # No usable fit: snap to the nearest location that has a pixel position
+            entries = [entry for entry in table if entry.pixel_x is not None]
+            if not entries:
+                return None
+            pixels = np.array([(entry.pixel_x, entry.pixel_y) for entry in entries], dtype=float)
+            return entries[int(np.argmin(((pixels - (x, y)) ** 2).sum(axis=1)))].name
+        
+        names = table.names_in_box(tile[0], tile[0], tile[1], tile[1])
+        located = [name for name in names if table.pixel(name) is not None]
+        if located:
+            return min(located, key=lambda name: (table.pixel(name)[0] - x) ** 2 + (table.pixel(name)[1] - y) ** 2)
+        
+        # Unsurveyed tile (or one without a pixel position): place it at the clicked pixel
+        name = min(names) if names else f"{tile[0]:g}x{tile[1]:g}"
+        with self.map_lock:
+            self.active_map.set_location(name, tile=tile, pixel=(int(round(x)), int(round(y))))
+        if not names:
+            self.log_message(f"Survey: new location {name} at tile {tile}")
+        return name
+    
+    def _log_survey_summary(self, summary):
+        """Report the result of a finished survey tile"""
+        if summary is None:
+            return
+        if summary.fingerprint is None:
+            self.log_message(f"Survey: {summary.location} skipped, only {summary.samples} usable samples", "warning")
+            return
+        x, y, z = summary.fingerprint
+        self.log_message(f"Survey: {summary.location} = [{x:.2f}, {y:.2f}, {z:.2f}] from {summary.samples} samples "
+                         f"({summary.rejected} outliers dropped)")
+    
+    def _on_map_view_changed(self, *args):
+        """Render tiles that scrolled or resized into view"""
+        if self.map_viewer is not None:
+            self.map_viewer.schedule_render()
+    
+    def _on_map_zoom_wheel(self, event):
+        """Zoom the map with Ctrl + mouse wheel"""
+        if event.delta > 0:
+            self.map_viewer.zoom_in()
+        else:
+            self.map_viewer.zoom_out()
+    
+    def _reproject_map_items(self, tag):
+        """Scale items just drawn in map image pixels to the current zoom"""
+        if self.map_viewer is not None:
+            self.map_viewer.reproject(tag)
+    
     def setup_vector_panel(self):
         """Set up the 3D vector visualization panel on the right side of the main window"""
         # Create a vertical layout
@@ -545,7 +1031,10 @@ class CombinedLocationVisualization:
         
         # Algorithm options
         self.algo_var = tk.StringVar(value="Euclidean Distance")
-        self.algo_options = ["Euclidean Distance", "Manhattan Distance", "Weighted Average", "KNN (K=3)", "Particle Filter"]
+        self.algo_options = ["Euclidean Distance", "Manhattan Distance", "Weighted Average", "KNN (K=3)",
+                             "Mahalanobis Distance", "Max Likelihood", "Particle Filter"]
+        if "Learned Metric" in METRICS:
+            self.algo_options.insert(-1, "Learned Metric")
         self.algo_combo = ttk.Combobox(map_algo_tab, width=15, 
                                     textvariable=self.algo_var, 
                                     values=self.algo_options)
@@ -572,6 +1061,7 @@ class CombinedLocationVisualization:
         
         # Initialize template size variable
         self.template_size_var = tk.IntVar(value=5)
+        self.template_size_var.trace_add("write", self._on_template_size_changed)
         
         # Template size entry (spinner)
         template_spinner = ttk.Spinbox(
@@ -647,6 +1137,9 @@ class CombinedLocationVisualization:
         self.log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
         self.log_scroll.pack(side=tk.RIGHT, fill=tk.Y, padx=0, pady=5)
         
+        # Start flushing the log sink into the widget
+        self.log_sink.attach(self.root, self.log_text)
+        
         # Initial log messages
         self.log_message("Application started. Please follow these steps:")
         self.log_message("1. Connect to the serial port")
@@ -678,6 +1171,10 @@ class CombinedLocationVisualization:
                                     style="Big.TButton")
         self.conn_button.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky=tk.EW)
         
+        # Additional robots on their own ports
+        fleet_button = ttk.Button(self.conn_frame, text="Robot Fleet...", command=self.open_fleet_window)
+        fleet_button.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky=tk.EW)
+        
         # Location settings frame
         self.location_frame = ttk.LabelFrame(self.left_panel, text="Location Settings")
         self.location_frame.grid(row=1, column=0, padx=5, pady=5, sticky="ew")
@@ -754,9 +1251,10 @@ class CombinedLocationVisualization:
         ttk.Label(map_algo_tab, text="Select Map:").grid(
             row=0, column=0, padx=5, pady=5, sticky=tk.W)
         
-        # Map options
+        # Map options (built-in maps plus bundles discovered in the maps directory)
         self.map_var = tk.StringVar(value="Default Map")
         self.map_options = ["Default Map", "With Objects Map"]
+        self.map_options += [name for name in self.map_catalog.names() if name not in self.map_options]
         self.map_combo = ttk.Combobox(map_algo_tab, width=15, 
                                     textvariable=self.map_var, 
                                     values=self.map_options)
@@ -769,7 +1267,10 @@ class CombinedLocationVisualization:
         
         # Algorithm options
         self.algo_var = tk.StringVar(value="Euclidean Distance")
-        self.algo_options = ["Euclidean Distance", "Manhattan Distance", "Weighted Average", "KNN (K=3)", "Particle Filter"]
+        self.algo_options = ["Euclidean Distance", "Manhattan Distance", "Weighted Average", "KNN (K=3)",
+                             "Mahalanobis Distance", "Max Likelihood", "Particle Filter"]
+        if "Learned Metric" in METRICS:
+            self.algo_options.insert(-1, "Learned Metric")
         self.algo_combo = ttk.Combobox(map_algo_tab, width=15, 
                                     textvariable=self.algo_var, 
                                     values=self.algo_options)
@@ -796,6 +1297,14 @@ class CombinedLocationVisualization:
             style="LineGraph.TButton"  # Use the custom style
         )
         self.line_graph_btn.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky=tk.EW)        
+        
+        # Per-stage latency statistics of the sample pipeline
+        latency_btn = ttk.Button(map_algo_tab, text="Latency Stats", command=self.open_latency_stats)
+        latency_btn.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky=tk.EW)
+        
+        # Sampling profiler of the Tk and serial threads
+        self.profile_btn = ttk.Button(map_algo_tab, text=f"Profile {PROFILE_SECONDS} s", command=self.toggle_profiler)
+        self.profile_btn.grid(row=5, column=0, columnspan=2, padx=5, pady=5, sticky=tk.EW)
 
 
         # Tab 2: Template Settings
@@ -811,6 +1320,7 @@ class CombinedLocationVisualization:
         
         # Initialize template size variable
         self.template_size_var = tk.IntVar(value=5)
+        self.template_size_var.trace_add("write", self._on_template_size_changed)
         
         # Template size entry (spinner)
         template_spinner = ttk.Spinbox(
@@ -868,6 +1378,14 @@ class CombinedLocationVisualization:
             state=tk.DISABLED  # Initialize as disabled
         )
         self.visualize_particles_btn.grid(row=5, column=1, padx=5, pady=5, sticky=tk.W)
+        
+        # Button to store the current measurement as the matched location's fingerprint
+        recalibrate_btn = ttk.Button(
+            template_frame,
+            text="Recalibrate Location",
+            command=self.recalibrate_matched_location
+        )
+        recalibrate_btn.grid(row=6, column=0, padx=5, pady=5, sticky=tk.W)
 
         # Add to the template_tab or create a new tab for particle filter visualization
         particle_frame = ttk.Frame(template_tab)
@@ -901,6 +1419,7 @@ class CombinedLocationVisualization:
                 # Try to open the serial port
                 self.serial_port = serial.Serial(port=port, baudrate=baud, timeout=1)
                 self.is_connected = True
+                self.serial_connects += 1
                 self.conn_button.config(text="Disconnect")
                 self.log_message(f"Connected to {port} at {baud} baud")
                 
@@ -1047,19 +1566,19 @@ class CombinedLocationVisualization:
             start_name = starting_location.iloc[0]['Location']
             target_name = target_location.iloc[0]['Location']
             
-            # First, look up coordinates in coordinates dataframe
-            start_coord = self.coordinates[self.coordinates['Location'] == start_name]
-            target_coord = self.coordinates[self.coordinates['Location'] == target_name]
+            # First, look up coordinates in the location table
+            start_coord = self.location_table.pixel(start_name)
+            target_coord = self.location_table.pixel(target_name)
             
-            # Use coordinates dataframe if available, otherwise use distances dataframe
-            if not start_coord.empty:
-                x1, y1 = start_coord.iloc[0]['X'], start_coord.iloc[0]['Y']
+            # Use map pixel coordinates if available, otherwise use tile coordinates
+            if start_coord is not None:
+                x1, y1 = start_coord
             else:
                 x1, y1 = starting_location.iloc[0]['X'], starting_location.iloc[0]['Y']
                 self.log_message(f"Warning: Using fallback coordinates for {start_name}")
             
-            if not target_coord.empty:
-                x2, y2 = target_coord.iloc[0]['X'], target_coord.iloc[0]['Y']
+            if target_coord is not None:
+                x2, y2 = target_coord
             else:
                 x2, y2 = target_location.iloc[0]['X'], target_location.iloc[0]['Y']
                 self.log_message(f"Warning: Using fallback coordinates for {target_name}")
@@ -1140,6 +1659,9 @@ class CombinedLocationVisualization:
                                        fill="green", outline="black", tags="location_marker")
             self.map_canvas.create_text(legend_x+90, legend_y+50, text="Target Location", 
                                       anchor=tk.W, font=("Arial", 8), tags="location_marker")
+            
+            # Place the markers at the current zoom
+            self._reproject_map_items("location_marker")
         
         except Exception as e:
             self.log_message(f"Error updating map: {str(e)}")
@@ -1150,6 +1672,13 @@ class CombinedLocationVisualization:
         while not self.stop_thread:
             try:
                 if self.serial_port and self.serial_port.is_open and self.serial_port.in_waiting > 0:
+                    # Every frame gets a sequence number and its arrival time, the other
+                    # stage timestamps are only taken while the latency stats are enabled
+                    t_read = time.perf_counter_ns()
+                    self.frame_seq += 1
+                    seq = self.frame_seq
+                    stats = self.latency_stats if self.latency_stats.enabled else None
+                    
                     # Read data from serial port
                     data = self.serial_port.readline().decode('utf-8').strip()
                     
@@ -1162,83 +1691,63 @@ class CombinedLocationVisualization:
                     
                     # Try to parse the data as comma-separated values
                     try:
-                        # Clean up the data: replace multiple commas with a single comma
-                        # and ensure proper separation of numbers
-                        cleaned_data = data
-                        
-                        # Handle case where values are run together without commas (e.g., '50.050.09')
-                        # This regex looks for patterns like digit.digit.digit and adds a comma
-                        import re
-                        cleaned_data = re.sub(r'(\d+\.\d+)(\d+\.\d+)', r'\1,\2', cleaned_data)
-                        
-                        # Split by comma and filter out any empty parts
-                        parts = [part.strip() for part in cleaned_data.split(',') if part.strip()]
-                        
-                        # Extract valid float values
-                        values = []
-                        for part in parts:
-                            try:
-                                # Try to convert to float
-                                values.append(float(part))
-                            except ValueError:
-                                # If part contains multiple numbers without separator, try to split
-                                if '.' in part:
-                                    # Count number of decimal points
-                                    decimal_count = part.count('.')
-                                    if decimal_count > 1:
-                                        # This might be multiple values stuck together
-                                        # Split at each decimal point after the first
-                                        decimal_positions = [pos for pos, char in enumerate(part) if char == '.']
-                                        
-                                        # Process first number (up to the second decimal)
-                                        if decimal_positions[0] > 0:
-                                            first_num_end = decimal_positions[1]
-                                            try:
-                                                first_value = float(part[:first_num_end])
-                                                values.append(first_value)
-                                            except ValueError:
-                                                pass
-                                        
-                                        # Process second number (from the second decimal)
-                                        try:
-                                            second_value = float(part[decimal_positions[1]-1:])
-                                            values.append(second_value)
-                                        except ValueError:
-                                            pass
+                        if stats:
+                            t_parse = stats.now()
+                            stats.record("read", t_read, t_parse)
+                        values = parse_serial_line(data)
+                        if stats:
+                            stats.record("parse", t_parse)
                         
                         # Check if we have enough data to process
                         if len(values) >= 3:  # We need at least 3 values (M_X, M_Y, M_Z)
                             # Use only the first three values as X, Y, Z
                             self.vector = values[:3]
                             
+                            # Record the sample for the surveyed tile
+                            survey = self.survey
+                            if survey is not None:
+                                survey.add_sample(self.vector)
+                            
                             # Add to history
                             self.history.append(self.vector.copy())
                             if len(self.history) > self.max_history:
                                 self.history.pop(0)
                             
-                            # Update displayed values
-                            self.x_var.set(f"{self.vector[0]:.2f}")
-                            self.y_var.set(f"{self.vector[1]:.2f}")
-                            self.z_var.set(f"{self.vector[2]:.2f}")
-                            
-                            # Calculate magnitude
-                            magnitude = np.sqrt(sum(x*x for x in self.vector))
-                            self.mag_var.set(f"{magnitude:.2f}")
+                            # Update displayed values (latest value wins, shown by the Tk thread)
+                            self.ui_queue.set_latest("vector", list(self.vector))
                             
                             # Process location data if we have set locations
                             if hasattr(self, 'Starting_location') and hasattr(self, 'Target_location'):
-                                # Find the closest matching location
-                                filtered_data = self.select_nearest_locations(template_size=5)
-                                closest_location = self.find_closest_location(self.vector, filtered_data)
+                                # Find the closest matching location (the active map can't change meanwhile)
+                                with self.map_lock:
+                                    if stats:
+                                        t_select = stats.now()
+                                    window = self.select_template_window(template_size=5)
+                                    if stats:
+                                        t_match = stats.now()
+                                        stats.record("select", t_select, t_match)
+                                    closest_location = self.find_closest_location(self.vector, window)
+                                    if stats:
+                                        t_matched = stats.now()
+                                        # The particle filter update is reported as its own stage
+                                        stage = "filter" if self.current_algorithm == "Particle Filter" else "match"
+                                        stats.record(stage, t_match, t_matched)
+                                        stats.record_algorithm(self.current_algorithm, t_match, t_matched)
+                                        stats.record("pipeline", t_read, t_matched)
                                 
                                 # Update the robot location on the map
                                 if closest_location != self.previous_location:
                                     self.previous_location = closest_location
-                                    self.update_robot_position(closest_location)
+                                    self.location_changes += 1
+                                    # Handed over with the sample's timestamps, so the Tk side can time queueing and drawing
+                                    if stats:
+                                        self.ui_queue.set_latest("robot_position", closest_location, t_read, stats.now())
+                                    else:
+                                        self.ui_queue.set_latest("robot_position", closest_location)
                                     
                                     # Auto-update particles if particle filter is selected and particles are visible
                                     if self.current_algorithm == "Particle Filter" and hasattr(self, 'particles_visible') and self.particles_visible:
-                                        self._update_particle_visualization()
+                                        self.ui_queue.set_latest("particles")
 
                                     # Check if robot has reached the target location
                                     target_loc_name = self.Target_location.iloc[0]['Location']
@@ -1246,12 +1755,16 @@ class CombinedLocationVisualization:
                                         # Send stop command to the robot
                                         if self.is_connected and self.serial_port and self.serial_port.is_open:
                                             self.serial_port.write(b"5")  # Send stop command
+                                            self._record_stop_latency(seq, t_read)
                                             self.log_message("Target location reached! Robot stopped.")
-                                            # Optional: Play a sound or show a message box
-                                            messagebox.showinfo("Target Reached", 
-                                                            f"Robot has reached the target location: {target_loc_name}")
+                                            # Show the message box from the Tk thread
+                                            self.ui_queue.post_event("target_reached", target_loc_name, seq)
+                    
+                        else:
+                            self.parse_errors += 1
                     
                     except ValueError as e:
+                        self.parse_errors += 1
                         self.log_message(f"Error parsing data: {str(e)} in '{data}'")
                         # Continue processing even if one data point fails
                     
@@ -1259,11 +1772,234 @@ class CombinedLocationVisualization:
                         self.log_message(f"Unexpected error processing data: {str(e)}")
                         
             except Exception as e:
+                self.serial_errors += 1
                 self.log_message(f"Serial error: {str(e)}")
                 time.sleep(0.5)  # Wait before trying again
                 
             time.sleep(0.01)  # Small delay to prevent CPU hogging
     
+    def _record_stop_latency(self, seq, t_read):
+        """Record the time from a frame's arrival to the stop command it triggered (serial thread)"""
+        t_sent = time.perf_counter_ns()
+        latency_ms = (t_sent - t_read) / 1e6
+        if self.latency_stats.record("stop_command", t_read, t_sent) is not None:
+            budget_ms = self.latency_stats.budgets["stop_command"] / 1e6
+            self.log_message(f"Stop command for frame #{seq} took {latency_ms:.1f} ms "
+                             f"(budget {budget_ms:g} ms), expect overshoot", "warning")
+        else:
+            self.log_message(f"Stop command for frame #{seq} sent {latency_ms:.1f} ms after arrival")
+    
+    def open_fleet_window(self):
+        """Open the window for connecting and commanding additional robots"""
+        if self.fleet_window is not None and self.fleet_window.winfo_exists():
+            self.fleet_window.deiconify()
+            self.fleet_window.lift()
+            return
+        
+        self.fleet_window = Toplevel(self.root)
+        self.fleet_window.title("Robot Fleet")
+        self.fleet_window.geometry("760x360")
+        
+        # New robot settings
+        add_frame = ttk.LabelFrame(self.fleet_window, text="Add Robot")
+        add_frame.pack(fill=tk.X, padx=10, pady=5)
+        self.fleet_vars = {}
+        for column, (label, default) in enumerate([("Name", f"robot{len(self.robots) + 1}"), ("Port", ""),
+                                                    ("Baud", "9600"), ("Start", ""), ("Target", "")]):
+            ttk.Label(add_frame, text=f"{label}:").grid(row=0, column=2 * column, padx=2, pady=5, sticky=tk.W)
+            var = tk.StringVar(value=default)
+            ttk.Entry(add_frame, width=10, textvariable=var).grid(row=0, column=2 * column + 1, padx=2, pady=5)
+            self.fleet_vars[label] = var
+        ttk.Button(add_frame, text="Add", command=self._add_fleet_robot).grid(row=0, column=10, padx=5, pady=5)
+        
+        # Connected robots
+        columns = ("port", "algorithm", "location", "target", "frames", "errors")
+        self.fleet_tree = ttk.Treeview(self.fleet_window, columns=columns, height=8)
+        self.fleet_tree.heading("#0", text="Robot")
+        self.fleet_tree.column("#0", width=100)
+        for column in columns:
+            self.fleet_tree.heading(column, text=column.capitalize())
+            self.fleet_tree.column(column, width=100)
+        self.fleet_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        # Commands for the selected robots
+        buttons_frame = ttk.Frame(self.fleet_window)
+        buttons_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(buttons_frame, text="Forward",
+                   command=lambda: self._send_fleet_command(FORWARD_COMMAND)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="Stop",
+                   command=lambda: self._send_fleet_command(STOP_COMMAND)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="Reverse",
+                   command=lambda: self._send_fleet_command(REVERSE_COMMAND)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="Stop All", style="Stop.TButton",
+                   command=lambda: self.robots.send_all(STOP_COMMAND)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="Disconnect", command=self._remove_fleet_robots).pack(side=tk.RIGHT, padx=5)
+        
+        self._refresh_fleet_window()
+    
+    def _add_fleet_robot(self):
+        """Connect the robot entered in the fleet window"""
+        values = {label: var.get().strip() for label, var in self.fleet_vars.items()}
+        try:
+            self.add_robot(values["Name"], values["Port"], int(values["Baud"] or 9600),
+                           start_location=values["Start"] or None, target_location=values["Target"] or None)
+            self.fleet_vars["Name"].set(f"robot{len(self.robots) + 1}")
+        except Exception as e:
+            messagebox.showerror("Robot Error", f"Failed to add robot: {str(e)}")
+    
+    def add_robot(self, name, port, baud=9600, start_location=None, target_location=None):
+        """Start a localization session for another robot with the current algorithm and template size"""
+        if not name or not port:
+            raise ValueError("A robot needs a name and a port")
+        for location in (start_location, target_location):
+            if location and location not in self.location_table:
+                raise ValueError(f"Unknown location '{location}'")
+        return self.robots.add(name, port, baud, algorithm=self.current_algorithm,
+                               template_size=getattr(self, 'template_size', 5),
+                               start_location=start_location, target_location=target_location)
+    
+    def _selected_fleet_robots(self):
+        return [self.robots.get(name) for name in self.fleet_tree.selection() if self.robots.get(name)]
+    
+    def _send_fleet_command(self, command):
+        """Queue a drive command for the selected robots"""
+        for session in self._selected_fleet_robots():
+            if not session.send_command(command):
+                self.log_message(f"Command queue of robot {session.name} is full", "warning")
+    
+    def _remove_fleet_robots(self):
+        """Disconnect the selected robots and remove their markers"""
+        for session in self._selected_fleet_robots():
+            self.robots.remove(session.name)
+            if hasattr(self, 'map_canvas'):
+                self.map_canvas.delete(f"fleet_{session.name}")
+    
+    def _refresh_fleet_window(self):
+        """Update the robot list every half second while the window exists"""
+        if self.fleet_window is None or not self.fleet_window.winfo_exists():
+            return
+        names = set()
+        for session in self.robots:
+            names.add(session.name)
+            values = (session.port, session.algorithm, session.matched_location or "-",
+                      session.target_location or "-", session.frame_seq, session.errors + session.parse_errors)
+            if self.fleet_tree.exists(session.name):
+                self.fleet_tree.item(session.name, values=values)
+            else:
+                self.fleet_tree.insert("", tk.END, iid=session.name, text=session.name, values=values)
+        for item in self.fleet_tree.get_children():
+            if item not in names:
+                self.fleet_tree.delete(item)
+        self.fleet_window.after(500, self._refresh_fleet_window)
+    
+    def _draw_fleet_positions(self, updates):
+        """Move the markers of the fleet robots to their latest locations (Tk thread only)"""
+        if not hasattr(self, 'map_canvas'):
+            return
+        # Only the newest position per robot is drawn
+        for name, location in dict(updates).items():
+            session = self.robots.get(name)
+            pixel = self.location_table.pixel(location)
+            tag = f"fleet_{name}"
+            self.map_canvas.delete(tag)
+            if session is None or pixel is None:
+                continue
+            x, y = pixel
+            self.map_canvas.create_oval(x - 10, y - 10, x + 10, y + 10, fill=session.color, outline="black",
+                                        width=2, tags=("fleet_marker", tag))
+            self.map_canvas.create_text(x, y - 20, text=f"{name} ({location_label(location)})", fill=session.color,
+                                        font=("Arial", 10, "bold"), tags=("fleet_marker", tag))
+            self._reproject_map_items(tag)
+    
+    def _on_fleet_target_reached(self, session, location, seq, latency_ns):
+        """A fleet robot was stopped at its target (session thread)"""
+        self.log_message(f"Robot {session.name} reached {location} and was stopped "
+                         f"{latency_ns / 1e6:.1f} ms after frame #{seq}")
+        self.ui_queue.post_event("target_reached", f"{location} ({session.name})", seq)
+    
+    def start_metrics_server(self, port, host="127.0.0.1"):
+        """Serve Prometheus text metrics of the session on http://host:port/metrics"""
+        try:
+            self.metrics_server = MetricsServer(self._collect_metrics, host=host, port=port)
+        except OSError as e:
+            self.log_message(f"Could not start the metrics endpoint on {host}:{port}: {str(e)}", "error")
+            return
+        # The per-stage and per-algorithm latency histograms are needed for the export
+        self.latency_stats.enabled = True
+        self._metrics_last_scrape = (time.monotonic(), self.frame_seq)
+        self.metrics_server.start()
+        self.log_message(f"Serving metrics on {self.metrics_server.address}")
+    
+    def _collect_metrics(self, writer):
+        """Write the session metrics to a MetricsWriter (metrics server thread, read only)"""
+        # Frame rate since the previous scrape, next to the counter for rate()
+        now, frames = time.monotonic(), self.frame_seq
+        last_time, last_frames = self._metrics_last_scrape
+        self._metrics_last_scrape = (now, frames)
+        writer.gauge("frames_per_second", (frames - last_frames) / (now - last_time) if now > last_time else 0.0,
+                     "Serial frames per second since the previous scrape")
+        writer.counter("frames_total", frames, "Serial frames read")
+        writer.counter("parse_errors_total", self.parse_errors, "Serial lines without three parsable values")
+        writer.counter("location_changes_total", self.location_changes, "Changes of the matched location")
+        writer.counter("serial_connects_total", self.serial_connects, "Successful serial port connections")
+        writer.counter("serial_errors_total", self.serial_errors, "Errors of the serial read loop")
+        writer.gauge("serial_connected", int(self.is_connected), "Whether the serial port is connected")
+        
+        # Updates that never reached the screen or the log
+        writer.counter("ui_updates_coalesced_total", self.ui_queue.coalesced, "UI updates replaced by newer ones")
+        writer.counter("ui_updates_dropped_total", self.ui_queue.dropped, "UI events and batch values dropped")
+        writer.counter("log_records_dropped_total", self.log_sink.dropped, "Log records dropped before display")
+        
+        # Latency distributions
+        stats = self.latency_stats
+        for stage in stats.stages:
+            histogram = stats.histograms[stage]
+            if histogram.count:
+                writer.histogram("stage_latency_seconds", histogram, "Latency of a sample pipeline stage",
+                                 {"stage": stage})
+        for algorithm, histogram in list(stats.algorithms.items()):
+            writer.histogram("match_latency_seconds", histogram, "Matching latency per algorithm",
+                             {"algorithm": algorithm})
+        for stage in stats.budgets:
+            writer.counter("over_budget_total", stats.over_budget[stage], "Latencies above the stage budget",
+                           {"stage": stage})
+        
+        # Localization state
+        particle_filter = self.particle_filter
+        writer.gauge("particles", len(particle_filter.particles) if particle_filter is not None else 0,
+                     "Particles of the particle filter")
+        active_map = self.active_map
+        writer.gauge("map_locations", len(active_map.location_table), "Locations of the active map",
+                     {"map": active_map.name})
+        writer.gauge("map_fingerprints", len(active_map.matcher), "Fingerprints of the active map",
+                     {"map": active_map.name})
+        writer.gauge("map_version", active_map.location_table.version + active_map.matcher.version,
+                     "Number of edits applied to the active map", {"map": active_map.name})
+    
+    def _apply_vector_readout(self, vector):
+        """Show the latest vector components and magnitude (Tk thread only)"""
+        self.x_var.set(f"{vector[0]:.2f}")
+        self.y_var.set(f"{vector[1]:.2f}")
+        self.z_var.set(f"{vector[2]:.2f}")
+        
+        # Calculate magnitude
+        magnitude = np.sqrt(sum(x*x for x in vector))
+        self.mag_var.set(f"{magnitude:.2f}")
+    
+    def _show_target_reached(self, target_loc_name, seq=None):
+        """Tell the user the robot reached the target (Tk thread only)"""
+        frame = f" (frame #{seq})" if seq is not None else ""
+        messagebox.showinfo("Target Reached", 
+                            f"Robot has reached the target location: {target_loc_name}{frame}")
+    
+    def _on_template_size_changed(self, *args):
+        """Mirror the template size variable into a plain attribute for the serial thread"""
+        try:
+            self.template_size = self.template_size_var.get()
+        except tk.TclError:
+            # Ignore partial input in the spinbox
+            pass
+    
     def update_vector_plot(self):
         """Update the 3D vector plot with current data"""
         if not hasattr(self, 'ax'):
@@ -1374,6 +2110,83 @@ class CombinedLocationVisualization:
             self.line_graph_btn.config(text="Hide Line Graph")
             self.log_message("Line graph created and shown")    
 
+    def open_latency_stats(self):
+        """Open the live latency statistics window (or bring it to the front)"""
+        if self.latency_window is not None and self.latency_window.winfo_exists():
+            self.latency_window.deiconify()
+            self.latency_window.lift()
+            return
+        
+        self.latency_window = Toplevel(self.root)
+        self.latency_window.title("Pipeline Latency")
+        self.latency_window.geometry("620x300")
+        
+        # Controls: enable/disable recording, reset and dump
+        controls_frame = ttk.Frame(self.latency_window)
+        controls_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.latency_enabled_var = tk.BooleanVar(value=self.latency_stats.enabled)
+        ttk.Checkbutton(controls_frame, text="Record", variable=self.latency_enabled_var,
+                        command=self._toggle_latency_stats).pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls_frame, text="Reset", command=self.latency_stats.reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls_frame, text="Dump", command=self.dump_latency_stats).pack(side=tk.LEFT, padx=5)
+        
+        # Stage table, refreshed while the window is open
+        self.latency_text = tk.Text(self.latency_window, height=12, font=("Courier", 10))
+        self.latency_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self._refresh_latency_stats()
+    
+    def _toggle_latency_stats(self):
+        """Turn the per-stage timestamps of the serial thread on or off"""
+        self.latency_stats.enabled = self.latency_enabled_var.get()
+        self.log_message(f"Latency recording {'enabled' if self.latency_stats.enabled else 'disabled'}")
+    
+    def _refresh_latency_stats(self):
+        """Redraw the stage table every half second while the window exists"""
+        if self.latency_window is None or not self.latency_window.winfo_exists():
+            return
+        self.latency_text.delete("1.0", tk.END)
+        self.latency_text.insert(tk.END, self.latency_stats.format_table())
+        if not self.latency_stats.enabled:
+            self.latency_text.insert(tk.END, "\n\nRecording is off.")
+        self.latency_window.after(500, self._refresh_latency_stats)
+    
+    def dump_latency_stats(self, path=None):
+        """Write the latency histograms to a JSON file and the table to the log"""
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                time.strftime("latency_%Y%m%d_%H%M%S.json"))
+        try:
+            self.latency_stats.dump(path)
+            self.log_message(f"Latency statistics written to {path}\n{self.latency_stats.format_table()}")
+        except Exception as e:
+            self.log_message(f"Error writing latency statistics: {str(e)}", "error")
+    
+    def toggle_profiler(self, duration=PROFILE_SECONDS, output_prefix=None):
+        """Start a sampling profile of the Tk and serial threads, or stop the running one early"""
+        if self.profiler.running:
+            self.profiler.stop()
+            self.log_message("Stopping the profiler...")
+            return
+        
+        if output_prefix is None:
+            output_prefix = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         time.strftime("profile_%Y%m%d_%H%M%S"))
+        self.profiler.start(output_prefix, duration)
+        if hasattr(self, 'profile_btn'):
+            self.profile_btn.config(text="Stop Profiler")
+        self.log_message(f"Profiling the Tk and serial threads for {duration} s")
+    
+    def _show_profile_finished(self, paths):
+        """Report the written profile and reset the button (Tk thread only)"""
+        if hasattr(self, 'profile_btn'):
+            self.profile_btn.config(text=f"Profile {PROFILE_SECONDS} s")
+        if paths is None:
+            self.log_message(f"Could not write the profile: {self.profiler.error}", "error")
+            return
+        collapsed_path, summary_path = paths
+        self.log_message(f"Profile written: {collapsed_path} (collapsed stacks), {summary_path} (per function)")
+    
     def create_line_graph_window(self):
         """Create a new window for line graph visualization"""
         self.line_graph_window = Toplevel(self.root)
@@ -1522,69 +2335,56 @@ class CombinedLocationVisualization:
         if hasattr(self, 'line_graph_window') and self.line_graph_window.winfo_exists():
             self.line_graph_window.after(100, self.update_line_graph)
 
-    def log_message(self, message):
-        """Add a message to the log with timestamp"""
-        timestamp = time.strftime("%H:%M:%S", time.localtime())
-        
-        # Check if log_text exists before using it
-        if self.log_text is not None:
-            self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-            self.log_text.see(tk.END)  # Scroll to the end
-        else:
-            # Fall back to print if log_text is not available
-            print(f"[{timestamp}] {message}")
-    
-    def select_nearest_locations(self, template_size=None):
-        """Select only nearest locations for calculating the Euclidean distance"""
-        # If we have template locations from the template window, use those
-        if hasattr(self, 'current_template_locations') and not self.current_template_locations.empty:
-            # Filter reference data based on selected locations
-            filtered_data = self.ref_data[self.ref_data['Location'].isin(self.current_template_locations['Location'])]
-            size = self.template_size_var.get() if hasattr(self, 'template_size_var') else (template_size or 5)
-            self.log_message(f"Using template settings window size: {size} with {len(filtered_data)} locations")
-            return filtered_data
-        
-        # Otherwise, use the normal method
+    def log_message(self, message, level="info"):
+        """Add a message to the log with timestamp (safe to call from any thread)"""
+        # The sink timestamps the message and writes it to the widget in the next batch
+        self.log_sink.log(message, level)
+    
+    def select_template_window(self, template_size=None):
+        """Template window the next sample is matched in, or None to match on the whole map
+
+        Only the window's center and size are looked up; its rows are selected
+        when a consumer needs them (see TemplateWindow), so the distance-based
+        algorithms never build the window's DataFrame.
+        """
         # Use the value from the template settings window if available
         if hasattr(self, 'template_size_var'):
-            template_size = self.template_size_var.get()
+            template_size = self.template_size
         else:
             # Use the provided value or default to 5
             template_size = template_size or 5
         
+        # A template chosen in the Template Settings tab takes precedence over the live window
+        if self.template_override is not None:
+            window = self.template_service.window(*self.template_override)
+            if window is not None and len(window.rows) > 0:
+                if self.log_sink.enabled("debug"):
+                    self.log_message(f"Using template settings window size: {window.size} with "
+                                     f"{len(window.rows)} locations", "debug")
+                return window
+        
         if not self.matched_location:
-            return self.ref_data  # Return all data if no matched location
-        
-        # Find the matched location coordinates
-        matched_data = self.distances[self.distances['Location'] == self.matched_location]
-        if matched_data.empty:
-            return self.ref_data
-        
-        matched_location_x = matched_data.iloc[0]['X']
-        matched_location_y = matched_data.iloc[0]['Y']
-        
-        # Filter locations based on distance
-        selected_locations = self.distances[
-            (self.distances['X'] >= matched_location_x - template_size) & 
-            (self.distances['X'] <= matched_location_x + template_size) & 
-            (self.distances['Y'] >= matched_location_y - template_size) & 
-            (self.distances['Y'] <= matched_location_y + template_size)
-        ]
+            return None  # Match on all data if no matched location
         
-        # Filter reference data based on selected locations
-        filtered_data = self.ref_data[self.ref_data['Location'].isin(selected_locations['Location'])]
+        # Same cached window the template views show
+        window = self.template_service.window(self.matched_location, template_size)
         
-        # Log the template size being used
-        self.log_message(f"Using template size: {template_size} with {len(filtered_data)} locations")
+        # Log the template size being used (per sample, so only formatted when debug logging is on)
+        if window is not None and self.log_sink.enabled("debug"):
+            self.log_message(f"Using template size: {template_size} with {len(window.rows)} locations", "debug")
         
-        return filtered_data
+        return window
     
-    def find_closest_location(self, real_time_data, filtered_data):
-        """Compute distance to find closest location using the selected algorithm"""
-        distances = []
+    def find_closest_location(self, real_time_data, window=None):
+        """Compute distance to find closest location using the selected algorithm
         
+        Args:
+            real_time_data: Measured [x, y, z] magnetic field
+            window: TemplateWindow to search (see select_template_window), None for the whole map
+        """
         # Special handling for Particle Filter
         if self.current_algorithm == "Particle Filter":
+            filtered_data = window.fingerprints if window is not None else self.ref_data
             # Initialize particle filter if it doesn't exist or if filtered data has changed
             if (self.particle_filter is None or 
                 len(filtered_data) != self.last_filtered_data_size):
@@ -1601,124 +2401,157 @@ class CombinedLocationVisualization:
             closest_location = self.particle_filter.update(real_time_data)
             return closest_location
         
-        # Regular distance-based algorithms
-        for index, row in filtered_data.iterrows():
-            # Get reference data
-            ref_data = [row['M_X'], row['M_Y'], row['M_Z']]
-            
-            # Calculate distance based on selected algorithm
-            if self.current_algorithm == "Euclidean Distance":
-                # Standard Euclidean distance
-                distance = np.sqrt(
-                    (real_time_data[0] - ref_data[0])**2 +
-                    (real_time_data[1] - ref_data[1])**2 +
-                    (real_time_data[2] - ref_data[2])**2
-                )
-            
-            elif self.current_algorithm == "Manhattan Distance":
-                # Manhattan (L1) distance
-                distance = (
-                    abs(real_time_data[0] - ref_data[0]) +
-                    abs(real_time_data[1] - ref_data[1]) +
-                    abs(real_time_data[2] - ref_data[2])
-                )
-            
-            elif self.current_algorithm == "Weighted Average":
-                # Weighted components (emphasize X and Y over Z)
-                distance = np.sqrt(
-                    1.5 * (real_time_data[0] - ref_data[0])**2 +
-                    1.5 * (real_time_data[1] - ref_data[1])**2 +
-                    0.7 * (real_time_data[2] - ref_data[2])**2
-                )
-            
-            elif self.current_algorithm == "KNN (K=3)":
-                # This will just calculate distances normally
-                # The actual KNN logic happens after all distances are calculated
-                distance = np.sqrt(
-                    (real_time_data[0] - ref_data[0])**2 +
-                    (real_time_data[1] - ref_data[1])**2 +
-                    (real_time_data[2] - ref_data[2])**2
-                )
-            
-            distances.append((row['Location'], distance))
+        # Per-location mean/covariance models of the survey samples
+        if self.current_algorithm in MODEL_ALGORITHMS:
+            names = pd.unique(self.matcher.locations[window.rows]) if window is not None else None
+            return self.active_map.tile_models.closest(real_time_data, self.current_algorithm, names)
         
-        # Sort by smallest distance
-        distances.sort(key=lambda x: x[1])
+        # Template windows are matched on the resident window, updated by the rows that slide in or out
+        if window is not None:
+            self.window_matcher.move_to(window.center_x, window.center_y, window.size)
+            candidates = self.window_matcher.count
+        else:
+            candidates = len(self.matcher)
         
-        # For KNN, return the most common location among the k=3 nearest neighbors
-        if self.current_algorithm == "KNN (K=3)" and len(distances) >= 3:
-            # Get the 3 closest locations
-            closest_three = [loc for loc, _ in distances[:3]]
-            # Count occurrences of each location
-            from collections import Counter
-            location_counts = Counter(closest_three)
-            # Return the most common location
-            return location_counts.most_common(1)[0][0]
+        # Very large candidate sets are split over the worker pool, by the window's tile box
+        if candidates >= SHARDED_MATCH_MIN_ROWS:
+            sharded = self._current_sharded_matcher()
+            box = (window.center_x, window.center_y, window.size) if window is not None else None
+            try:
+                if sharded is not None:
+                    return sharded.closest(real_time_data, self.current_algorithm, box)
+            except RuntimeError as e:
+                # The pool closed itself, match in process until a new one is built
+                self.sharded_matcher = None
+                self.log_message(f"Matcher workers failed, rebuilding: {str(e)}", "error")
+        
+        if window is not None:
+            return self.window_matcher.match(real_time_data, self.current_algorithm)
+        
+        # Regular distance-based algorithms, vectorized over all live rows
+        return self.matcher.closest(real_time_data, self.current_algorithm)
+    
+    def _current_sharded_matcher(self):
+        """Worker-pool matcher of the active map, or None while it is off, building or stale"""
+        if not self.match_workers:
+            return None
+        if self.sharded_matcher is not None:
+            loaded, sharded = self.sharded_matcher
+            if loaded is self.active_map and not sharded.closed and sharded.is_current(self.matcher,
+                                                                                       self.location_table):
+                return sharded
+        
+        # (Re)build from a fresh snapshot in the background, matching stays in process meanwhile
+        if self._sharded_build is None or not self._sharded_build.is_alive():
+            self._sharded_build = threading.Thread(target=self._build_sharded_matcher, args=(self.active_map,))
+            self._sharded_build.daemon = True
+            self._sharded_build.start()
+        return None
+    
+    def _build_sharded_matcher(self, loaded):
+        """Snapshot a map into a new worker pool and swap it in (background thread)"""
+        start = time.time()
+        try:
+            sharded = ShardedMatcher(loaded.matcher, loaded.location_table, self.match_workers, lock=self.map_lock)
+        except Exception as e:
+            self.log_message(f"Could not start the matcher workers, matching in process: {str(e)}", "error")
+            self.match_workers = 0
+            return
         
-        # For other algorithms, just return the closest location
-        return distances[0][0]  # Return the closest location name
+        # Swap under the map lock, so no query is running on the pool being closed
+        with self.map_lock:
+            previous, self.sharded_matcher = self.sharded_matcher, (loaded, sharded)
+            if previous is not None:
+                previous[1].close()
+        self.log_message(f"Matcher workers ready for {loaded.name}: {len(sharded)} fingerprints in "
+                         f"{len(sharded.shards)} shards ({time.time() - start:.1f} s)")
     
     def show_all_locations(self):
-        """Show all available locations on the map"""
+        """Toggle the layer showing all available locations on the map"""
         try:
-            # Clear any previous markers
-            self.map_canvas.delete("all_locations")
-            
-            # Display the map image again
-            self.map_canvas.create_image(0, 0, anchor=tk.NW, image=self.map_photo)
-            
-            # Draw all locations from the coordinates dataframe
-            location_count = 0
-            
-            # Get unique locations only
-            unique_locations = self.coordinates.drop_duplicates(subset=['Location'])
-            
-            for idx, row in unique_locations.iterrows():
-                location_name = row['Location']
-                x, y = row['X'], row['Y']
-                
-                # Verify coordinates are within canvas bounds
-                if 0 <= x < self.map_image.width and 0 <= y < self.map_image.height:
-                    # Draw the location point
-                    self.map_canvas.create_oval(
-                        x-5, y-5, x+5, y+5, 
-                        fill="orange", outline="black", tags="all_locations"
-                    )
-                    
-                    # Extract location number for cleaner display
-                    loc_num = location_name.split('_')[-1] if '_' in location_name else location_name
-                    
-                    # Add the location label
-                    self.map_canvas.create_text(
-                        x, y-10, text=loc_num, 
-                        font=("Arial", 8), fill="black", tags="all_locations"
-                    )
-                    
-                    location_count += 1
+            if self.all_locations_visible:
+                # Just hide the cached layer
+                self.map_canvas.itemconfigure("all_locations", state=tk.HIDDEN)
+                self.all_locations_visible = False
+                self.show_all_btn.config(text="Show All Locations")
+                return
             
-            # Add a legend
-            legend_x = 10
-            # Place legend near the bottom of the map image
-            legend_y = self.map_image.height - 80 if hasattr(self, 'map_image') else 520
-            self.map_canvas.create_oval(legend_x+10, legend_y+25, legend_x+20, legend_y+35, 
-                                       fill="orange", outline="black", tags="all_locations")
-            self.map_canvas.create_text(legend_x+70, legend_y+30, text="Location point", 
-                                      anchor=tk.W, font=("Arial", 8), tags="all_locations")
+            # Draw the layer only once per map image
+            if self.all_locations_version != self.map_version:
+                self._draw_all_locations_layer()
             
-            self.log_message(f"Displayed {location_count} locations on the map")
+            self.map_canvas.itemconfigure("all_locations", state=tk.NORMAL)
+            self.all_locations_visible = True
+            self.show_all_btn.config(text="Hide All Locations")
             
         except Exception as e:
             self.log_message(f"Error showing locations: {str(e)}")
             messagebox.showerror("Map Error", f"Failed to show locations: {str(e)}")
+    
+    def _draw_all_locations_layer(self):
+        """Render the static layer with every location point (hidden until shown)"""
+        # Clear any previous layer
+        self.map_canvas.delete("all_locations")
+        
+        location_count = 0
+        for entry in self.location_table:
+            if entry.pixel_x is None:
+                continue
+            x, y = entry.pixel_x, entry.pixel_y
+            
+            # Verify coordinates are within canvas bounds
+            if 0 <= x < self.map_image.width and 0 <= y < self.map_image.height:
+                # Draw the location point
+                self.map_canvas.create_oval(
+                    x-5, y-5, x+5, y+5, 
+                    fill="orange", outline="black", tags="all_locations", state=tk.HIDDEN
+                )
+                
+                # Add the location label
+                self.map_canvas.create_text(
+                    x, y-10, text=entry.label, 
+                    font=("Arial", 8), fill="black", tags="all_locations", state=tk.HIDDEN
+                )
+                
+                location_count += 1
+        
+        # Add a legend
+        legend_x = 10
+        # Place legend near the bottom of the map image
+        legend_y = self.map_image.height - 80 if hasattr(self, 'map_image') else 520
+        self.map_canvas.create_oval(legend_x+10, legend_y+25, legend_x+20, legend_y+35, 
+                                   fill="orange", outline="black", tags="all_locations", state=tk.HIDDEN)
+        self.map_canvas.create_text(legend_x+70, legend_y+30, text="Location point", 
+                                  anchor=tk.W, font=("Arial", 8), tags="all_locations", state=tk.HIDDEN)
+        
+        # Map tiles are kept at the bottom, so the layer sits directly above the map
+        self._reproject_map_items("all_locations")
+        
+        self.all_locations_version = self.map_version
+        self.log_message(f"Rendered {location_count} locations on the map")
 
+    def _render_robot_position(self, location_name, t_read=None, t_queued=None):
+        """Draw a new robot position, timing the UI queue and render stages when the sample was timed"""
+        if t_read is None:
+            self.update_robot_position(location_name)
+            return
+        
+        stats = self.latency_stats
+        t_render = stats.now()
+        self.update_robot_position(location_name)
+        t_done = stats.now()
+        stats.record("queue", t_queued, t_render)
+        stats.record("render", t_render, t_done)
+        stats.record("end_to_end", t_read, t_done)
+    
     def update_robot_position(self, location_name):
         """Update the robot's position on the map"""
         try:
-            # Find the location in coordinates DataFrame
-            location = self.coordinates[self.coordinates['Location'] == location_name]
-            if not location.empty:
+            # Find the location in the location table
+            location = self.location_table.pixel(location_name)
+            if location is not None:
                 # Get the coordinates
-                x, y = location.iloc[0]['X'], location.iloc[0]['Y']
+                x, y = location
                 
                 # Clear previous robot marker
                 self.map_canvas.delete("robot_marker")
@@ -1737,11 +2570,12 @@ class CombinedLocationVisualization:
                 )
                 
                 # Add label with location number
-                loc_num = location_name.split('_')[-1] if '_' in location_name else location_name
+                loc_num = location_label(location_name)
                 self.map_canvas.create_text(
                     x, y - 25, text=f"ROBOT ({loc_num})", 
                     fill="red", font=("Arial", 10, "bold"), tags="robot_marker"
                 )
+                self._reproject_map_items("robot_marker")
                 
                 # Update the current location label
                 self.current_loc_var.set(location_name)
@@ -1772,6 +2606,30 @@ class CombinedLocationVisualization:
         if self.is_connected:
             self.toggle_connection()  # Disconnect if connected
         
+        # Keep the tile being surveyed
+        if self.survey is not None:
+            self._log_survey_summary(self.survey.close())
+        
+        # Stop the matcher workers
+        if self.sharded_matcher is not None:
+            self.sharded_matcher[1].close()
+        
+        # Disconnect the fleet robots
+        self.robots.stop_all()
+        
+        # Stop serving metrics
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        
+        # Write out a running profile
+        if self.profiler.running:
+            self.profiler.stop(join=True)
+        
+        # Stop watching the data files and the UI update pump, write out pending log lines
+        self.data_watcher.stop()
+        self.ui_queue.stop()
+        self.log_sink.detach()
+        
         # Close map window if it exists
         if hasattr(self, 'map_window') and self.map_window.winfo_exists():
             self.map_window.destroy()
@@ -1793,7 +2651,9 @@ class CombinedLocationVisualization:
             self.current_map = selected_map
             self.log_message(f"Map changed to: {selected_map}")
             
-            # The actual map will be loaded when Apply is clicked
+            # The actual map will be applied when Apply is clicked, load bundles in the background meanwhile
+            if selected_map in self.map_catalog.paths and not self.map_catalog.is_warm(selected_map):
+                self.map_catalog.warm([selected_map])
             
     def change_algorithm(self, event=None):
         """Handle algorithm selection change"""
@@ -1810,36 +2670,29 @@ class CombinedLocationVisualization:
     def apply_map_algo_settings(self):
         """Apply the selected map and algorithm settings"""
         try:
-            # Apply map change
-            map_path = self.map_paths.get(self.current_map)
-            if not map_path or not os.path.exists(map_path):
-                self.log_message(f"Warning: Map file not found at {map_path}")
+            # Apply map change (only swaps references when the map is still warm)
+            loaded = self._load_map(self.current_map)
+            if loaded is None:
                 messagebox.showwarning("Map Not Found", 
                                     f"The selected map file was not found.\nUsing the current map instead.")
-            else:
-                # Reload the map in the map window
-                self.reload_map(map_path)
-                self.log_message(f"Successfully applied map: {self.current_map}")
-                
-                # Load corresponding magnetic data file
-                mag_data_path = self.magnetic_data_paths.get(self.current_map)
-                if mag_data_path and os.path.exists(mag_data_path):
-                    # Update current path
-                    self.current_magnetic_data_path = mag_data_path
-                    
-                    # Reload the magnetic data
-                    self.reload_magnetic_data()
-                    self.log_message(f"Loaded magnetic data for {self.current_map}")
-                else:
-                    self.log_message(f"Warning: Magnetic data file for {self.current_map} not found")
+            elif loaded is not self.active_map:
+                switch_start = time.perf_counter()
+                self._switch_to_map(loaded)
+                self.log_message(f"Successfully applied map: {self.current_map} "
+                                 f"({(time.perf_counter() - switch_start) * 1000:.1f} ms)")
             
             # Apply algorithm change
             self.log_message(f"Successfully applied algorithm: {self.current_algorithm}")
+            algorithm_changed = self.current_algorithm != self.applied_algorithm
+            self.applied_algorithm = self.current_algorithm
             
             # Reset particle filter if algorithm changed
             if self.current_algorithm == "Particle Filter":
-                self.particle_filter = None  # Will be recreated on next data point
-                self.log_message("Particle filter will be initialized with next data point")
+                if algorithm_changed or self.particle_filter is None:
+                    self.particle_filter = None  # Will be recreated on next data point
+                    self.log_message("Particle filter will be initialized with next data point")
+                else:
+                    self.log_message("Keeping the particle filter of this map")
                 
                 # Reset particle visibility state
                 self.particles_visible = False
@@ -1864,21 +2717,18 @@ class CombinedLocationVisualization:
     def reload_magnetic_data(self):
         """Reload the magnetic reference data from the current path"""
         try:
-            # Load reference location dataset for Euclidean distance calculation
-            self.ref_data = pd.read_csv(self.current_magnetic_data_path)
+            # Load reference location dataset, from the compiled bundle if there is one
+            ref_data = self._read_magnetic_data(self.current_magnetic_data_path)
+            if ref_data is None:
+                raise FileNotFoundError(self.current_magnetic_data_path)
             self.log_message(f"Magnetic data reloaded from: {self.current_magnetic_data_path}")
             
-            # Reset the particle filter if it exists
-            if hasattr(self, 'particle_filter') and self.particle_filter is not None:
-                self.particle_filter = None
-                
-            # Reset any template-related data
-            if hasattr(self, 'current_template_locations'):
-                self.current_template_locations = None
-                
-            # Update template info if available
-            if hasattr(self, 'template_info_text'):
-                self.update_template_info()
+            # Re-index the active map with the new data and swap it in, keeping the particle belief
+            previous = self.active_map
+            loaded = LoadedMap(previous.name, previous.tile_coordinates, previous.pixel_coordinates, ref_data,
+                               image_path=previous.image_path, bundle_path=previous.bundle_path,
+                               gmm_components=previous.gmm_components)
+            self._swap_in_map_data(previous, loaded)
                 
         except Exception as e:
             self.log_message(f"Error reloading magnetic data: {str(e)}")
@@ -1887,21 +2737,20 @@ class CombinedLocationVisualization:
     def reload_map(self, map_path):
         """Reload the map with a new image"""
         try:
-            # Create new map image
+            # Open the new map image (header only)
             self.map_image = Image.open(map_path)
-            original_width, original_height = self.map_image.width, self.map_image.height
-            
-            # Update the PhotoImage
-            self.map_photo = ImageTk.PhotoImage(self.map_image)
             
             # Clear the canvas
             self.map_canvas.delete("all")
             
-            # Add the new image
-            self.map_canvas.create_image(0, 0, anchor=tk.NW, image=self.map_photo)
+            # Show the new map from its tile pyramid (built on first use)
+            original_width, original_height = self.map_viewer.load(map_path)
+            self.map_version += 1
             
-            # Update the scroll region
-            self.map_canvas.config(scrollregion=(0, 0, original_width, original_height))
+            # Rebuild the all-locations layer for the new image if it was shown
+            if self.all_locations_visible:
+                self._draw_all_locations_layer()
+                self.map_canvas.itemconfigure("all_locations", state=tk.NORMAL)
             
             # If we had markers before, redraw them
             if hasattr(self, 'Starting_location') and hasattr(self, 'Target_location'):
@@ -1940,6 +2789,7 @@ class CombinedLocationVisualization:
             
             # Default template size
             self.template_size_var = tk.IntVar(value=5)
+            self.template_size_var.trace_add("write", self._on_template_size_changed)
             
             # Template size slider - integers only
             template_scale = ttk.Scale(
@@ -2053,29 +2903,16 @@ class CombinedLocationVisualization:
             if hasattr(self, 'matched_loc_display'):
                 self.matched_loc_display.config(text=self.matched_location)
             
-            # Find the matched location in the distances DataFrame
-            matched_data = self.distances[self.distances['Location'] == self.matched_location]
-            if matched_data.empty:
+            # Get the cached template window for the matched location
+            window = self.template_service.window(self.matched_location, template_size)
+            if window is None:
                 self.template_results_text.insert(tk.END, f"Matched location '{self.matched_location}' not found in data.")
                 return
             
             # Get matched location coordinates
-            matched_x = matched_data.iloc[0]['X']
-            matched_y = matched_data.iloc[0]['Y']
-            
-            # Calculate template bounds
-            min_x = matched_x - template_size
-            max_x = matched_x + template_size
-            min_y = matched_y - template_size
-            max_y = matched_y + template_size
-            
-            # Find locations within the template bounds
-            template_locations = self.distances[
-                (self.distances['X'] >= min_x) & 
-                (self.distances['X'] <= max_x) & 
-                (self.distances['Y'] >= min_y) & 
-                (self.distances['Y'] <= max_y)
-            ]
+            matched_x = window.center_x
+            matched_y = window.center_y
+            template_locations = window.locations
             
             # Show results in text view
             self.template_results_text.insert(tk.END, f"Number of locations in template: {len(template_locations)}\n")
@@ -2091,8 +2928,8 @@ class CombinedLocationVisualization:
                 entry = f"{loc_name} - Position: ({x}, {y}) - Distance from matched: {distance:.2f}\n"
                 self.template_results_text.insert(tk.END, entry)
             
-            # Store the template locations for use in find_closest_location
-            self.current_template_locations = template_locations
+            # Pin matching to this template (see select_template_window)
+            self.template_override = (self.matched_location, template_size)
             
             # Update the map preview
             self.draw_template_preview(matched_x, matched_y, template_size, template_locations)
@@ -2112,20 +2949,20 @@ class CombinedLocationVisualization:
             # Get the current template size
             template_size = self.template_size_var.get()
             
-            # Find the matched location
-            matched_data = self.distances[self.distances['Location'] == self.matched_location]
-            if matched_data.empty:
+            # Get the cached template window for the matched location
+            window = self.template_service.window(self.matched_location, template_size)
+            if window is None:
                 messagebox.showinfo("Template Error", f"Matched location '{self.matched_location}' not found in data.")
                 return
             
             # Get matched location coordinates in the map coordinate system
-            matched_coord = self.coordinates[self.coordinates['Location'] == self.matched_location]
-            if matched_coord.empty:
+            matched_coord = self.location_table.pixel(self.matched_location)
+            if matched_coord is None:
                 # Fall back to distance coordinates
-                x, y = matched_data.iloc[0]['X'], matched_data.iloc[0]['Y']
+                x, y = window.center_x, window.center_y
                 self.log_message(f"Warning: Using fallback coordinates for {self.matched_location}")
             else:
-                x, y = matched_coord.iloc[0]['X'], matched_coord.iloc[0]['Y']
+                x, y = matched_coord
             
             # Clear any previous template visualizations
             self.map_canvas.delete("template_viz")
@@ -2137,26 +2974,12 @@ class CombinedLocationVisualization:
                 outline="blue", width=2, dash=(4, 2), tags="template_viz"
             )
             
-            # Find locations within the template bounds
-            # Convert template_size to a similar scale in the tile coordinates
-            matched_tile_data = self.distances[self.distances['Location'] == self.matched_location]
-            tile_x, tile_y = matched_tile_data.iloc[0]['X'], matched_tile_data.iloc[0]['Y']
-            
-            template_locations = self.distances[
-                (self.distances['X'] >= tile_x - template_size) & 
-                (self.distances['X'] <= tile_x + template_size) & 
-                (self.distances['Y'] >= tile_y - template_size) & 
-                (self.distances['Y'] <= tile_y + template_size)
-            ]
-            
             # Draw each location in the template
-            for idx, row in template_locations.iterrows():
-                loc_name = row['Location']
-                
+            for loc_name in window.locations['Location']:
                 # Get map coordinates for this location
-                loc_coord = self.coordinates[self.coordinates['Location'] == loc_name]
-                if not loc_coord.empty:
-                    loc_x, loc_y = loc_coord.iloc[0]['X'], loc_coord.iloc[0]['Y']
+                loc_coord = self.location_table.pixel(loc_name)
+                if loc_coord is not None:
+                    loc_x, loc_y = loc_coord
                     
                     # Draw point for template location
                     self.map_canvas.create_oval(
@@ -2165,7 +2988,7 @@ class CombinedLocationVisualization:
                     )
                     
                     # Draw small label
-                    loc_num = loc_name.split('_')[-1] if '_' in loc_name else loc_name
+                    loc_num = location_label(loc_name)
                     self.map_canvas.create_text(
                         loc_x, loc_y-12, text=loc_num,
                         fill="blue", font=("Arial", 8), tags="template_viz"
@@ -2178,6 +3001,7 @@ class CombinedLocationVisualization:
                 font=("Arial", 10, "bold"), fill="blue",
                 tags="template_viz"
             )
+            self._reproject_map_items("template_viz")
             
             # Update the info message
             self.log_message(f"Template with size {template_size} displayed on main map")
@@ -2237,8 +3061,7 @@ class CombinedLocationVisualization:
         )
         
         # Draw all locations in the data set with faded appearance
-        for idx, row in self.distances.iterrows():
-            x, y = row['X'], row['Y']
+        for x, y in zip(self.location_table.tile_x, self.location_table.tile_y):
             cx, cy = to_canvas(x, y)
             
             # Different color and size for points inside vs outside template
@@ -2299,45 +3122,26 @@ class CombinedLocationVisualization:
             if hasattr(self, 'matched_loc_display'):
                 self.matched_loc_display.config(text=self.matched_location)
                 
-            # Find the matched location in the distances DataFrame
-            matched_data = self.distances[self.distances['Location'] == self.matched_location]
-            if matched_data.empty:
+            # Get the cached template window for the matched location
+            window = self.template_service.window(self.matched_location, template_size)
+            if window is None:
                 self.template_info_text.insert(tk.END, f"Location '{self.matched_location}' not found.")
                 return
-                
-            # Get matched location coordinates
-            matched_x = matched_data.iloc[0]['X']
-            matched_y = matched_data.iloc[0]['Y']
-            
-            # Calculate template bounds
-            min_x = matched_x - template_size
-            max_x = matched_x + template_size
-            min_y = matched_y - template_size
-            max_y = matched_y + template_size
-            
-            # Find locations within the template bounds
-            template_locations = self.distances[
-                (self.distances['X'] >= min_x) & 
-                (self.distances['X'] <= max_x) & 
-                (self.distances['Y'] >= min_y) & 
-                (self.distances['Y'] <= max_y)
-            ]
-            
-            # Store the template locations for use in find_closest_location
-            self.current_template_locations = template_locations
+            template_locations = window.locations
+            
+            # Pin matching to this template (see select_template_window)
+            self.template_override = (self.matched_location, template_size)
             
             # Show info about the template
             self.template_info_text.insert(tk.END, f"Template size: {template_size}\n")
             self.template_info_text.insert(tk.END, f"Center: {self.matched_location}\n")
             self.template_info_text.insert(tk.END, f"Locations in template: {len(template_locations)}\n\n")
             
-            # List the location names (shortened)
+            # List the location names (shortened) in a single insert
             self.template_info_text.insert(tk.END, "Included locations:\n")
-            for idx, row in template_locations.iterrows():
-                loc_name = row['Location']
-                # Extract location number for cleaner display
-                loc_num = loc_name.split('_')[-1] if '_' in loc_name else loc_name
-                self.template_info_text.insert(tk.END, f"• {loc_num}\n")
+            self.template_info_text.insert(
+                tk.END, "".join(f"• {location_label(loc_name)}\n" for loc_name in template_locations['Location'])
+            )
                 
         except Exception as e:
             if hasattr(self, 'template_info_text'):
@@ -2421,10 +3225,10 @@ class CombinedLocationVisualization:
                 else:
                     location_counts[loc_name] = 1
                     
-                loc_coord = self.coordinates[self.coordinates['Location'] == loc_name]
+                loc_coord = self.location_table.pixel(loc_name)
                 
-                if not loc_coord.empty:
-                    x, y = loc_coord.iloc[0]['X'], loc_coord.iloc[0]['Y']
+                if loc_coord is not None:
+                    x, y = loc_coord
                     
                     # Add small random offset to visualize multiple particles at same location
                     x += np.random.normal(0, 3)
@@ -2464,215 +3268,56 @@ class CombinedLocationVisualization:
                 font=("Arial", 9), fill="black", 
                 tags="particles", anchor="w"
             )
+            self._reproject_map_items("particles")
             
             self.log_message(f"Updated particle visualization with {particles_drawn} particles")
             
         except Exception as e:
             self.log_message(f"Error updating particle visualization: {str(e)}")
 
-class ParticleFilter:
-    """Particle filter implementation for magnetic vector-based localization"""
-    
-    def __init__(self, locations_data, num_particles=100, sensor_noise=2.0, motion_noise=2.0):
-        """Initialize the particle filter
-        
-        Args:
-            locations_data: DataFrame with location and magnetic data
-            num_particles: Number of particles to use
-            sensor_noise: Standard deviation of sensor measurement noise
-            motion_noise: Standard deviation of motion model noise
-        """
-        self.locations_data = locations_data
-        self.num_particles = num_particles
-        self.sensor_noise = sensor_noise
-        self.motion_noise = motion_noise
-        
-        # Initialize particles randomly across all possible locations
-        self.particles = []
-        self.weights = []
-        
-        # Make sure we have data to work with
-        if len(locations_data) == 0:
-            raise ValueError("No location data provided for particle filter")
-        
-        # Reset particles with proper random distribution
-        self.reset_particles()
-        
-        # Keep track of history
-        self.location_history = []
-        self.history_length = 2
-        
-    def reset_particles(self):
-        """Reset particles to random distribution"""
-        # Get the list of unique locations
-        unique_locations = self.locations_data['Location'].unique()
-        
-        # Clear existing particles
-        self.particles = []
-        
-        # Create particles distributed across all locations
-        for _ in range(self.num_particles):
-            # Select a random location
-            random_loc_idx = np.random.randint(0, len(unique_locations))
-            location = unique_locations[random_loc_idx]
-            
-            # Get the magnetic data for this location
-            location_data = self.locations_data[self.locations_data['Location'] == location]
-            
-            if not location_data.empty:
-                # Get a random row if there are multiple entries for this location
-                row_idx = np.random.randint(0, len(location_data))
-                
-                magnetic_data = [
-                    location_data.iloc[row_idx]['M_X'],
-                    location_data.iloc[row_idx]['M_Y'],
-                    location_data.iloc[row_idx]['M_Z']
-                ]
-                
-                # Add some noise to initial magnetic values
-                noisy_data = [
-                    m + np.random.normal(0, self.sensor_noise) 
-                    for m in magnetic_data
-                ]
-                
-                self.particles.append({
-                    'location': location,
-                    'mag_x': noisy_data[0],
-                    'mag_y': noisy_data[1],
-                    'mag_z': noisy_data[2],
-                    'weight': 1.0 / self.num_particles  # Equal initial weights
-                })
-        
-        # Initialize weights equally
-        self.weights = [1.0 / self.num_particles] * len(self.particles)
-        
-        # Print initialization info
-        print(f"Reset {len(self.particles)} particles across {len(unique_locations)} locations")
-        
-    def update(self, measurement):
-        """Update the particle filter based on a new measurement
-        
-        Args:
-            measurement: List of [x, y, z] magnetic field values
-            
-        Returns:
-            String: Most likely location
-        """
-        # Calculate weights based on the likelihood of the measurement
-        total_weight = 0
-        for i, particle in enumerate(self.particles):
-            # Calculate likelihood of this measurement given the particle
-            # (Gaussian probability density function)
-            likelihood = self._measurement_probability(measurement, particle)
-            
-            # Update particle weight
-            self.particles[i]['weight'] = likelihood
-            self.weights[i] = likelihood
-            total_weight += likelihood
-        
-        # Normalize weights so they sum to 1
-        if total_weight > 0:
-            self.weights = [w / total_weight for w in self.weights]
-            for i in range(len(self.particles)):
-                self.particles[i]['weight'] = self.weights[i]
-        else:
-            # If all weights are zero, reset to uniform
-            self.weights = [1.0 / self.num_particles] * self.num_particles
-            for i in range(len(self.particles)):
-                self.particles[i]['weight'] = self.weights[i]
-        
-        # Resample particles based on their weights
-        self._resample()
-        
-        # Determine the most likely location
-        location_counts = {}
-        for particle in self.particles:
-            loc = particle['location']
-            if loc in location_counts:
-                location_counts[loc] += particle['weight']
-            else:
-                location_counts[loc] = particle['weight']  # Creates new entry with the weight
-        
-        # Find location with highest weight
-        best_location = max(location_counts.items(), key=lambda x: x[1])[0]
-        
-        # Add to history
-        self.location_history.append(best_location)
-        if len(self.location_history) > self.history_length:
-            self.location_history.pop(0)
-        
-        # Return the most common location in history for stability
-        if len(self.location_history) > 0:
-            from collections import Counter
-            return Counter(self.location_history).most_common(1)[0][0]
-        else:
-            return best_location
-    
-    def _measurement_probability(self, measurement, particle):
-        """Calculate how likely the measurement is given the particle state"""
-        # Compute Gaussian probability density for each dimension
-        prob_x = self._gaussian(measurement[0], particle['mag_x'], self.sensor_noise)
-        prob_y = self._gaussian(measurement[1], particle['mag_y'], self.sensor_noise)
-        prob_z = self._gaussian(measurement[2], particle['mag_z'], self.sensor_noise)
-        
-        # Combine probabilities
-        return prob_x * prob_y * prob_z
-    
-    def _gaussian(self, x, mu, sigma):
-        """Calculate the Gaussian probability density function value"""
-        # Handle the case where sigma is too small to avoid division by zero
-        if sigma < 0.0001:
-            sigma = 0.0001
-            
-        # Gaussian PDF formula
-        return (1.0 / (np.sqrt(2.0 * np.pi) * sigma)) * np.exp(-0.5 * ((x - mu) / sigma) ** 2)
-    
-    def _resample(self):
-        """Resample particles based on their weights"""
-        # Create new particles array
-        new_particles = []
-        
-        # Use numpy's random choice with weights
-        if sum(self.weights) > 0:
-            # With probability 0.95, select based on weights
-            if np.random.random() < 0.95:
-                indices = np.random.choice(
-                    range(len(self.particles)), 
-                    size=self.num_particles, 
-                    replace=True, 
-                    p=self.weights
-                )
-                
-                # Create new particles based on the selected ones
-                for idx in indices:
-                    old_particle = self.particles[idx]
-                    
-                    # Create new particle with some randomness
-                    new_particle = {
-                        'location': old_particle['location'],
-                        'mag_x': old_particle['mag_x'] + np.random.normal(0, self.motion_noise),
-                        'mag_y': old_particle['mag_y'] + np.random.normal(0, self.motion_noise),
-                        'mag_z': old_particle['mag_z'] + np.random.normal(0, self.motion_noise),
-                        'weight': 1.0 / self.num_particles
-                    }
-                    new_particles.append(new_particle)
-            else:
-                # With probability 0.05, add completely random particles to avoid getting stuck
-                self.reset_particles()
-                new_particles = self.particles
-        else:
-            # If all weights are zero, reset the particles
-            self.reset_particles()
-            new_particles = self.particles
-            
-        # Update particles
-        self.particles = new_particles
-        self.weights = [1.0 / self.num_particles] * len(self.particles)
-
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Magnetic Vector Visualization & Control")
+    parser.add_argument("--log-file", help="Also write the system log to this rotating file")
+    parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"],
+                        help="Minimum level shown in the system log")
+    parser.add_argument("--latency-stats", action="store_true",
+                        help="Record per-stage latencies of the sample pipeline from the start")
+    parser.add_argument("--latency-dump", help="Write the latency statistics to this JSON file on exit")
+    parser.add_argument("--profile", type=float, metavar="SECONDS",
+                        help="Sample the Tk and serial threads for this many seconds after startup")
+    parser.add_argument("--profile-output", help="Output prefix of the profile (.collapsed and .txt)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus text metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--robot", action="append", default=[], metavar="NAME=PORT[:BAUD]",
+                        help="Connect an additional robot at startup (can be repeated)")
+    parser.add_argument("--match-workers", type=int, default=0,
+                        help=f"Search maps with at least {SHARDED_MATCH_MIN_ROWS} fingerprints with this many worker processes")
+    parser.add_argument("--stop-budget-ms", type=float, default=STOP_COMMAND_BUDGET_MS,
+                        help="Warn when the stop command is sent later than this after the frame arrived")
+    parser.add_argument("--gmm-components", type=int, default=0,
+                        help="Model well-surveyed locations as a Gaussian mixture with this many components "
+                             "(Mahalanobis Distance / Max Likelihood)")
+    args = parser.parse_args()
+    
     root = tk.Tk()
-    app = CombinedLocationVisualization(root)
+    app = CombinedLocationVisualization(root, log_file=args.log_file,
+                                        latency_stats=args.latency_stats or bool(args.latency_dump),
+                                        stop_budget_ms=args.stop_budget_ms, metrics_port=args.metrics_port,
+                                        match_workers=args.match_workers, log_level=args.log_level,
+                                        gmm_components=args.gmm_components)
+    if args.profile:
+        app.toggle_profiler(args.profile, args.profile_output)
+    for robot in args.robot:
+        name, _, port = robot.partition("=")
+        port, _, baud = port.partition(":")
+        try:
+            app.add_robot(name, port, int(baud or 9600))
+        except Exception as e:
+            app.log_message(f"Could not connect robot {robot}: {str(e)}", "error")
     root.mainloop()
+    if args.latency_dump:
+        app.dump_latency_stats(args.latency_dump)
 
 if __name__ == "__main__":  # <-- The '==' was missing
     main()
\ No newline at end of file
@@ -11,6 +11,7 @@ from matplotlib.animation import FuncAnimation
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os  # Add this to your imports at the top
+from log_sink import LogSink
 
 class CombinedLocationVisualization:
     def __init__(self, root):
@@ -47,6 +48,9 @@ class CombinedLocationVisualization:
         # Initialize the log_text as a None value
         self.log_text = None
         
+        # Leveled log sink, flushed to the log panel in batches
+        self.log_sink = LogSink()
+        
         # Load data
         self.load_data()
         
@@ -592,6 +596,9 @@ class CombinedLocationVisualization:
         self.log_text.tag_configure("warning", foreground="orange")
         self.log_text.tag_configure("error", foreground="red")
         
+        # Start flushing the log sink into the widget
+        self.log_sink.attach(self.root, self.log_text)
+        
         # Initial log messages
         self.log_message("Application started. Please follow these steps:", level="info")
         self.log_message("1. Connect to the serial port")
@@ -1208,27 +1215,9 @@ class CombinedLocationVisualization:
         self.canvas.draw()
     
     def log_message(self, message, level="normal"):
-        """Add a styled message to the log with timestamp"""
-        timestamp = time.strftime("%H:%M:%S", time.localtime())
-        
-        # Check if log_text exists before using it
-        if self.log_text is not None:
-            self.log_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
-            
-            # Apply different styling based on message level
-            if level == "info":
-                self.log_text.insert(tk.END, f"{message}\n", "info")
-            elif level == "warning":
-                self.log_text.insert(tk.END, f"{message}\n", "warning")
-            elif level == "error":
-                self.log_text.insert(tk.END, f"{message}\n", "error")
-            else:
-                self.log_text.insert(tk.END, f"{message}\n")
-                
-            self.log_text.see(tk.END)  # Scroll to the end
-        else:
-            # Fall back to print if log_text is not available
-            print(f"[{timestamp}] {message}")
+        """Add a styled message to the log with timestamp (safe to call from any thread)"""
+        # The sink timestamps the message and applies the level tag in the next batch
+        self.log_sink.log(message, level)
     
     def select_nearest_locations(self, template_size=None):
         """Select only nearest locations for calculating the Euclidean distance"""
@@ -1237,7 +1226,8 @@ class CombinedLocationVisualization:
             # Filter reference data based on selected locations
             filtered_data = self.ref_data[self.ref_data['Location'].isin(self.current_template_locations['Location'])]
             size = self.template_size_var.get() if hasattr(self, 'template_size_var') else (template_size or 5)
-            self.log_message(f"Using template settings window size: {size} with {len(filtered_data)} locations")
+            if self.log_sink.enabled("debug"):
+                self.log_message(f"Using template settings window size: {size} with {len(filtered_data)} locations", level="debug")
             return filtered_data
         
         # Otherwise, use the normal method
@@ -1271,7 +1261,8 @@ class CombinedLocationVisualization:
         filtered_data = self.ref_data[self.ref_data['Location'].isin(selected_locations['Location'])]
         
         # Log the template size being used
-        self.log_message(f"Using template size: {template_size} with {len(filtered_data)} locations")
+        if self.log_sink.enabled("debug"):
+            self.log_message(f"Using template size: {template_size} with {len(filtered_data)} locations", level="debug")
         
         return filtered_data
     
@@ -1447,6 +1438,9 @@ class CombinedLocationVisualization:
         if self.is_connected:
             self.toggle_connection()  # Disconnect if connected
         
+        # Write out pending log lines
+        self.log_sink.detach()
+        
         # Close map window if it exists
         if hasattr(self, 'map_window') and self.map_window.winfo_exists():
             self.map_window.destroy()
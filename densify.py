@@ -0,0 +1,298 @@
+"""Offline densification of a fingerprint map with Gaussian-process regression
+
+Fits a GP (RBF kernel over tile coordinates, shared by M_X, M_Y and M_Z) to
+the surveyed fingerprints and predicts fingerprints on a sub-tile grid. The
+result is written as a regular map bundle: the surveyed locations are kept
+and every grid point becomes an extra location named after its tile
+coordinates (e.g. "2.25x3.5"), so the GUI and the matcher use it unchanged.
+
+The GP uses inducing points (DTC approximation) and accumulates the kernel
+products in chunks, so memory stays O(m^2 + chunk * m) and time O(n m^2)
+for n survey points and m inducing points:
+
+    python densify.py --bundle Locations_&_Magnetic_Data.magmap --step 0.25 \\
+        -o maps/dense.magmap
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from location_table import tile_to_pixel_transform
+from map_bundle import MapBundle, bundle_relative_path, resolve_bundle_path, write_bundle
+
+MAGNETIC_COLUMNS = ['M_X', 'M_Y', 'M_Z']
+
+
+def rbf_kernel(a, b, lengthscale, variance):
+    """Squared exponential kernel between two sets of 2D points"""
+    sq = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * a @ b.T
+    return variance * np.exp(-0.5 * np.maximum(sq, 0.0) / lengthscale ** 2)
+
+
+class SparseGP:
+    """GP regression with inducing points (DTC), solved in chunks
+
+    All outputs share the kernel; each output gets its own constant mean and
+    signal variance. With as many inducing points as inputs (the default for
+    small surveys) the predictive mean equals the exact GP mean.
+    """
+
+    def __init__(self, lengthscale=1.0, noise_ratio=0.05, inducing=500, chunk_size=2048, jitter=1e-6):
+        """Initialize the model
+
+        Args:
+            lengthscale: Kernel lengthscale in tiles
+            noise_ratio: Noise variance as a fraction of the signal variance
+            inducing: Maximum number of inducing points
+            chunk_size: Rows of the kernel matrices processed at once
+            jitter: Diagonal added to Kmm for numerical stability
+        """
+        self.lengthscale = lengthscale
+        self.noise_ratio = noise_ratio
+        self.inducing = inducing
+        self.chunk_size = chunk_size
+        self.jitter = jitter
+
+    def fit(self, points, values):
+        """Fit the model
+
+        Args:
+            points: (n, 2) tile coordinates
+            values: (n, d) fingerprints
+        """
+        self.points = np.asarray(points, dtype=float)
+        values = np.asarray(values, dtype=float)
+        self.mean = values.mean(axis=0)
+        self.scale = values.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        # Work on standardized outputs, so the kernel has unit signal variance
+        self.targets = (values - self.mean) / self.scale
+        self.inducing_points = self._select_inducing(self.points)
+        self._solve()
+        return self
+
+    def log_marginal_likelihood(self):
+        """DTC approximation of the log marginal likelihood (summed over outputs)"""
+        return self._lml
+
+    def optimize(self, points, values, lengthscales=None, noise_ratios=None):
+        """Fit with the grid point of hyperparameters that maximizes the marginal likelihood"""
+        if lengthscales is None:
+            lengthscales = [0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0]
+        if noise_ratios is None:
+            noise_ratios = [0.01, 0.05, 0.1, 0.25]
+
+        best = None
+        for lengthscale in lengthscales:
+            for noise_ratio in noise_ratios:
+                self.lengthscale, self.noise_ratio = lengthscale, noise_ratio
+                self.fit(points, values)
+                if best is None or self._lml > best[0]:
+                    best = (self._lml, lengthscale, noise_ratio)
+
+        self.lengthscale, self.noise_ratio = best[1], best[2]
+        return self.fit(points, values)
+
+    def predict(self, points, return_std=False):
+        """Predictive mean (and standard deviation) at new points, in chunks"""
+        points = np.asarray(points, dtype=float)
+        means = np.empty((len(points), self.targets.shape[1]))
+        stds = np.empty(len(points)) if return_std else None
+
+        for start in range(0, len(points), self.chunk_size):
+            chunk = points[start:start + self.chunk_size]
+            k_sm = rbf_kernel(chunk, self.inducing_points, self.lengthscale, 1.0)
+            means[start:start + len(chunk)] = k_sm @ self._alpha
+            if return_std:
+                # DTC variance: k** - diag(K*m Kmm^-1 Km*) + diag(K*m Sigma^-1 Km*)
+                a = np.linalg.solve(self._kmm_chol, k_sm.T)
+                b = np.linalg.solve(self._sigma_chol, k_sm.T)
+                variance = 1.0 - (a * a).sum(axis=0) + self._noise * (b * b).sum(axis=0)
+                stds[start:start + len(chunk)] = np.sqrt(np.maximum(variance, 0.0))
+
+        means = means * self.scale + self.mean
+        if return_std:
+            return means, stds[:, None] * self.scale
+        return means
+
+    def _select_inducing(self, points):
+        """Inducing points: all inputs for small surveys, a spread-out subset otherwise"""
+        unique = np.unique(points, axis=0)
+        if len(unique) <= self.inducing:
+            return unique
+
+        # Farthest point sampling gives an even cover of the surveyed area
+        chosen = [0]
+        distance = ((unique - unique[0]) ** 2).sum(axis=1)
+        for _ in range(self.inducing - 1):
+            chosen.append(int(np.argmax(distance)))
+            distance = np.minimum(distance, ((unique - unique[chosen[-1]]) ** 2).sum(axis=1))
+        return unique[chosen]
+
+    def _solve(self):
+        """Accumulate Kmn Knm and Kmn y over chunks of the inputs and factorize"""
+        z = self.inducing_points
+        m = len(z)
+        self._noise = self.noise_ratio
+        kmm = rbf_kernel(z, z, self.lengthscale, 1.0) + self.jitter * np.eye(m)
+
+        kmn_knm = np.zeros((m, m))
+        kmn_y = np.zeros((m, self.targets.shape[1]))
+        for start in range(0, len(self.points), self.chunk_size):
+            chunk = self.points[start:start + self.chunk_size]
+            k_mn = rbf_kernel(z, chunk, self.lengthscale, 1.0)
+            kmn_knm += k_mn @ k_mn.T
+            kmn_y += k_mn @ self.targets[start:start + len(chunk)]
+
+        # Sigma = Kmm + Kmn Knm / noise, predictive mean weights alpha = Sigma^-1 Kmn y / noise
+        sigma = kmm + kmn_knm / self._noise
+        self._kmm_chol = np.linalg.cholesky(kmm)
+        self._sigma_chol = np.linalg.cholesky(sigma + self.jitter * np.eye(m))
+        self._alpha = np.linalg.solve(
+            self._sigma_chol.T, np.linalg.solve(self._sigma_chol, kmn_y)
+        ) / self._noise
+
+        # log N(y | 0, Qnn + noise I) via the matrix determinant lemma and Woodbury
+        n, d = self.targets.shape
+        log_det = (
+            2.0 * np.log(np.diag(self._sigma_chol)).sum()
+            - 2.0 * np.log(np.diag(self._kmm_chol)).sum()
+            + n * np.log(self._noise)
+        )
+        projected = np.linalg.solve(self._sigma_chol, kmn_y)
+        quad = ((self.targets ** 2).sum(axis=0) - (projected ** 2).sum(axis=0) / self._noise) / self._noise
+        self._lml = float(-0.5 * (quad.sum() + d * log_det + d * n * np.log(2.0 * np.pi)))
+
+
+def dense_grid(tile_points, step, max_distance):
+    """Sub-tile grid points within max_distance tiles of a surveyed tile"""
+    low = tile_points.min(axis=0)
+    high = tile_points.max(axis=0)
+    xs = np.arange(low[0], high[0] + step / 2, step)
+    ys = np.arange(low[1], high[1] + step / 2, step)
+    grid = np.stack(np.meshgrid(xs, ys, indexing='xy'), axis=-1).reshape(-1, 2)
+
+    # Keep points close to the survey (no extrapolation through walls) and drop the surveyed tiles.
+    # Only grid points around a surveyed tile can qualify, so each tile's neighbourhood on the grid
+    # is visited offset by offset: memory stays O(tiles) instead of O(grid chunk x tiles).
+    keep = np.zeros((len(ys), len(xs)), dtype=bool)
+    surveyed = np.zeros((len(ys), len(xs)), dtype=bool)
+    reach = int(np.ceil(max_distance / step)) + 1
+    base_x = np.rint((tile_points[:, 0] - low[0]) / step).astype(int)
+    base_y = np.rint((tile_points[:, 1] - low[1]) / step).astype(int)
+    for offset_y in range(-reach, reach + 1):
+        for offset_x in range(-reach, reach + 1):
+            ix = base_x + offset_x
+            iy = base_y + offset_y
+            inside = (ix >= 0) & (ix < len(xs)) & (iy >= 0) & (iy < len(ys))
+            ix, iy, points = ix[inside], iy[inside], tile_points[inside]
+            distance = np.sqrt((xs[ix] - points[:, 0]) ** 2 + (ys[iy] - points[:, 1]) ** 2)
+            near = distance <= max_distance
+            keep[iy[near], ix[near]] = True
+            on_tile = distance < 1e-9
+            surveyed[iy[on_tile], ix[on_tile]] = True
+    return grid[(keep & ~surveyed).ravel()]
+
+
+def densify(tile_coordinates, pixel_coordinates, magnetic_data, step=0.25, max_distance=0.75,
+            inducing=500, chunk_size=2048, optimize=True):
+    """Densify a fingerprint map
+
+    Returns:
+        Tuple (tile_coordinates, pixel_coordinates, magnetic_data, model) of the dense map
+    """
+    tiles = tile_coordinates.drop_duplicates(subset=['Location'])
+    samples = magnetic_data.merge(tiles, on='Location')
+    points = samples[['X', 'Y']].to_numpy(dtype=float)
+    values = samples[MAGNETIC_COLUMNS].to_numpy(dtype=float)
+
+    model = SparseGP(inducing=inducing, chunk_size=chunk_size)
+    if optimize:
+        model.optimize(points, values)
+    else:
+        model.fit(points, values)
+
+    grid = dense_grid(np.unique(points, axis=0), step, max_distance)
+    predicted = model.predict(grid)
+    names = [f"{x:g}x{y:g}" for x, y in grid]
+
+    dense_tiles = pd.concat([
+        tiles, pd.DataFrame({'Location': names, 'X': grid[:, 0], 'Y': grid[:, 1]})
+    ], ignore_index=True)
+    dense_magnetic = pd.concat([
+        magnetic_data,
+        pd.DataFrame({'Location': names, 'M_X': predicted[:, 0], 'M_Y': predicted[:, 1], 'M_Z': predicted[:, 2]}),
+    ], ignore_index=True)
+
+    dense_pixels = pixel_coordinates
+    transform = tile_to_pixel_transform(tiles, pixel_coordinates)
+    if transform is not None:
+        pixels = np.column_stack([grid, np.ones(len(grid))]) @ transform
+        dense_pixels = pd.concat([
+            pixel_coordinates,
+            pd.DataFrame({'Location': names, 'X': np.round(pixels[:, 0]), 'Y': np.round(pixels[:, 1])}),
+        ], ignore_index=True)
+
+    return dense_tiles, dense_pixels, dense_magnetic, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Densify a fingerprint map with GP regression")
+    parser.add_argument("--bundle", help="Source map bundle")
+    parser.add_argument("--tiles", help="Locations_&_Tile_Coordinates.csv (instead of --bundle)")
+    parser.add_argument("--pixels", help="Map_Image_Pixel_Coordinates_for_Locations.csv (instead of --bundle)")
+    parser.add_argument("--magnetic", help="Locations_&_Magnetic_Data.csv (instead of --bundle)")
+    parser.add_argument("--step", type=float, default=0.25, help="Grid spacing in tiles")
+    parser.add_argument("--max-distance", type=float, default=0.75,
+                        help="Only predict within this many tiles of a surveyed tile")
+    parser.add_argument("--inducing", type=int, default=500, help="Maximum number of inducing points")
+    parser.add_argument("--chunk-size", type=int, default=2048, help="Rows per kernel chunk")
+    parser.add_argument("--no-optimize", action="store_true", help="Skip the hyperparameter search")
+    parser.add_argument("--name", help="Map name stored in the metadata")
+    parser.add_argument("-o", "--output", required=True, help="Output bundle path")
+    args = parser.parse_args()
+
+    if args.bundle:
+        bundle = MapBundle.open(args.bundle)
+        if bundle.is_delta:
+            parser.error("densify a full bundle (resolve the variant first)")
+        tiles, pixels, magnetic = bundle.tile_coordinates(), bundle.pixel_coordinates(), bundle.magnetic_data()
+        source = bundle.metadata.get("name") or os.path.basename(args.bundle)
+        image = bundle.metadata.get("image")
+        if image:
+            image = resolve_bundle_path(image, args.bundle)
+    elif args.tiles and args.pixels and args.magnetic:
+        tiles, pixels, magnetic = pd.read_csv(args.tiles), pd.read_csv(args.pixels), pd.read_csv(args.magnetic)
+        source = os.path.basename(args.magnetic)
+        image = None
+    else:
+        parser.error("give --bundle or --tiles, --pixels and --magnetic")
+
+    dense_tiles, dense_pixels, dense_magnetic, model = densify(
+        tiles, pixels, magnetic, args.step, args.max_distance, args.inducing, args.chunk_size,
+        optimize=not args.no_optimize,
+    )
+
+    metadata = {
+        "name": args.name or f"{source} (dense)",
+        "densified": {
+            "source": source,
+            "step": args.step,
+            "lengthscale": model.lengthscale,
+            "noise_ratio": model.noise_ratio,
+            "inducing_points": len(model.inducing_points),
+            "log_marginal_likelihood": model.log_marginal_likelihood(),
+        },
+    }
+    if image:
+        # Stored relative to the output bundle, like the source bundle stored it relative to itself
+        metadata["image"] = bundle_relative_path(image, args.output)
+    write_bundle(args.output, dense_tiles, dense_pixels, dense_magnetic, metadata)
+    print(f"Wrote {args.output}: {len(dense_magnetic) - len(magnetic)} interpolated fingerprints, "
+          f"lengthscale {model.lengthscale}, noise ratio {model.noise_ratio}")
+
+
+if __name__ == "__main__":
+    main()
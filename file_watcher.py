@@ -0,0 +1,81 @@
+import os
+import threading
+
+
+class FileWatcher:
+    """Polls a set of files and reports the ones that changed
+
+    A change is only reported once the file's size and modification time have
+    been stable for one extra poll, so a file that is still being written (e.g.
+    a CSV saved from a spreadsheet) is not picked up half way.
+    """
+
+    def __init__(self, callback, paths=(), interval=1.0):
+        """Initialize the watcher
+
+        Args:
+            callback: Called from the watcher thread with the path of a changed file
+            paths: Files to watch (they don't need to exist yet)
+            interval: Seconds between polls
+        """
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """Replace the watched files, their current state counts as unchanged"""
+        with self._lock:
+            self._stats = {path: self._stat(path) for path in paths}
+            self._pending = {}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self):
+        """Check the files once, returns the paths reported as changed"""
+        changed = []
+        with self._lock:
+            for path, known in self._stats.items():
+                current = self._stat(path)
+                if current == known:
+                    self._pending.pop(path, None)
+                    continue
+                # Wait until the file stopped changing
+                if self._pending.get(path) != current:
+                    self._pending[path] = current
+                    continue
+                self._stats[path] = current
+                del self._pending[path]
+                if current is not None:
+                    changed.append(path)
+
+        for path in changed:
+            try:
+                self.callback(path)
+            except Exception as e:
+                print(f"Error handling change of {path}: {str(e)}")
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
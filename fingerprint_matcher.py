@@ -0,0 +1,407 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from change_log import ChangeLog
+from metric import QuadraticMetric
+
+# Per-axis weights of the "Weighted Average" algorithm (emphasize X and Y over Z)
+WEIGHTED_AVERAGE_WEIGHTS = np.array([1.5, 1.5, 0.7])
+
+MAGNETIC_COLUMNS = ['M_X', 'M_Y', 'M_Z']
+
+# Elements of the (queries, rows, 3) difference block computed at once by closest_batch
+BATCH_BLOCK_ELEMENTS = 1 << 22
+
+# Algorithm name -> quadratic metric, matched as Euclidean distance in the transformed space
+METRICS = {
+    "Weighted Average": QuadraticMetric.diagonal(WEIGHTED_AVERAGE_WEIGHTS, "weighted average"),
+}
+
+
+def register_metric(algorithm, metric):
+    """Make a quadratic metric available as a matching algorithm"""
+    METRICS[algorithm] = metric
+
+
+class FingerprintMatcher:
+    """Vectorized nearest-fingerprint matcher over a contiguous fingerprint array
+
+    Every fingerprint lives in a numbered row of a preallocated array. Rows are
+    stable: updating a fingerprint rewrites its row in place, deleting one only
+    marks the row free for reuse, and appending grows the array by doubling, so
+    edits cost amortized O(1) and never reshuffle the other rows. The reference
+    DataFrame (:meth:`frame`) uses the row numbers as its index, so a template
+    window (a filtered view of it) can be matched by passing its index as ``rows``.
+    Edits cost O(1) on the derived data as well: the sorted live rows are
+    recompacted from the ``alive`` mask when next read, and the cached reference
+    frame is patched in place for updates (and for freed rows that are reused)
+    while added and removed rows are applied to it in one pass on its next use.
+    The edited locations are logged (:meth:`changes_since`) for caches derived
+    per location.
+
+    Quadratic metrics (see :data:`METRICS`) are matched on a copy of the rows
+    transformed by the metric's whitening transform, created on first use and
+    kept in sync row by row on edits.
+    """
+
+    def __init__(self, ref_data):
+        """Build the matcher
+
+        Args:
+            ref_data: DataFrame with Location, M_X, M_Y, M_Z and a default RangeIndex
+        """
+        count = len(ref_data)
+        capacity = max(16, count)
+        fingerprints = np.zeros((capacity, 3), dtype=float)
+        fingerprints[:count] = ref_data[MAGNETIC_COLUMNS].to_numpy(dtype=float)
+        locations = np.empty(capacity, dtype=object)
+        locations[:count] = ref_data['Location'].to_numpy(dtype=object)
+        self._adopt(fingerprints, locations, count)
+
+    @classmethod
+    def from_arrays(cls, fingerprints, locations):
+        """Build a matcher on existing arrays without copying them
+
+        The fingerprint array is used as the row storage directly, so a
+        copy-on-write memory map of a bundle stays shared with other maps
+        until rows are edited.
+
+        Args:
+            fingerprints: Writable (N, 3) float array
+            locations: Location name of every row
+        """
+        matcher = cls.__new__(cls)
+        matcher._adopt(fingerprints, np.asarray(locations, dtype=object), len(fingerprints))
+        return matcher
+
+    def __len__(self):
+        return self.size - len(self._free_rows)
+
+    def add(self, location, vector):
+        """Add a fingerprint for a location, returns its row"""
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            if self.size == len(self.fingerprints):
+                self._grow()
+            row = self.size
+            self.size += 1
+        self.fingerprints[row] = vector
+        self._transform_row(row)
+        self.locations[row] = location
+        self.alive[row] = True
+        self.rows_by_location.setdefault(location, []).append(row)
+        self._live_rows = None
+        if self._frame is not None:
+            if row in self._frame_removed:
+                # Freed and reused before the frame caught up: the row is still in it
+                self._frame_removed.discard(row)
+                self._patch_frame(row)
+            else:
+                self._frame_added.add(row)
+        self._changed(location)
+        return row
+
+    def update(self, row, vector):
+        """Overwrite the fingerprint in a row"""
+        if not self.alive[row]:
+            raise KeyError(f"Fingerprint row {row} does not exist")
+        self.fingerprints[row] = vector
+        self._transform_row(row)
+        if self._frame is not None and row not in self._frame_added:
+            self._patch_frame(row)
+        self._changed(self.locations[row])
+
+    def remove(self, row):
+        """Delete the fingerprint in a row"""
+        if not self.alive[row]:
+            raise KeyError(f"Fingerprint row {row} does not exist")
+        location = self.locations[row]
+        rows = self.rows_by_location[location]
+        rows.remove(row)
+        if not rows:
+            del self.rows_by_location[location]
+        self.alive[row] = False
+        self.locations[row] = None
+        self._free_rows.append(row)
+        self._live_rows = None
+        if self._frame is not None:
+            if row in self._frame_added:
+                self._frame_added.discard(row)
+            else:
+                self._frame_removed.add(row)
+        self._changed(location)
+
+    def set_location(self, location, vectors):
+        """Replace all fingerprints of a location (rows are reused in place)
+
+        Args:
+            location: Location name
+            vectors: Sequence of [x, y, z] fingerprints, empty to delete the location
+        """
+        vectors = np.asarray(vectors, dtype=float).reshape(-1, 3)
+        rows = list(self.rows_by_location.get(location, []))
+        for row, vector in zip(rows, vectors):
+            self.update(row, vector)
+        for row in rows[len(vectors):]:
+            self.remove(row)
+        for vector in vectors[len(rows):]:
+            self.add(location, vector)
+
+    def remove_location(self, location):
+        """Delete all fingerprints of a location"""
+        self.set_location(location, [])
+
+    def rows_for(self, locations):
+        """Sorted rows of all fingerprints of the given locations"""
+        rows = []
+        for location in locations:
+            rows.extend(self.rows_by_location.get(location, ()))
+        return np.array(sorted(rows), dtype=np.intp)
+
+    def changes_since(self, version):
+        """Locations edited after a version, or None if the change log no longer reaches back that far"""
+        return self.changes.since(version, self.version)
+
+    def live_rows(self):
+        """Sorted rows that hold a fingerprint (recompacted from the alive mask after edits)"""
+        if self._live_rows is None:
+            self._live_rows = np.flatnonzero(self.alive[:self.size])
+        return self._live_rows
+
+    def frame(self, rows=None):
+        """Reference data as a DataFrame indexed by row (all rows, or the given ones)"""
+        if rows is None:
+            if self._frame is None:
+                self._frame = self._build_frame(self.live_rows())
+            elif self._frame_added or self._frame_removed:
+                self._apply_frame_edits()
+            return self._frame
+        return self._build_frame(np.asarray(rows, dtype=np.intp))
+
+    def distances(self, vector, algorithm, rows=None):
+        """Distance from a measurement to every (selected) fingerprint
+
+        Args:
+            vector: Measured [x, y, z] magnetic field
+            algorithm: One of the distance-based algorithm names of the GUI
+            rows: Optional array of row positions to restrict the search to
+
+        Returns:
+            Array of distances, aligned with ``rows`` (or :meth:`live_rows`)
+        """
+        if rows is None:
+            rows = self.live_rows()
+
+        metric = METRICS.get(algorithm)
+        if metric is not None:
+            # Euclidean distance in the metric's whitened space
+            diff = self._space(algorithm, metric)[rows] - metric.apply(vector)
+        else:
+            diff = self.fingerprints[rows] - np.asarray(vector, dtype=float)
+
+        if algorithm == "Manhattan Distance":
+            return np.abs(diff).sum(axis=1)
+        # Euclidean Distance, KNN (K=3) and the quadratic metrics rank by Euclidean distance
+        return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def closest(self, vector, algorithm, rows=None):
+        """Name of the best matching location for a measurement"""
+        rows = self.live_rows() if rows is None else np.asarray(rows, dtype=np.intp)
+        if len(rows) == 0:
+            return None
+
+        distances = self.distances(vector, algorithm, rows)
+        locations = self.locations[rows]
+
+        # For KNN, return the most common location among the k=3 nearest neighbors
+        if algorithm == "KNN (K=3)" and len(distances) >= 3:
+            nearest = np.argsort(distances, kind='stable')[:3]
+            return Counter(locations[nearest]).most_common(1)[0][0]
+
+        # For other algorithms, just return the closest location
+        return locations[int(np.argmin(distances))]
+
+    def closest_batch(self, vectors, algorithm, rows=None):
+        """Best matching locations of many measurements in one matrix computation
+
+        Queries restricted to (template window) rows are matched as one flat
+        list of (query, row) pairs, reduced per query with segmented minima.
+        Unrestricted queries are matched against all live rows in blocks,
+        keeping a running top k per query, so memory stays bounded for any
+        map size.
+
+        Args:
+            vectors: (M, 3) measurements
+            algorithm: One of the distance-based algorithm names of the GUI
+            rows: Optional list with an array of candidate rows per measurement (None: all live rows)
+
+        Returns:
+            List of location names, None where a query has no candidate rows
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=float))
+        if rows is None:
+            rows = [None] * len(vectors)
+        k = 3 if algorithm == "KNN (K=3)" else 1
+        results = [None] * len(vectors)
+
+        metric = METRICS.get(algorithm)
+        if metric is not None:
+            space = self._space(algorithm, metric)
+            vectors = metric.apply(vectors)
+        else:
+            space = self.fingerprints
+        manhattan = algorithm == "Manhattan Distance"
+
+        def distance(diff):
+            # Squared Euclidean distance ranks like the Euclidean distance
+            return np.abs(diff).sum(axis=-1) if manhattan else np.einsum('...i,...i->...', diff, diff)
+
+        # Template window queries: all (query, row) pairs at once
+        windowed = [i for i, r in enumerate(rows) if r is not None and len(r) > 0]
+        if windowed:
+            window_rows = [np.asarray(rows[i], dtype=np.intp) for i in windowed]
+            lengths = np.array([len(r) for r in window_rows])
+            flat_rows = np.concatenate(window_rows)
+            owners = np.repeat(np.arange(len(windowed)), lengths)
+            distances = distance(space[flat_rows] - vectors[windowed][owners])
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+            # k passes of "first minimum of every segment" (ties keep the row order like closest())
+            nearest = np.full((len(windowed), k), -1, dtype=np.intp)
+            for rank in range(k):
+                minima = np.minimum.reduceat(distances, starts)
+                hits = np.flatnonzero((distances == np.repeat(minima, lengths)) & np.isfinite(distances))
+                hit_owners = owners[hits]
+                first = np.ones(len(hits), dtype=bool)
+                first[1:] = hit_owners[1:] != hit_owners[:-1]
+                hits = hits[first]
+                nearest[owners[hits], rank] = flat_rows[hits]
+                distances[hits] = np.inf
+            for position, found in zip(windowed, nearest):
+                results[position] = self._vote(found[found >= 0], k)
+
+        # Whole-map queries: blocks of rows, running top k
+        unrestricted = [i for i, r in enumerate(rows) if r is None]
+        live = self.live_rows() if unrestricted else None
+        if unrestricted and len(live):
+            queries = vectors[unrestricted]
+            best_distances = np.full((len(queries), k), np.inf)
+            best_rows = np.full((len(queries), k), -1, dtype=np.intp)
+            block_size = max(1, BATCH_BLOCK_ELEMENTS // (3 * len(queries)))
+            for start in range(0, len(live), block_size):
+                block = live[start:start + block_size]
+                distances = distance(space[block][None, :, :] - queries[:, None, :])
+                if distances.shape[1] > k:
+                    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                else:
+                    top = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+                merged_distances = np.concatenate([best_distances, np.take_along_axis(distances, top, axis=1)], axis=1)
+                merged_rows = np.concatenate([best_rows, block[top]], axis=1)
+                order = np.argsort(merged_distances, axis=1, kind='stable')[:, :k]
+                best_distances = np.take_along_axis(merged_distances, order, axis=1)
+                best_rows = np.take_along_axis(merged_rows, order, axis=1)
+            for position, found in zip(unrestricted, best_rows):
+                results[position] = self._vote(found[found >= 0], k)
+        return results
+
+    def _vote(self, nearest, k):
+        """Location of the nearest rows (closest first): the nearest one, or the KNN majority"""
+        if len(nearest) == 0:
+            return None
+        if k == 3 and len(nearest) >= 3:
+            # Most common location among the 3 nearest neighbors
+            return Counter(self.locations[nearest]).most_common(1)[0][0]
+        return self.locations[nearest[0]]
+
+    def _adopt(self, fingerprints, locations, count):
+        self.fingerprints = fingerprints
+        self.locations = locations
+        self.alive = np.zeros(len(fingerprints), dtype=bool)
+        self.alive[:count] = True
+
+        # High-water mark of used rows, rows freed by deletes are reused first
+        self.size = count
+        self._free_rows = []
+        self.rows_by_location = {}
+        for row, location in enumerate(self.locations[:count]):
+            self.rows_by_location.setdefault(location, []).append(row)
+
+        # Bumped on every edit, the edited locations are logged for per-location caches
+        self.version = 0
+        self.changes = ChangeLog()
+        self._live_rows = None
+        # Reference frame, and the rows added to and removed from the matcher since it was last brought up to date
+        self._frame = None
+        self._frame_added = set()
+        self._frame_removed = set()
+
+        # Algorithm name -> (metric, transformed fingerprints)
+        self._spaces = {}
+
+    def _build_frame(self, rows):
+        fingerprints = self.fingerprints[rows]
+        return pd.DataFrame({
+            'Location': self.locations[rows],
+            'M_X': fingerprints[:, 0],
+            'M_Y': fingerprints[:, 1],
+            'M_Z': fingerprints[:, 2],
+        }, index=rows)
+
+    def _patch_frame(self, row):
+        """Write a row of the arrays into the cached reference frame"""
+        self._frame.at[row, 'Location'] = self.locations[row]
+        for column, value in zip(MAGNETIC_COLUMNS, self.fingerprints[row]):
+            self._frame.at[row, column] = value
+
+    def _apply_frame_edits(self):
+        """Drop the removed rows from the cached reference frame and append the added ones, in one pass"""
+        frame = self._frame
+        if self._frame_removed:
+            frame = frame.drop(index=list(self._frame_removed))
+        if self._frame_added:
+            added = self._build_frame(np.array(sorted(self._frame_added), dtype=np.intp))
+            if frame.empty:
+                frame = added
+            else:
+                # Reused rows land between the others, keep the index sorted like live_rows
+                ordered = added.index[0] > frame.index[-1]
+                frame = pd.concat([frame, added])
+                if not ordered:
+                    frame = frame.sort_index()
+        self._frame = frame
+        self._frame_added.clear()
+        self._frame_removed.clear()
+
+    def _grow(self):
+        """Double the capacity of the row arrays"""
+        capacity = max(16, len(self.fingerprints) * 2)
+        fingerprints = np.zeros((capacity, 3), dtype=float)
+        fingerprints[:self.size] = self.fingerprints[:self.size]
+        locations = np.empty(capacity, dtype=object)
+        locations[:self.size] = self.locations[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.fingerprints, self.locations, self.alive = fingerprints, locations, alive
+        for algorithm, (metric, space) in self._spaces.items():
+            grown = np.zeros((capacity, 3), dtype=float)
+            grown[:self.size] = space[:self.size]
+            self._spaces[algorithm] = (metric, grown)
+
+    def _space(self, algorithm, metric):
+        """Fingerprints transformed by a metric, computed once per metric"""
+        cached = self._spaces.get(algorithm)
+        if cached is None or cached[0] is not metric:
+            cached = (metric, metric.apply(self.fingerprints))
+            self._spaces[algorithm] = cached
+        return cached[1]
+
+    def _transform_row(self, row):
+        for metric, space in self._spaces.values():
+            space[row] = metric.apply(self.fingerprints[row])
+
+    def _changed(self, location):
+        self.version += 1
+        self.changes.record(self.version, location)
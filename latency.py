@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+
+# Significant bits kept per value: values are bucketed with at most 1/64 (~1.6%) relative error
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+# Stages of the sample pipeline, in order
+PIPELINE_STAGES = ("read", "parse", "select", "match", "filter", "queue", "render", "pipeline", "end_to_end",
+                   "stop_command")
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of integer latencies (nanoseconds)
+
+    Values below 128 get their own bucket; above that every power of two is
+    split into 64 linear buckets, so any value is recorded with a bounded
+    relative error in O(1) without storing the samples. Recording is meant to
+    be done by a single thread per histogram; reading from another thread may
+    see a sample count that is off by one, which is fine for statistics.
+    """
+
+    def __init__(self, max_value_ns=60 * 10 ** 9):
+        """Initialize the histogram
+
+        Args:
+            max_value_ns: Largest value that is recorded exactly, larger values are clamped
+        """
+        self.max_value_ns = max_value_ns
+        self.counts = [0] * (self._index(max_value_ns) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        """Bucket index of a non-negative integer value"""
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _bucket_value(index):
+        """Largest value falling into a bucket"""
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = index // SUB_BUCKET_HALF - 1
+        mantissa = index - shift * SUB_BUCKET_HALF
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value_ns):
+        """Record one latency"""
+        value_ns = min(max(int(value_ns), 0), self.max_value_ns)
+        self.counts[self._index(value_ns)] += 1
+        self.count += 1
+        self.total += value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    def percentile(self, p):
+        """Value at a percentile (0-100), 0 if nothing was recorded"""
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(p / 100.0 * self.count + 0.5 - 1e-9)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def cumulative(self, bounds_ns):
+        """Number of recorded values <= each of the ascending bounds (bucket resolution)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds_ns:
+            while index < len(self.counts) and self._bucket_value(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same range"""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Count, mean, min, max and percentiles in milliseconds"""
+        summary = {
+            "count": self.count,
+            "mean_ms": self.mean() / 1e6,
+            "min_ms": (self.min or 0) / 1e6,
+            "max_ms": self.max / 1e6,
+        }
+        for p in percentiles:
+            summary[f"p{p:g}_ms"] = self.percentile(p) / 1e6
+        return summary
+
+
+class PipelineStats:
+    """Per-stage latency histograms of the sample pipeline
+
+    Disabled by default: callers check ``enabled`` once per sample and skip all
+    timestamping when it is off, so the pipeline only pays one attribute load.
+    Stages that must always be tracked (the stop command) are recorded
+    regardless of ``enabled``. Timestamps are ``time.perf_counter_ns`` (monotonic).
+    """
+
+    def __init__(self, stages=PIPELINE_STAGES, enabled=False):
+        self.enabled = enabled
+        self.stages = tuple(stages)
+        self.histograms = {stage: LatencyHistogram() for stage in self.stages}
+        # Matching latency per algorithm
+        self.algorithms = {}
+        # Stage -> budget in ns, and the number of recorded latencies above it
+        self.budgets = {}
+        self.over_budget = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def now():
+        return time.perf_counter_ns()
+
+    def set_budget(self, stage, budget_ms):
+        """Count latencies of a stage above a budget (None removes the budget)"""
+        if budget_ms is None:
+            self.budgets.pop(stage, None)
+        else:
+            self.budgets[stage] = int(budget_ms * 1e6)
+            self.over_budget.setdefault(stage, 0)
+
+    def record(self, stage, start_ns, end_ns=None):
+        """Record the time from start_ns to end_ns (default: now) for a stage
+
+        Returns:
+            The latency in ns if it exceeded the stage's budget, otherwise None
+        """
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+                if stage not in self.stages:
+                    self.stages += (stage,)
+        latency = end_ns - start_ns
+        histogram.record(latency)
+        budget = self.budgets.get(stage)
+        if budget is not None and latency > budget:
+            self.over_budget[stage] += 1
+            return latency
+        return None
+
+    def record_algorithm(self, algorithm, start_ns, end_ns):
+        """Record the matching latency of an algorithm"""
+        histogram = self.algorithms.get(algorithm)
+        if histogram is None:
+            with self._lock:
+                histogram = self.algorithms.setdefault(algorithm, LatencyHistogram())
+        histogram.record(end_ns - start_ns)
+
+    def reset(self):
+        for histogram in list(self.histograms.values()) + list(self.algorithms.values()):
+            histogram.reset()
+        self.over_budget = {stage: 0 for stage in self.budgets}
+        self.started = time.time()
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES):
+        """Summaries of all stages that recorded something"""
+        snapshot = {
+            stage: self.histograms[stage].summary(percentiles)
+            for stage in self.stages if self.histograms[stage].count
+        }
+        for stage, budget in self.budgets.items():
+            if stage in snapshot:
+                snapshot[stage]["budget_ms"] = budget / 1e6
+                snapshot[stage]["over_budget"] = self.over_budget[stage]
+        return snapshot
+
+    def format_table(self, percentiles=DEFAULT_PERCENTILES):
+        """Fixed-width text table of the stage summaries"""
+        header = f"{'stage':<13}{'count':>8}" + "".join(f"{f'p{p:g}':>9}" for p in percentiles) + f"{'max':>9}"
+        lines = [header + "   (ms)"]
+        for stage, summary in self.snapshot(percentiles).items():
+            cells = "".join(f"{summary[f'p{p:g}_ms']:9.3f}" for p in percentiles)
+            lines.append(f"{stage:<13}{summary['count']:>8}{cells}{summary['max_ms']:9.3f}")
+        if len(lines) == 1:
+            lines.append("(no samples recorded)")
+        for stage, budget in self.budgets.items():
+            count = self.histograms[stage].count
+            if count:
+                lines.append(f"{stage} over {budget / 1e6:g} ms budget: {self.over_budget[stage]} of {count}")
+        return "\n".join(lines)
+
+    def dump(self, path, percentiles=DEFAULT_PERCENTILES):
+        """Write the summaries and the raw non-empty buckets as JSON"""
+        data = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "dumped": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "stages": self.snapshot(percentiles),
+            "buckets_ns": {
+                stage: {
+                    str(LatencyHistogram._bucket_value(i)): c
+                    for i, c in enumerate(self.histograms[stage].counts) if c
+                }
+                for stage in self.stages if self.histograms[stage].count
+            },
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,426 @@
+"""Local localization server with micro-batched matching
+
+Thin clients (robots, bridges forwarding their serial lines) connect over TCP
+or a Unix socket and send one JSON object per line:
+
+    {"robot": "r1", "id": 7, "m": [12.5, -3.1, 40.2]}
+    {"robot": "r1", "id": 8, "line": "12.50,-3.10,40.20"}      raw serial line
+    {"robot": "r1", "start": "data_location_12"}                 seed the robot's last location
+    {"robot": "r1", "reset": true}                               forget the robot's state
+    {"stats": true}                                              server counters
+
+and get one JSON object per line back (in completion order, match by id;
+"batch" is the number of samples matched together with this one):
+
+    {"robot": "r1", "id": 7, "location": "data_location_14", "tile": [3.0, 2.0], "batch": 12}
+
+Requests arriving within the batch window are matched together: every robot
+keeps its own template window and filter state, and the distance-based
+algorithms of a batch run as one vectorized computation
+(FingerprintMatcher.closest_batch), so throughput grows with the load.
+
+    python localization_server.py --bundle maps/office.magmap --port 8765
+    python localization_server.py --tiles t.csv --pixels p.csv --magnetic m.csv --unix /tmp/maglocal.sock
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from fingerprint_matcher import METRICS, register_metric
+from map_catalog import LoadedMap
+from metric import QuadraticMetric
+from particle_filter import ParticleFilter
+from serial_parser import parse_serial_line
+from tile_models import MODEL_ALGORITHMS
+
+DISTANCE_ALGORITHMS = ("Euclidean Distance", "Manhattan Distance", "KNN (K=3)")
+
+# Short names accepted from clients
+ALGORITHM_ALIASES = {
+    "euclidean": "Euclidean Distance",
+    "manhattan": "Manhattan Distance",
+    "weighted": "Weighted Average",
+    "knn": "KNN (K=3)",
+    "mahalanobis": "Mahalanobis Distance",
+    "likelihood": "Max Likelihood",
+    "particle": "Particle Filter",
+}
+
+
+class RobotState:
+    """Localization state of one client robot"""
+
+    def __init__(self, matched_location=''):
+        self.matched_location = matched_location
+        self.particle_filter = None
+        self.last_filtered_data_size = 0
+        self.requests = 0
+
+
+class LocalizationEngine:
+    """Matches batches of tagged samples against one map, keeping per-robot state"""
+
+    def __init__(self, loaded, algorithm="Euclidean Distance", template_size=5):
+        """Initialize the engine
+
+        Args:
+            loaded: LoadedMap to localize on
+            algorithm: Algorithm used when a request doesn't name one
+            template_size: Template window half size around each robot's last match
+        """
+        self.loaded = loaded
+        self.algorithm = self.resolve_algorithm(algorithm)
+        self.template_size = template_size
+        self.robots = {}
+
+        # Counters
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.busy_seconds = 0.0
+
+    @staticmethod
+    def resolve_algorithm(name):
+        """GUI algorithm name for a name or alias
+
+        Raises:
+            ValueError: For unknown algorithms
+        """
+        name = ALGORITHM_ALIASES.get(str(name).lower(), name)
+        if name in DISTANCE_ALGORITHMS or name in METRICS or name in MODEL_ALGORITHMS or name == "Particle Filter":
+            return name
+        raise ValueError(f"Unknown algorithm '{name}'")
+
+    def stats(self):
+        return {
+            "robots": len(self.robots),
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": self.requests / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "map": self.loaded.name,
+            "fingerprints": len(self.loaded.matcher),
+        }
+
+    def process(self, requests):
+        """Answer a batch of requests
+
+        A robot's samples are processed in order: its n-th request of the batch
+        is matched in the n-th round, after its earlier ones updated its window.
+
+        Returns:
+            List of response dicts, aligned with the requests
+        """
+        start = time.perf_counter()
+        responses = [None] * len(requests)
+        rounds = defaultdict(list)
+        seen = defaultdict(int)
+        for i, request in enumerate(requests):
+            robot = str(request.get("robot", "default"))
+            rounds[seen[robot]].append(i)
+            seen[robot] += 1
+
+        for round_number in sorted(rounds):
+            self._process_round(requests, rounds[round_number], responses)
+
+        self.requests += len(requests)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(requests))
+        self.busy_seconds += time.perf_counter() - start
+        return responses
+
+    def _process_round(self, requests, indices, responses):
+        """Match requests of distinct robots together"""
+        loaded = self.loaded
+        groups = defaultdict(list)
+        for i in indices:
+            request = requests[i]
+            robot = str(request.get("robot", "default"))
+            response = {"robot": robot}
+            if "id" in request:
+                response["id"] = request["id"]
+            responses[i] = response
+            try:
+                if request.get("reset"):
+                    self.robots.pop(robot, None)
+                    response["reset"] = True
+                    continue
+
+                state = self.robots.get(robot)
+                if state is None:
+                    state = self.robots[robot] = RobotState()
+                if "start" in request:
+                    if request["start"] not in loaded.location_table:
+                        raise ValueError(f"Unknown location '{request['start']}'")
+                    state.matched_location = request["start"]
+                    state.particle_filter = None
+                    if "m" not in request and "line" not in request:
+                        response["location"] = state.matched_location
+                        continue
+
+                if "line" in request:
+                    vector = parse_serial_line(str(request["line"]))[:3]
+                else:
+                    vector = [float(value) for value in request["m"]][:3]
+                if len(vector) < 3:
+                    raise ValueError("A sample needs three values")
+                algorithm = self.resolve_algorithm(request.get("algorithm", self.algorithm))
+                size = int(request.get("template_size", self.template_size))
+
+                # Template window around the robot's last match
+                window = None
+                if state.matched_location:
+                    window = loaded.template_service.window(state.matched_location, size)
+                groups[algorithm].append((i, state, vector, window))
+            except (KeyError, TypeError, ValueError) as e:
+                response["error"] = str(e)
+
+        for algorithm, group in groups.items():
+            if algorithm in DISTANCE_ALGORITHMS or algorithm in METRICS:
+                # One vectorized computation for the whole group
+                vectors = [vector for _, _, vector, _ in group]
+                rows = [None if window is None else window.rows for _, _, _, window in group]
+                locations = loaded.matcher.closest_batch(vectors, algorithm, rows)
+            else:
+                locations = [self._match_one(algorithm, state, vector, window) for _, state, vector, window in group]
+
+            for (i, state, _, _), location in zip(group, locations):
+                response = responses[i]
+                response["location"] = location
+                response["algorithm"] = algorithm
+                response["batch"] = len(group)
+                if location is not None:
+                    state.matched_location = location
+                    tile = loaded.location_table.tile(location)
+                    response["tile"] = list(tile) if tile is not None else None
+                state.requests += 1
+
+    def _match_one(self, algorithm, state, vector, window):
+        """Stateful or per-location-model algorithms, one sample at a time"""
+        if algorithm == "Particle Filter":
+            filtered_data = window.fingerprints if window is not None else self.loaded.ref_data
+            if state.particle_filter is None or len(filtered_data) != state.last_filtered_data_size:
+                state.particle_filter = ParticleFilter(filtered_data, num_particles=200, sensor_noise=2.0,
+                                                       motion_noise=2.0)
+                state.last_filtered_data_size = len(filtered_data)
+            return state.particle_filter.update(vector)
+        names = pd.unique(self.loaded.matcher.locations[window.rows]) if window is not None else None
+        return self.loaded.tile_models.closest(vector, algorithm, names)
+
+
+class LocalizationServer:
+    """asyncio line-JSON server feeding a LocalizationEngine in micro-batches"""
+
+    def __init__(self, engine, host="127.0.0.1", port=8765, unix_path=None, batch_window_ms=2.0, max_batch=256):
+        """Initialize the server
+
+        Args:
+            engine: LocalizationEngine answering the requests
+            host: TCP host to listen on (None: no TCP listener)
+            port: TCP port to listen on
+            unix_path: Unix socket path to listen on as well, if any
+            batch_window_ms: How long the first request of a batch waits for more
+            max_batch: Largest number of requests matched together
+        """
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.connections = 0
+
+        # Matching runs on one worker thread; the next batch fills up meanwhile
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._servers = []
+
+    async def start(self):
+        """Start listening and batching"""
+        self._queue = asyncio.Queue()
+        if self.host is not None:
+            server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self._servers.append(await asyncio.start_unix_server(self._handle_client, self.unix_path))
+        self._batcher = asyncio.ensure_future(self._run_batches())
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in self._servers))
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    async def _handle_client(self, reader, writer):
+        """Read requests of one connection and write their responses as they complete"""
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+
+        def reply(response):
+            if not writer.is_closing():
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Requests must be JSON objects")
+                except ValueError as e:
+                    reply({"error": f"Invalid request: {str(e)}"})
+                    continue
+
+                if request.get("stats"):
+                    reply({"stats": {**self.engine.stats(), "connections": self.connections,
+                                     "queued": self._queue.qsize()}})
+                    continue
+
+                future = loop.create_future()
+                future.add_done_callback(lambda f: reply(f.result()) if not f.cancelled() else None)
+                self._queue.put_nowait((request, future))
+
+                # Keep the socket buffer from growing when a client doesn't read
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _run_batches(self):
+        """Collect requests for one batch window, then match them together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                responses = await loop.run_in_executor(self._executor, self.engine.process, requests)
+            except Exception as e:
+                responses = []
+                for request, _ in batch:
+                    response = {"robot": str(request.get("robot", "default")), "error": f"Engine error: {str(e)}"}
+                    if "id" in request:
+                        response["id"] = request["id"]
+                    responses.append(response)
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+
+class LocalizationClient:
+    """Blocking line-JSON client, e.g. for a robot bridge or tests"""
+
+    def __init__(self, host="127.0.0.1", port=8765, unix_path=None, timeout=5.0):
+        if unix_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_path)
+        else:
+            self.sock = socket.create_connection((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self._file = self.sock.makefile("rb")
+
+    def send(self, request):
+        self.sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+    def receive(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+    def request(self, request):
+        """Send one request and wait for its response"""
+        self.send(request)
+        return self.receive()
+
+    def locate(self, robot, vector, **options):
+        return self.request({"robot": robot, "m": list(vector), **options})
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve magnetic localization to many clients")
+    parser.add_argument("--bundle", help="Map bundle (.magmap) to localize on")
+    parser.add_argument("--tiles", help="Locations_&_Tile_Coordinates.csv (without a bundle)")
+    parser.add_argument("--pixels", help="Map_Image_Pixel_Coordinates_for_Locations.csv (without a bundle)")
+    parser.add_argument("--magnetic", help="Locations_&_Magnetic_Data.csv (without a bundle)")
+    parser.add_argument("--metric", help="Learned metric JSON, offered as 'Learned Metric'")
+    parser.add_argument("--algorithm", default="Euclidean Distance", help="Default algorithm (name or alias)")
+    parser.add_argument("--template-size", type=int, default=5, help="Template window half size")
+    parser.add_argument("--gmm-components", type=int, default=0,
+                        help="Gaussian mixture components per well-surveyed location (model algorithms)")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--no-tcp", action="store_true", help="Only listen on the Unix socket")
+    parser.add_argument("--unix", help="Also listen on this Unix socket path")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="Micro-batch window")
+    parser.add_argument("--max-batch", type=int, default=256, help="Largest batch")
+    args = parser.parse_args()
+
+    if args.bundle:
+        loaded = LoadedMap.from_bundle(os.path.splitext(os.path.basename(args.bundle))[0], args.bundle,
+                                       args.gmm_components)
+    elif args.tiles and args.pixels and args.magnetic:
+        loaded = LoadedMap("csv", pd.read_csv(args.tiles), pd.read_csv(args.pixels), pd.read_csv(args.magnetic),
+                           gmm_components=args.gmm_components)
+    else:
+        parser.error("Give --bundle or --tiles, --pixels and --magnetic")
+    if args.metric:
+        register_metric("Learned Metric", QuadraticMetric.load(args.metric))
+
+    engine = LocalizationEngine(loaded, args.algorithm, args.template_size)
+    server = LocalizationServer(engine, None if args.no_tcp else args.host, args.port, args.unix,
+                                args.batch_window_ms, args.max_batch)
+    listening = [] if args.no_tcp else [f"{args.host}:{args.port}"]
+    listening += [args.unix] if args.unix else []
+    print(f"Serving {loaded.name} ({len(loaded.matcher)} fingerprints) on {', '.join(listening)}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
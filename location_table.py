@@ -0,0 +1,222 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from change_log import ChangeLog
+
+# One row of the table: tile grid position and map image pixel position of a location
+LocationEntry = namedtuple("LocationEntry", ["name", "label", "tile_x", "tile_y", "pixel_x", "pixel_y"])
+
+
+def location_label(location_name):
+    """Short label for a location name (e.g. 'data_location_12' -> '12')"""
+    return location_name.split('_')[-1] if '_' in location_name else location_name
+
+
+def tile_to_pixel_transform(tile_coordinates, pixel_coordinates):
+    """Least-squares affine map from tile to map pixel coordinates
+
+    Returns:
+        (3, 2) array: [tile x, tile y, 1] @ transform = [pixel x, pixel y], or None below 3 locations
+    """
+    joined = tile_coordinates.merge(pixel_coordinates, on='Location', suffixes=('_tile', '_pixel'))
+    if len(joined) < 3:
+        return None
+    design = np.column_stack([joined['X_tile'], joined['Y_tile'], np.ones(len(joined))]).astype(float)
+    coefficients, *_ = np.linalg.lstsq(design, joined[['X_pixel', 'Y_pixel']].to_numpy(dtype=float), rcond=None)
+    return coefficients
+
+
+class LocationTable:
+    """Precomputed tile -> pixel lookup for all surveyed locations
+
+    Built once from the tile coordinate and map pixel coordinate DataFrames so
+    that map drawing code can look up a location by name in O(1) instead of
+    filtering a DataFrame per location. Locations are bucketed by tile cell, so
+    template windows are answered by visiting the cells of the window, and single
+    locations can be added, moved or removed in O(1).
+    """
+
+    def __init__(self, tile_coordinates, pixel_coordinates):
+        """Build the table
+
+        Args:
+            tile_coordinates: DataFrame with Location, X, Y on the tile grid
+            pixel_coordinates: DataFrame with Location, X, Y in map image pixels
+        """
+        tiles = tile_coordinates.drop_duplicates(subset=['Location'])
+        pixels = pixel_coordinates.drop_duplicates(subset=['Location'])
+        pixel_lookup = {
+            name: (x, y) for name, x, y in zip(pixels['Location'], pixels['X'], pixels['Y'])
+        }
+
+        self.entries = {}
+        # (cell x, cell y) -> names of the locations in that tile cell
+        self.cells = {}
+        self.version = 0
+        self.changes = ChangeLog()
+        self._columns = None
+        # (version, tile -> pixel transform) fitted on the located entries
+        self._transform = None
+
+        for name, tile_x, tile_y in zip(tiles['Location'], tiles['X'], tiles['Y']):
+            self.set(name, (tile_x, tile_y), pixel_lookup.get(name))
+
+        # Locations that only have pixel coordinates are still drawable
+        for name, pixel in pixel_lookup.items():
+            if name not in self.entries:
+                self.set(name, None, pixel)
+
+    def set(self, name, tile=None, pixel=None):
+        """Add a location or replace its coordinates
+
+        Args:
+            name: Location name
+            tile: (x, y) on the tile grid, or None
+            pixel: (x, y) in map image pixels, or None
+        """
+        self.remove(name)
+        tile_x, tile_y = tile if tile is not None else (None, None)
+        pixel_x, pixel_y = pixel if pixel is not None else (None, None)
+        self.entries[name] = LocationEntry(name, location_label(name), tile_x, tile_y, pixel_x, pixel_y)
+        if tile_x is not None:
+            self.cells.setdefault(self._cell(tile_x, tile_y), set()).add(name)
+        self._changed(name)
+
+    def remove(self, name):
+        """Remove a location, if present"""
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+        if entry.tile_x is not None:
+            cell = self._cell(entry.tile_x, entry.tile_y)
+            self.cells[cell].discard(name)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        self._changed(name)
+
+    def names_within(self, center_x, center_y, size):
+        """Names of the locations within `size` tiles of a point (a square window)"""
+        return self.names_in_box(center_x - size, center_x + size, center_y - size, center_y + size)
+
+    def names_in_box(self, min_x, max_x, min_y, max_y):
+        """Names of the locations whose tile lies in a rectangle (bounds included)"""
+        if min_x > max_x or min_y > max_y:
+            return set()
+        first_x, first_y = self._cell(min_x, min_y)
+        last_x, last_y = self._cell(max_x, max_y)
+
+        # Windows larger than the map are cheaper to answer with the column arrays
+        if (last_x - first_x + 1) * (last_y - first_y + 1) > len(self.cells):
+            mask = (
+                (self.tile_x >= min_x) & (self.tile_x <= max_x) &
+                (self.tile_y >= min_y) & (self.tile_y <= max_y)
+            )
+            return set(self.names[mask])
+
+        names = set()
+        for cell_x in range(first_x, last_x + 1):
+            for cell_y in range(first_y, last_y + 1):
+                for name in self.cells.get((cell_x, cell_y), ()):
+                    entry = self.entries[name]
+                    if min_x <= entry.tile_x <= max_x and min_y <= entry.tile_y <= max_y:
+                        names.add(name)
+        return names
+
+    @property
+    def names(self):
+        """Names of the tiled locations, aligned with tile_x and tile_y"""
+        return self._column_arrays()[0]
+
+    @property
+    def tile_x(self):
+        return self._column_arrays()[1]
+
+    @property
+    def tile_y(self):
+        return self._column_arrays()[2]
+
+    def tile_frame(self, names=None):
+        """Tile coordinates as a DataFrame (Location, X, Y), for all or the given locations"""
+        entries = self.entries.values() if names is None else (self.entries[n] for n in names if n in self.entries)
+        rows = [(e.name, e.tile_x, e.tile_y) for e in entries if e.tile_x is not None]
+        return pd.DataFrame(rows, columns=['Location', 'X', 'Y'])
+
+    def pixel_frame(self):
+        """Map pixel coordinates as a DataFrame (Location, X, Y)"""
+        rows = [(e.name, e.pixel_x, e.pixel_y) for e in self.entries.values() if e.pixel_x is not None]
+        return pd.DataFrame(rows, columns=['Location', 'X', 'Y'])
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, name):
+        """Entry for a location name, or None"""
+        return self.entries.get(name)
+
+    def tile(self, name):
+        """Tile grid coordinates of a location, or None"""
+        entry = self.entries.get(name)
+        if entry is None or entry.tile_x is None:
+            return None
+        return entry.tile_x, entry.tile_y
+
+    def pixel(self, name):
+        """Map pixel coordinates of a location, or None"""
+        entry = self.entries.get(name)
+        if entry is None or entry.pixel_x is None:
+            return None
+        return entry.pixel_x, entry.pixel_y
+
+    def pixel_or_tile(self, name):
+        """Map pixel coordinates, falling back to tile coordinates when no pixel position is known"""
+        return self.pixel(name) or self.tile(name)
+
+    def tile_transform(self):
+        """Affine tile -> pixel transform fitted on the locations with both coordinates, or None"""
+        if self._transform is None or self._transform[0] != self.version:
+            self._transform = (self.version, tile_to_pixel_transform(self.tile_frame(), self.pixel_frame()))
+        return self._transform[1]
+
+    def tile_at_pixel(self, x, y):
+        """Tile grid cell under a map pixel (rounded to whole tiles), or None without a usable transform"""
+        transform = self.tile_transform()
+        if transform is None:
+            return None
+        try:
+            tile = np.linalg.solve(transform[:2].T, np.array([x, y], dtype=float) - transform[2])
+        except np.linalg.LinAlgError:
+            return None
+        return int(round(tile[0])), int(round(tile[1]))
+
+    @staticmethod
+    def _cell(x, y):
+        return math.floor(x), math.floor(y)
+
+    def _column_arrays(self):
+        """Column arrays over the tiled locations for vectorized queries, rebuilt lazily after edits"""
+        if self._columns is None:
+            tiled = [e for e in self.entries.values() if e.tile_x is not None]
+            self._columns = (
+                np.array([e.name for e in tiled], dtype=object),
+                np.array([e.tile_x for e in tiled], dtype=float),
+                np.array([e.tile_y for e in tiled], dtype=float),
+            )
+        return self._columns
+
+    def changes_since(self, version):
+        """Locations edited after a version, or None if the change log no longer reaches back that far"""
+        return self.changes.since(version, self.version)
+
+    def _changed(self, name):
+        self.version += 1
+        self.changes.record(self.version, name)
+        self._columns = None
@@ -0,0 +1,167 @@
+import itertools
+import logging
+import logging.handlers
+import time
+import tkinter as tk
+from collections import deque
+
+# Log levels, "normal" is kept as an alias of "info" for the older log_message callers
+LEVELS = {
+    "debug": logging.DEBUG,
+    "normal": logging.INFO,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+
+class LogSink:
+    """Leveled log sink with a lock-free in-memory ring and batched Text widget output
+
+    Producers only append a tuple to a bounded deque (atomic in CPython), so a
+    log call costs microseconds and can be made from any thread. A Tk ``after``
+    callback periodically formats everything pending, writes it to the Text
+    widget in a single insert, trims the widget to ``max_lines`` and scrolls
+    once. An optional rotating file receives the same lines.
+    """
+
+    def __init__(self, capacity=5000, max_lines=1000, interval_ms=200, level="info"):
+        """Initialize the sink
+
+        Args:
+            capacity: Number of pending records kept before the oldest are dropped
+            max_lines: Maximum number of lines kept in the Text widget
+            interval_ms: Delay between two flushes to the widget
+            level: Minimum level that is recorded
+        """
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.level = LEVELS[level]
+
+        self._pending = deque(maxlen=capacity)
+        self._seq = itertools.count()
+        self._next_seq = 0
+        self.dropped = 0
+
+        self._root = None
+        self._text = None
+        self._after_id = None
+        self._file_logger = None
+
+    def set_level(self, level):
+        """Change the minimum recorded level"""
+        self.level = LEVELS[level]
+
+    def enabled(self, level):
+        """Whether messages of a level are recorded, to skip formatting per-sample messages"""
+        return LEVELS.get(level, logging.INFO) >= self.level
+
+    def log(self, message, level="info"):
+        """Record a message, callable from any thread"""
+        if LEVELS.get(level, logging.INFO) < self.level:
+            return
+        self._pending.append((next(self._seq), time.time(), level, message))
+
+    def debug(self, message):
+        self.log(message, "debug")
+
+    def info(self, message):
+        self.log(message, "info")
+
+    def warning(self, message):
+        self.log(message, "warning")
+
+    def error(self, message):
+        self.log(message, "error")
+
+    def enable_file(self, path, max_bytes=5 * 1024 * 1024, backup_count=3):
+        """Also write flushed lines to a rotating log file"""
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        logger = logging.getLogger(f"{__name__}.{id(self)}")
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self._file_logger = logger
+
+    def attach(self, root, text_widget):
+        """Start flushing pending records into a Text widget"""
+        self._root = root
+        self._text = text_widget
+        if self._after_id is None:
+            self._after_id = root.after(self.interval_ms, self._pump)
+
+    def detach(self):
+        """Stop the periodic flush and write out whatever is pending"""
+        if self._root is not None and self._after_id is not None:
+            try:
+                self._root.after_cancel(self._after_id)
+            except Exception:
+                pass
+        self._after_id = None
+        self._text = None
+        self.flush()
+
+    def _take_pending(self):
+        """Pop all pending records without locking"""
+        records = []
+        while True:
+            try:
+                records.append(self._pending.popleft())
+            except IndexError:
+                break
+        return records
+
+    def flush(self):
+        """Format and write all pending records (Tk thread only when a widget is attached)"""
+        records = self._take_pending()
+        if not records:
+            return
+
+        # Gaps in the sequence numbers are records the ring overwrote
+        missed = records[0][0] - self._next_seq
+        self._next_seq = records[-1][0] + 1
+        if missed > 0:
+            self.dropped += missed
+
+        chunks = []
+        lines = []
+        if missed > 0:
+            line = f"... {missed} log messages dropped\n"
+            chunks.extend((line, "warning"))
+            lines.append(line)
+
+        for _, ts, level, message in records:
+            stamp = f"[{time.strftime('%H:%M:%S', time.localtime(ts))}] "
+            line = f"{message}\n"
+            chunks.extend((stamp, "timestamp", line, level))
+            lines.append(stamp + line)
+
+        if self._file_logger is not None:
+            self._file_logger.info("".join(lines).rstrip("\n"))
+
+        if self._text is None:
+            # Fall back to print if no widget is attached
+            print("".join(lines), end="")
+            return
+
+        # One insert for the whole batch, then trim and scroll once
+        self._text.insert(tk.END, *chunks)
+        # Every record ends with a newline, so the last line is always empty
+        line_count = int(self._text.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_lines:
+            self._text.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+        self._text.see(tk.END)
+
+    def _pump(self):
+        """Flush and reschedule"""
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Log flush failed: {str(e)}")
+        finally:
+            if self._root is not None and self._after_id is not None:
+                self._after_id = self._root.after(self.interval_ms, self._pump)
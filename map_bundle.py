@@ -0,0 +1,449 @@
+"""Compiled fingerprint map bundles
+
+A bundle packs the tile coordinates, map pixel coordinates, magnetic
+fingerprints, location names and metadata of one map into a single versioned
+binary file:
+
+    magic (8 bytes) | format version (uint32) | header length (uint32) | JSON header
+    | padding | 64-byte aligned little-endian arrays ...
+
+The JSON header lists every array with its dtype, shape and file offset, so the
+arrays can be opened with ``np.memmap`` without parsing or copying. Processes
+that open the same bundle share the pages through the OS page cache.
+
+Build a bundle from the CSV trio with:
+
+    python map_bundle.py build --tiles Locations_&_Tile_Coordinates.csv \\
+        --pixels Map_Image_Pixel_Coordinates_for_Locations.csv \\
+        --magnetic Locations_&_Magnetic_Data.csv -o Locations_&_Magnetic_Data.magmap
+
+A map variant (e.g. the same floor with furniture) can be stored as a delta
+bundle that only holds the locations that differ from a base bundle, plus the
+names of removed locations. The header records the base bundle path relative
+to the delta; the variant is resolved at load time on top of a copy-on-write
+mapping of the base, so variants share the base pages:
+
+    python map_bundle.py delta --base Locations_&_Magnetic_Data.magmap \\
+        --magnetic Locations_&_Magnetic_Data_WithObjects.csv --name "With Objects Map" \\
+        -o Locations_&_Magnetic_Data_WithObjects.magmap
+
+The base can itself be a delta: the new delta only stores the differences to
+the base chain resolved up to it, and loading applies the chain in order.
+"""
+import argparse
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"MAGMAP\x00\x00"
+FORMAT_VERSION = 1
+BUNDLE_SUFFIX = ".magmap"
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode_names(names):
+    """Pack strings into a UTF-8 blob plus an int64 offsets array"""
+    encoded = [name.encode("utf-8") for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _decode_names(blob, offsets):
+    raw = bytes(blob)
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def write_bundle(path, tile_coordinates, pixel_coordinates, magnetic_data, metadata=None):
+    """Compile the three map tables into a bundle file
+
+    Args:
+        path: Output bundle path
+        tile_coordinates: DataFrame with Location, X, Y on the tile grid
+        pixel_coordinates: DataFrame with Location, X, Y in map image pixels (may miss locations)
+        magnetic_data: DataFrame with Location, M_X, M_Y, M_Z (one or more rows per location)
+        metadata: Optional dict stored in the header (map name, source files, ...)
+    """
+    arrays = _map_arrays(tile_coordinates, pixel_coordinates, magnetic_data)
+    header = {"metadata": dict(metadata or {}, created=time.strftime("%Y-%m-%dT%H:%M:%S"))}
+    _write_file(path, arrays, header)
+
+
+def write_delta_bundle(path, base_path, tile_coordinates, pixel_coordinates, magnetic_data,
+                       removed=(), metadata=None):
+    """Write a map variant as the differences to a base bundle
+
+    Args:
+        path: Output bundle path
+        base_path: Bundle the variant is layered on
+        tile_coordinates: Tile coordinates of added or moved locations
+        pixel_coordinates: Pixel coordinates of added or moved locations
+        magnetic_data: All fingerprints of the locations whose fingerprints changed
+        removed: Names of base locations the variant does not have
+        metadata: Optional dict stored in the header
+    """
+    arrays = _map_arrays(tile_coordinates, pixel_coordinates, magnetic_data)
+    removed_blob, removed_offsets = _encode_names(list(removed))
+    arrays["removed_blob"] = removed_blob
+    arrays["removed_offsets"] = removed_offsets
+
+    header = {
+        "base": bundle_relative_path(base_path, path),
+        "metadata": dict(metadata or {}, created=time.strftime("%Y-%m-%dT%H:%M:%S")),
+    }
+    _write_file(path, arrays, header)
+
+
+def diff_map(base, tile_coordinates, pixel_coordinates, magnetic_data):
+    """Differences of a full map to a base bundle, as arguments for write_delta_bundle
+
+    Returns:
+        Tuple (tile_coordinates, pixel_coordinates, magnetic_data, removed)
+    """
+    names = base.names
+    columns = ['M_X', 'M_Y', 'M_Z']
+
+    base_tiles = {n: tuple(xy) for n, xy in zip(names, base.tile_xy.tolist())}
+    base_pixels = {n: tuple(xy) for n, xy in zip(names, base.pixel_xy.tolist())}
+    base_fingerprints = {}
+    for location, fingerprint in zip(base.fingerprint_location, base.fingerprints.tolist()):
+        base_fingerprints.setdefault(names[location], []).append(fingerprint)
+
+    def moved(frame, known):
+        frame = frame.drop_duplicates(subset=['Location'])
+        keep = [
+            known.get(name) is None or not np.allclose(known[name], (x, y), equal_nan=True)
+            for name, x, y in zip(frame['Location'], frame['X'], frame['Y'])
+        ]
+        return frame[keep]
+
+    # A location's fingerprints are stored whole if any of them differ
+    changed = []
+    for location, rows in magnetic_data.groupby('Location', sort=False):
+        base_rows = base_fingerprints.get(location)
+        values = rows[columns].to_numpy(dtype=float)
+        if base_rows is None or len(base_rows) != len(values) or not np.allclose(base_rows, values):
+            changed.append(location)
+
+    variant_names = set(tile_coordinates['Location']) | set(magnetic_data['Location'])
+    removed = [name for name in names if name not in variant_names]
+    return (
+        moved(tile_coordinates, base_tiles),
+        moved(pixel_coordinates, base_pixels),
+        magnetic_data[magnetic_data['Location'].isin(changed)],
+        removed,
+    )
+
+
+def _map_arrays(tile_coordinates, pixel_coordinates, magnetic_data):
+    """Arrays of the locations table and the fingerprints table of a bundle"""
+    tiles = tile_coordinates.drop_duplicates(subset=['Location'])
+    pixels = pixel_coordinates.drop_duplicates(subset=['Location']).set_index('Location')
+
+    # Locations table: every location that has coordinates or fingerprints
+    names = list(tiles['Location'])
+    known = set(names)
+    for name in list(pixels.index) + list(magnetic_data['Location']):
+        if name not in known:
+            names.append(name)
+            known.add(name)
+    index_of = {name: i for i, name in enumerate(names)}
+
+    tile_lookup = tiles.set_index('Location')
+    tile_xy = np.full((len(names), 2), np.nan, dtype="<f8")
+    pixel_xy = np.full((len(names), 2), np.nan, dtype="<f8")
+    for i, name in enumerate(names):
+        if name in tile_lookup.index:
+            tile_xy[i] = tile_lookup.loc[name, ['X', 'Y']].to_numpy(dtype=float)
+        if name in pixels.index:
+            pixel_xy[i] = pixels.loc[name, ['X', 'Y']].to_numpy(dtype=float)
+
+    # Fingerprints table: one row per survey sample, pointing into the locations table
+    fingerprint_location = np.array([index_of[name] for name in magnetic_data['Location']], dtype="<i4")
+    fingerprints = magnetic_data[['M_X', 'M_Y', 'M_Z']].to_numpy(dtype="<f8").reshape(-1, 3)
+
+    name_blob, name_offsets = _encode_names(names)
+    return {
+        "tile_xy": tile_xy,
+        "pixel_xy": pixel_xy,
+        "fingerprint_location": fingerprint_location,
+        "fingerprints": np.ascontiguousarray(fingerprints),
+        "name_blob": name_blob,
+        "name_offsets": name_offsets,
+    }
+
+
+def _write_file(path, arrays, header):
+    """Lay out the header and arrays and write them atomically"""
+    header = dict(header)
+    header["location_count"] = len(arrays["tile_xy"])
+    header["fingerprint_count"] = len(arrays["fingerprints"])
+    header["arrays"] = {}
+
+    # Lay out the arrays after the header; the header size depends on the offsets, so iterate
+    header_len = 0
+    while True:
+        offset = _align(_PREAMBLE.size + header_len)
+        for name, array in arrays.items():
+            header["arrays"][name] = {
+                "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset,
+            }
+            offset = _align(offset + array.nbytes)
+        encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+        if len(encoded) <= header_len:
+            break
+        header_len = _align(len(encoded))
+
+    # Write to a temporary file and swap it in so readers never see a partial bundle
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, header_len))
+        f.write(encoded.ljust(header_len, b" "))
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+class MapBundle:
+    """Read-only, memory-mapped view of a compiled map bundle"""
+
+    def __init__(self, path, header, arrays):
+        self.path = path
+        self.header = header
+        self.metadata = header.get("metadata", {})
+        self.location_count = header["location_count"]
+        self.fingerprint_count = header["fingerprint_count"]
+
+        # Memory-mapped arrays, no data is read until it is touched
+        self.tile_xy = arrays["tile_xy"]
+        self.pixel_xy = arrays["pixel_xy"]
+        self.fingerprint_location = arrays["fingerprint_location"]
+        self.fingerprints = arrays["fingerprints"]
+        self.names = _decode_names(arrays["name_blob"], arrays["name_offsets"])
+
+        # Delta bundles name their base bundle and the locations they remove
+        base = header.get("base")
+        self.base_path = os.path.join(os.path.dirname(os.path.abspath(path)), base) if base else None
+        self.removed = _decode_names(arrays["removed_blob"], arrays["removed_offsets"]) if base else []
+
+    @property
+    def is_delta(self):
+        return self.base_path is not None
+
+    def chain(self):
+        """Paths of this bundle and of the bases it is layered on, nearest first
+
+        Raises:
+            ValueError: If the bases refer back to a bundle of the chain
+        """
+        paths = [os.path.abspath(self.path)]
+        bundle = self
+        while bundle.is_delta:
+            base_path = os.path.abspath(bundle.base_path)
+            if base_path in paths:
+                raise ValueError(f"{self.path}: base bundles form a cycle through {base_path}")
+            paths.append(base_path)
+            bundle = MapBundle.open(base_path)
+        return paths
+
+    def resolve(self):
+        """Full map of a bundle: a delta is applied on top of its resolved base chain
+
+        Returns:
+            The bundle itself if it is a full bundle, otherwise an in-memory
+            full bundle (not memory-mapped) with the variant's data
+        """
+        if not self.is_delta:
+            return self
+        self.chain()
+        base = MapBundle.open(self.base_path).resolve()
+
+        # Removed locations go, moved or added ones replace the base entries, changed fingerprints are stored whole
+        removed = set(self.removed)
+        tiles, pixels, magnetic = self.tile_coordinates(), self.pixel_coordinates(), self.magnetic_data()
+        changed = set(magnetic['Location'])
+
+        def overlay(frame, delta, replaced):
+            return pd.concat([frame[~frame['Location'].isin(removed | replaced)], delta], ignore_index=True)
+
+        arrays = _map_arrays(
+            overlay(base.tile_coordinates(), tiles, set(tiles['Location'])),
+            overlay(base.pixel_coordinates(), pixels, set(pixels['Location'])),
+            overlay(base.magnetic_data(), magnetic, changed),
+        )
+        header = {
+            "metadata": self.metadata,
+            "location_count": len(arrays["tile_xy"]),
+            "fingerprint_count": len(arrays["fingerprints"]),
+        }
+        return MapBundle(self.path, header, arrays)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """Open a bundle file with np.memmap
+
+        Args:
+            path: Bundle path
+            mode: "r" for read-only arrays, "c" for copy-on-write arrays (writes stay private)
+        """
+        with open(path, "rb") as f:
+            magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a map bundle")
+            if version > FORMAT_VERSION:
+                raise ValueError(f"{path} has unsupported bundle version {version}")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+                continue
+            arrays[name] = np.memmap(path, mode=mode, dtype=spec["dtype"], offset=spec["offset"], shape=shape)
+        return cls(path, header, arrays)
+
+    def tile_coordinates(self):
+        """Tile coordinates as a DataFrame (Location, X, Y)"""
+        mask = ~np.isnan(self.tile_xy[:, 0])
+        return self._coordinate_frame(self.tile_xy, mask)
+
+    def pixel_coordinates(self):
+        """Map pixel coordinates as a DataFrame (Location, X, Y)"""
+        mask = ~np.isnan(self.pixel_xy[:, 0])
+        return self._coordinate_frame(self.pixel_xy, mask)
+
+    def magnetic_data(self):
+        """Fingerprints as a DataFrame (Location, M_X, M_Y, M_Z)"""
+        names = np.array(self.names, dtype=object)
+        return pd.DataFrame({
+            'Location': names[self.fingerprint_location],
+            'M_X': self.fingerprints[:, 0],
+            'M_Y': self.fingerprints[:, 1],
+            'M_Z': self.fingerprints[:, 2],
+        })
+
+    def _coordinate_frame(self, xy, mask):
+        names = np.array(self.names, dtype=object)[mask]
+        values = np.asarray(xy[mask])
+        # Keep integer coordinates integer, like the CSV files
+        if np.all(values == np.round(values)):
+            values = values.astype(int)
+        return pd.DataFrame({'Location': names, 'X': values[:, 0], 'Y': values[:, 1]})
+
+
+def bundle_relative_path(path, bundle_path):
+    """A path as stored in the header of a bundle: relative to the bundle's directory, with forward slashes
+
+    Falls back to the absolute path when there is no relative one (another drive on Windows).
+    """
+    path = os.path.abspath(path)
+    try:
+        path = os.path.relpath(path, os.path.dirname(os.path.abspath(bundle_path)))
+    except ValueError:
+        pass
+    return path.replace(os.sep, "/")
+
+
+def resolve_bundle_path(path, bundle_path):
+    """A path stored in the header of a bundle, resolved against the bundle's directory"""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(bundle_path)), path)
+
+
+def bundle_path_for(csv_path):
+    """Bundle path that sits next to a magnetic data CSV"""
+    return os.path.splitext(csv_path)[0] + BUNDLE_SUFFIX
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and inspect fingerprint map bundles")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Compile a bundle from the CSV trio")
+    build.add_argument("--tiles", required=True, help="Locations_&_Tile_Coordinates.csv")
+    build.add_argument("--pixels", required=True, help="Map_Image_Pixel_Coordinates_for_Locations.csv")
+    build.add_argument("--magnetic", required=True, help="Locations_&_Magnetic_Data.csv")
+    build.add_argument("--name", help="Map name stored in the metadata")
+    build.add_argument("--image", help="Map image path stored in the metadata")
+    build.add_argument("-o", "--output", help="Output path (default: next to the magnetic CSV)")
+
+    delta = subparsers.add_parser("delta", help="Compile a map variant as a delta over a base bundle")
+    delta.add_argument("--base", required=True, help="Base bundle")
+    delta.add_argument("--magnetic", required=True, help="Magnetic data CSV of the variant")
+    delta.add_argument("--tiles", help="Tile coordinates CSV of the variant (default: same as the base)")
+    delta.add_argument("--pixels", help="Pixel coordinates CSV of the variant (default: same as the base)")
+    delta.add_argument("--name", help="Map name stored in the metadata")
+    delta.add_argument("--image", help="Map image path stored in the metadata")
+    delta.add_argument("-o", "--output", help="Output path (default: next to the magnetic CSV)")
+
+    info = subparsers.add_parser("info", help="Show the header of a bundle")
+    info.add_argument("bundle")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output = args.output or bundle_path_for(args.magnetic)
+        metadata = {
+            "name": args.name or os.path.splitext(os.path.basename(args.magnetic))[0],
+            "sources": {
+                "tiles": os.path.basename(args.tiles),
+                "pixels": os.path.basename(args.pixels),
+                "magnetic": os.path.basename(args.magnetic),
+            },
+        }
+        if args.image:
+            metadata["image"] = args.image
+        write_bundle(
+            output,
+            pd.read_csv(args.tiles),
+            pd.read_csv(args.pixels),
+            pd.read_csv(args.magnetic),
+            metadata,
+        )
+        print(f"Wrote {output}")
+    elif args.command == "delta":
+        output = args.output or bundle_path_for(args.magnetic)
+        base = MapBundle.open(args.base)
+        try:
+            if os.path.abspath(output) in base.chain():
+                parser.error(f"{output} is a base of {args.base}")
+            # Deltas can stack: diff against the base chain resolved up to the given base
+            base = base.resolve()
+        except ValueError as e:
+            parser.error(str(e))
+        tiles, pixels, magnetic, removed = diff_map(
+            base,
+            pd.read_csv(args.tiles) if args.tiles else base.tile_coordinates(),
+            pd.read_csv(args.pixels) if args.pixels else base.pixel_coordinates(),
+            pd.read_csv(args.magnetic),
+        )
+        metadata = {
+            "name": args.name or os.path.splitext(os.path.basename(args.magnetic))[0],
+            "sources": {"magnetic": os.path.basename(args.magnetic)},
+        }
+        if args.image:
+            metadata["image"] = args.image
+        write_delta_bundle(output, args.base, tiles, pixels, magnetic, removed, metadata)
+        print(f"Wrote {output}: {magnetic['Location'].nunique()} changed, "
+              f"{len(tiles)} moved or added, {len(removed)} removed locations")
+    else:
+        bundle = MapBundle.open(args.bundle)
+        print(json.dumps(bundle.header, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from fingerprint_matcher import FingerprintMatcher
+from location_table import LocationTable
+from map_bundle import BUNDLE_SUFFIX, MapBundle, resolve_bundle_path
+from template_service import TemplateService
+from tile_models import TileModels
+from window_matcher import WindowMatcher
+
+
+class LoadedMap:
+    """A map with everything the localization pipeline needs already indexed"""
+
+    def __init__(self, name, tile_coordinates, pixel_coordinates, ref_data, image_path=None, bundle_path=None,
+                 matcher=None, gmm_components=0):
+        """Index a map
+
+        Args:
+            name: Display name of the map
+            tile_coordinates: DataFrame with Location, X, Y on the tile grid
+            pixel_coordinates: DataFrame with Location, X, Y in map image pixels
+            ref_data: DataFrame with Location, M_X, M_Y, M_Z reference fingerprints
+            image_path: Map image shown for this map, if any
+            bundle_path: Bundle file the map was loaded from, if any
+            matcher: Prebuilt FingerprintMatcher, used instead of ref_data
+            gmm_components: Mixture components of the per-location models, 0 for a single Gaussian
+        """
+        self.name = name
+        self.image_path = image_path
+        self.bundle_path = bundle_path
+        # Every file the map data was resolved from (a delta bundle and its bases)
+        self.source_paths = [bundle_path] if bundle_path else []
+        self.gmm_components = gmm_components
+
+        self.location_table = LocationTable(tile_coordinates, pixel_coordinates)
+        self.matcher = matcher if matcher is not None else FingerprintMatcher(ref_data.reset_index(drop=True))
+        self.template_service = TemplateService(self.location_table, self.matcher)
+        # Resident template window of the live matching path
+        self.window_matcher = WindowMatcher(self.location_table, self.matcher)
+        self._frames = {}
+
+        # Filter state is kept per map so switching back resumes where it left off
+        self.particle_filter = None
+
+    @property
+    def tile_coordinates(self):
+        """Tile coordinates as a DataFrame (Location, X, Y)"""
+        return self._cached("tile", self.location_table.version, self.location_table.tile_frame)
+
+    @property
+    def pixel_coordinates(self):
+        """Map pixel coordinates as a DataFrame (Location, X, Y)"""
+        return self._cached("pixel", self.location_table.version, self.location_table.pixel_frame)
+
+    @property
+    def ref_data(self):
+        """Reference fingerprints as a DataFrame indexed by matcher row"""
+        return self.matcher.frame()
+
+    @property
+    def tile_models(self):
+        """Per-location mean/covariance models, the edited locations are refit after the fingerprints changed"""
+        cached = self._frames.get("models")
+        if cached is not None and cached[0] != self.matcher.version:
+            changed = self.matcher.changes_since(cached[0])
+            if changed is not None and cached[1].refit(self.matcher, changed):
+                cached = (self.matcher.version, cached[1])
+                self._frames["models"] = cached
+        return self._cached("models", self.matcher.version,
+                            lambda: TileModels.from_matcher(self.matcher, gmm_components=self.gmm_components))
+
+    def set_location(self, location, tile=None, pixel=None, fingerprints=None):
+        """Add or patch a single location in place, without re-indexing the map
+
+        Args:
+            location: Location name
+            tile: New (x, y) on the tile grid, None keeps the current one
+            pixel: New (x, y) in map image pixels, None keeps the current one
+            fingerprints: New [x, y, z] fingerprints of the location, None keeps the current ones
+        """
+        if tile is not None or pixel is not None or location not in self.location_table:
+            current_tile = self.location_table.tile(location)
+            current_pixel = self.location_table.pixel(location)
+            self.location_table.set(
+                location,
+                tile if tile is not None else current_tile,
+                pixel if pixel is not None else current_pixel,
+            )
+        if fingerprints is not None:
+            self.matcher.set_location(location, fingerprints)
+
+    def remove_location(self, location):
+        """Delete a location and its fingerprints"""
+        self.location_table.remove(location)
+        self.matcher.remove_location(location)
+
+    def apply_delta(self, bundle):
+        """Apply the changes stored in a delta bundle"""
+        for location in bundle.removed:
+            self.remove_location(location)
+
+        fingerprints = {}
+        for location, fingerprint in zip(bundle.fingerprint_location, bundle.fingerprints.tolist()):
+            fingerprints.setdefault(location, []).append(fingerprint)
+
+        for i, location in enumerate(bundle.names):
+            tile = None if np.isnan(bundle.tile_xy[i, 0]) else tuple(bundle.tile_xy[i].tolist())
+            pixel = None if np.isnan(bundle.pixel_xy[i, 0]) else tuple(bundle.pixel_xy[i].tolist())
+            self.set_location(location, tile=tile, pixel=pixel, fingerprints=fingerprints.get(i))
+
+    def _cached(self, key, version, build):
+        """Derived view rebuilt only after the underlying data changed"""
+        cached = self._frames.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build())
+            self._frames[key] = cached
+        return cached[1]
+
+    @classmethod
+    def from_bundle(cls, name, bundle_path, gmm_components=0):
+        """Load and index a compiled map bundle, resolving delta bundles over their base"""
+        bundle = MapBundle.open(bundle_path)
+        image_path = bundle.metadata.get("image")
+        if image_path:
+            image_path = resolve_bundle_path(image_path, bundle_path)
+
+        if not bundle.is_delta:
+            # Copy-on-write mapping: the fingerprints stay shared pages until a row is edited
+            base = MapBundle.open(bundle_path, mode="c")
+            names = np.array(base.names, dtype=object)
+            matcher = FingerprintMatcher.from_arrays(base.fingerprints, names[base.fingerprint_location])
+            return cls(name, base.tile_coordinates(), base.pixel_coordinates(), None,
+                       image_path=image_path, bundle_path=bundle_path, matcher=matcher, gmm_components=gmm_components)
+
+        # Resolve the base, then apply the sparse overlay through the incremental edit API
+        bundle.chain()
+        loaded = cls.from_bundle(name, bundle.base_path, gmm_components)
+        loaded.image_path = image_path or loaded.image_path
+        loaded.bundle_path = bundle_path
+        loaded.source_paths = [bundle_path] + loaded.source_paths
+        loaded.apply_delta(bundle)
+        return loaded
+
+
+class MapCatalog:
+    """Discovers map bundles in a directory and keeps recently used maps warm
+
+    Loaded maps are kept in an LRU cache, so switching between recently used
+    maps (floor variants, object layouts) only swaps references.
+    """
+
+    def __init__(self, directory, capacity=4, gmm_components=0):
+        """Initialize the catalog
+
+        Args:
+            directory: Directory scanned for *.magmap bundles
+            capacity: Number of loaded maps kept warm
+            gmm_components: Mixture components of the per-location models of the loaded maps
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.gmm_components = gmm_components
+        self.paths = {}
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Rescan the directory for bundles"""
+        paths = {}
+        if self.directory and os.path.isdir(self.directory):
+            for path in sorted(glob.glob(os.path.join(self.directory, f"*{BUNDLE_SUFFIX}"))):
+                try:
+                    name = MapBundle.open(path).metadata.get("name")
+                except (OSError, ValueError):
+                    continue
+                paths[name or os.path.splitext(os.path.basename(path))[0]] = path
+        self.paths = paths
+        return list(paths)
+
+    def names(self):
+        """Names of all discovered bundles"""
+        return list(self.paths)
+
+    def __contains__(self, name):
+        return name in self.paths or name in self._loaded
+
+    def is_warm(self, name):
+        return name in self._loaded
+
+    def get(self, name):
+        """Loaded map by name, loading and indexing it on a cache miss"""
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is not None:
+                self._loaded.move_to_end(name)
+                return loaded
+
+        if name not in self.paths:
+            raise KeyError(f"Unknown map: {name}")
+
+        # Load outside the lock so other maps stay available meanwhile
+        loaded = LoadedMap.from_bundle(name, self.paths[name], self.gmm_components)
+        self.put(name, loaded)
+        return loaded
+
+    def put(self, name, loaded):
+        """Add an already loaded map (e.g. one built from CSV files) to the cache"""
+        with self._lock:
+            self._loaded[name] = loaded
+            self._loaded.move_to_end(name)
+            while len(self._loaded) > self.capacity:
+                self._loaded.popitem(last=False)
+
+    def warm(self, names):
+        """Load maps in a background thread so the first switch to them is instant"""
+        def load_all():
+            for name in names:
+                if name in self.paths and not self.is_warm(name):
+                    try:
+                        self.get(name)
+                    except Exception as e:
+                        print(f"Failed to warm map '{name}': {str(e)}")
+
+        thread = threading.Thread(target=load_all, daemon=True)
+        thread.start()
+        return thread
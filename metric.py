@@ -0,0 +1,108 @@
+"""Quadratic fingerprint metrics as precomputed linear transforms
+
+Any quadratic metric d(a, b)^2 = (a - b)^T M (a - b) with a positive definite
+M can be written as a plain Euclidean distance after the linear map
+x -> L x, where M = L^T L. Fingerprints are transformed once (when a metric is
+first used, then row by row on edits) and every query only transforms the
+measurement, so all metrics share the Euclidean nearest-neighbour code.
+
+Learn a metric offline from labeled runs (Location, M_X, M_Y, M_Z rows
+recorded while standing on known tiles) with:
+
+    python metric.py learn runs.csv -o maps/learned_metric.json
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+
+class QuadraticMetric:
+    """A quadratic metric stored as its whitening transform"""
+
+    def __init__(self, matrix, name=None):
+        """Initialize the metric
+
+        Args:
+            matrix: Symmetric positive definite 3x3 matrix M of the metric
+            name: Optional description
+        """
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.name = name
+        # M = L^T L with L the transposed Cholesky factor
+        self.transform = np.linalg.cholesky(self.matrix).T
+
+    @classmethod
+    def identity(cls):
+        return cls(np.eye(3), "euclidean")
+
+    @classmethod
+    def diagonal(cls, weights, name=None):
+        """Per-axis weighted Euclidean distance"""
+        return cls(np.diag(np.asarray(weights, dtype=float)), name)
+
+    @classmethod
+    def from_covariance(cls, covariance, name=None):
+        """Mahalanobis distance for a (global) noise covariance"""
+        return cls(np.linalg.inv(np.asarray(covariance, dtype=float)), name)
+
+    @classmethod
+    def learn(cls, fingerprints, labels, shrinkage=0.1, name="learned"):
+        """Learn a metric from labeled samples
+
+        Uses the inverse of the pooled within-location covariance, so axes that
+        vary a lot while standing on the same tile count less.
+
+        Args:
+            fingerprints: (N, 3) array of recorded measurements
+            labels: Location of every measurement
+            shrinkage: Fraction of the average variance added to the diagonal
+        """
+        fingerprints = np.asarray(fingerprints, dtype=float)
+        codes, _ = pd.factorize(np.asarray(labels, dtype=object))
+        means = np.zeros((codes.max() + 1, 3))
+        np.add.at(means, codes, fingerprints)
+        means /= np.bincount(codes)[:, None]
+        centered = fingerprints - means[codes]
+
+        dof = max(len(fingerprints) - len(means), 1)
+        within = centered.T @ centered / dof
+        within += shrinkage * np.trace(within) / 3 * np.eye(3)
+        matrix = np.linalg.inv(within)
+        # Keep distances on the scale of the raw readings
+        return cls(matrix * 3 / np.trace(matrix), name)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["matrix"], data.get("name"))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"name": self.name, "matrix": self.matrix.tolist()}, f, indent=2)
+
+    def apply(self, vectors):
+        """Map fingerprints (rows) into the space where the metric is Euclidean"""
+        return np.asarray(vectors, dtype=float) @ self.transform.T
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Learn fingerprint metrics from labeled runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    learn = subparsers.add_parser("learn", help="Learn a metric from a labeled run CSV")
+    learn.add_argument("runs", nargs="+", help="CSV files with Location, M_X, M_Y, M_Z")
+    learn.add_argument("--shrinkage", type=float, default=0.1, help="Diagonal regularization")
+    learn.add_argument("-o", "--output", required=True, help="Output JSON path")
+
+    args = parser.parse_args()
+    runs = pd.concat([pd.read_csv(path) for path in args.runs], ignore_index=True)
+    metric = QuadraticMetric.learn(runs[['M_X', 'M_Y', 'M_Z']].to_numpy(), runs['Location'], args.shrinkage)
+    metric.save(args.output)
+    print(f"Wrote {args.output}:\n{np.array2string(metric.matrix, precision=4)}")
+
+
+if __name__ == "__main__":
+    main()
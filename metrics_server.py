@@ -0,0 +1,130 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) of the exported latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    """Sample value text, integers are kept exact"""
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricsWriter:
+    """Builds a Prometheus text exposition, one family at a time"""
+
+    def __init__(self, prefix="maglocal_"):
+        self.prefix = prefix
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f"# HELP {name} {help_text}")
+            self._lines.append(f"# TYPE {name} {kind}")
+
+    def counter(self, name, value, help_text, labels=None):
+        name = self.prefix + name
+        self._declare(name, "counter", help_text)
+        self._lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+
+    def gauge(self, name, value, help_text, labels=None):
+        name = self.prefix + name
+        self._declare(name, "gauge", help_text)
+        self._lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+
+    def histogram(self, name, histogram, help_text, labels=None, buckets=LATENCY_BUCKETS):
+        """Export a LatencyHistogram (nanoseconds) as a histogram in seconds"""
+        name = self.prefix + name
+        self._declare(name, "histogram", help_text)
+        labels = dict(labels or {})
+        cumulative = histogram.cumulative([int(bound * 1e9) for bound in buckets])
+        for bound, count in zip(buckets, cumulative):
+            self._lines.append(f"{name}_bucket{_label_text({**labels, 'le': f'{bound:g}'})} {count}")
+        self._lines.append(f"{name}_bucket{_label_text({**labels, 'le': '+Inf'})} {histogram.count}")
+        self._lines.append(f"{name}_sum{_label_text(labels)} {histogram.total / 1e9:.9f}")
+        self._lines.append(f"{name}_count{_label_text(labels)} {histogram.count}")
+
+    def text(self):
+        return "\n".join(self._lines) + "\n"
+
+
+class MetricsServer:
+    """Serves Prometheus text metrics on http://host:port/metrics from a daemon thread
+
+    ``collect`` is called for every scrape with a MetricsWriter and must only
+    read state, it runs on the server thread.
+    """
+
+    def __init__(self, collect, host="127.0.0.1", port=9108, prefix="maglocal_"):
+        self.collect = collect
+        self.prefix = prefix
+        self.scrapes = 0
+        self.errors = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = server.render().encode("utf-8")
+                except Exception as e:
+                    server.errors += 1
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds for a whole shift would flood stderr
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def render(self):
+        """The current metrics as exposition text"""
+        writer = MetricsWriter(self.prefix)
+        self.collect(writer)
+        self.scrapes += 1
+        return writer.text()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="MetricsServer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
@@ -0,0 +1,256 @@
+import copy
+
+import numpy as np
+
+
+class ParticleFilter:
+    """Particle filter implementation for magnetic vector-based localization"""
+    
+    def __init__(self, locations_data, num_particles=100, sensor_noise=2.0, motion_noise=2.0):
+        """Initialize the particle filter
+        
+        Args:
+            locations_data: DataFrame with location and magnetic data
+            num_particles: Number of particles to use
+            sensor_noise: Standard deviation of sensor measurement noise
+            motion_noise: Standard deviation of motion model noise
+        """
+        self.locations_data = locations_data
+        self.num_particles = num_particles
+        self.sensor_noise = sensor_noise
+        self.motion_noise = motion_noise
+        
+        # Initialize particles randomly across all possible locations
+        self.particles = []
+        self.weights = []
+        
+        # Make sure we have data to work with
+        if len(locations_data) == 0:
+            raise ValueError("No location data provided for particle filter")
+        
+        # Reset particles with proper random distribution
+        self.reset_particles()
+        
+        # Keep track of history
+        self.location_history = []
+        self.history_length = 2
+        
+    def copy(self):
+        """Independent copy of the filter state (the reference data is shared, not copied)"""
+        clone = copy.copy(self)
+        clone.particles = [dict(particle) for particle in self.particles]
+        clone.weights = list(self.weights)
+        clone.location_history = list(self.location_history)
+        return clone
+    
+    def reset_particles(self):
+        """Reset particles to random distribution"""
+        # Get the list of unique locations
+        unique_locations = self.locations_data['Location'].unique()
+        
+        # Clear existing particles
+        self.particles = []
+        
+        # Create particles distributed across all locations
+        for _ in range(self.num_particles):
+            # Select a random location
+            random_loc_idx = np.random.randint(0, len(unique_locations))
+            location = unique_locations[random_loc_idx]
+            
+            # Get the magnetic data for this location
+            location_data = self.locations_data[self.locations_data['Location'] == location]
+            
+            if not location_data.empty:
+                # Get a random row if there are multiple entries for this location
+                row_idx = np.random.randint(0, len(location_data))
+                
+                magnetic_data = [
+                    location_data.iloc[row_idx]['M_X'],
+                    location_data.iloc[row_idx]['M_Y'],
+                    location_data.iloc[row_idx]['M_Z']
+                ]
+                
+                # Add some noise to initial magnetic values
+                noisy_data = [
+                    m + np.random.normal(0, self.sensor_noise) 
+                    for m in magnetic_data
+                ]
+                
+                self.particles.append({
+                    'location': location,
+                    'mag_x': noisy_data[0],
+                    'mag_y': noisy_data[1],
+                    'mag_z': noisy_data[2],
+                    'weight': 1.0 / self.num_particles  # Equal initial weights
+                })
+        
+        # Initialize weights equally
+        self.weights = [1.0 / self.num_particles] * len(self.particles)
+        
+        # Print initialization info
+        print(f"Reset {len(self.particles)} particles across {len(unique_locations)} locations")
+    
+    def migrate(self, locations_data):
+        """Switch to updated reference data, keeping the belief over locations
+        
+        Particles keep their location and weight; their magnetic state is moved
+        by how much the mean fingerprint of that location changed. Particles on
+        locations that no longer exist are redrawn at random.
+        
+        Args:
+            locations_data: DataFrame with the new location and magnetic data
+        """
+        if len(locations_data) == 0:
+            raise ValueError("No location data provided for particle filter")
+        
+        columns = ['M_X', 'M_Y', 'M_Z']
+        old_means = self.locations_data.groupby('Location')[columns].mean()
+        new_means = locations_data.groupby('Location')[columns].mean()
+        
+        self.locations_data = locations_data
+        kept = []
+        for particle in self.particles:
+            location = particle['location']
+            if location not in new_means.index:
+                continue
+            shift = new_means.loc[location].to_numpy() - old_means.loc[location].to_numpy() \
+                if location in old_means.index else np.zeros(3)
+            particle['mag_x'] += shift[0]
+            particle['mag_y'] += shift[1]
+            particle['mag_z'] += shift[2]
+            kept.append(particle)
+        
+        # Refill the particles of removed locations from the new data
+        missing = self.num_particles - len(kept)
+        if missing > 0:
+            self.reset_particles()
+            kept.extend(self.particles[:missing])
+        
+        total_weight = sum(particle['weight'] for particle in kept)
+        for particle in kept:
+            particle['weight'] = particle['weight'] / total_weight if total_weight > 0 else 1.0 / len(kept)
+        self.particles = kept
+        self.weights = [particle['weight'] for particle in kept]
+        
+        # Forget history entries of removed locations
+        self.location_history = [loc for loc in self.location_history if loc in new_means.index]
+        
+    def update(self, measurement):
+        """Update the particle filter based on a new measurement
+        
+        Args:
+            measurement: List of [x, y, z] magnetic field values
+            
+        Returns:
+            String: Most likely location
+        """
+        # Calculate weights based on the likelihood of the measurement
+        total_weight = 0
+        for i, particle in enumerate(self.particles):
+            # Calculate likelihood of this measurement given the particle
+            # (Gaussian probability density function)
+            likelihood = self._measurement_probability(measurement, particle)
+            
+            # Update particle weight
+            self.particles[i]['weight'] = likelihood
+            self.weights[i] = likelihood
+            total_weight += likelihood
+        
+        # Normalize weights so they sum to 1
+        if total_weight > 0:
+            self.weights = [w / total_weight for w in self.weights]
+            for i in range(len(self.particles)):
+                self.particles[i]['weight'] = self.weights[i]
+        else:
+            # If all weights are zero, reset to uniform
+            self.weights = [1.0 / self.num_particles] * self.num_particles
+            for i in range(len(self.particles)):
+                self.particles[i]['weight'] = self.weights[i]
+        
+        # Resample particles based on their weights
+        self._resample()
+        
+        # Determine the most likely location
+        location_counts = {}
+        for particle in self.particles:
+            loc = particle['location']
+            if loc in location_counts:
+                location_counts[loc] += particle['weight']
+            else:
+                location_counts[loc] = particle['weight']  # Creates new entry with the weight
+        
+        # Find location with highest weight
+        best_location = max(location_counts.items(), key=lambda x: x[1])[0]
+        
+        # Add to history
+        self.location_history.append(best_location)
+        if len(self.location_history) > self.history_length:
+            self.location_history.pop(0)
+        
+        # Return the most common location in history for stability
+        if len(self.location_history) > 0:
+            from collections import Counter
+            return Counter(self.location_history).most_common(1)[0][0]
+        else:
+            return best_location
+    
+    def _measurement_probability(self, measurement, particle):
+        """Calculate how likely the measurement is given the particle state"""
+        # Compute Gaussian probability density for each dimension
+        prob_x = self._gaussian(measurement[0], particle['mag_x'], self.sensor_noise)
+        prob_y = self._gaussian(measurement[1], particle['mag_y'], self.sensor_noise)
+        prob_z = self._gaussian(measurement[2], particle['mag_z'], self.sensor_noise)
+        
+        # Combine probabilities
+        return prob_x * prob_y * prob_z
+    
+    def _gaussian(self, x, mu, sigma):
+        """Calculate the Gaussian probability density function value"""
+        # Handle the case where sigma is too small to avoid division by zero
+        if sigma < 0.0001:
+            sigma = 0.0001
+            
+        # Gaussian PDF formula
+        return (1.0 / (np.sqrt(2.0 * np.pi) * sigma)) * np.exp(-0.5 * ((x - mu) / sigma) ** 2)
+    
+    def _resample(self):
+        """Resample particles based on their weights"""
+        # Create new particles array
+        new_particles = []
+        
+        # Use numpy's random choice with weights
+        if sum(self.weights) > 0:
+            # With probability 0.95, select based on weights
+            if np.random.random() < 0.95:
+                indices = np.random.choice(
+                    range(len(self.particles)), 
+                    size=self.num_particles, 
+                    replace=True, 
+                    p=self.weights
+                )
+                
+                # Create new particles based on the selected ones
+                for idx in indices:
+                    old_particle = self.particles[idx]
+                    
+                    # Create new particle with some randomness
+                    new_particle = {
+                        'location': old_particle['location'],
+                        'mag_x': old_particle['mag_x'] + np.random.normal(0, self.motion_noise),
+                        'mag_y': old_particle['mag_y'] + np.random.normal(0, self.motion_noise),
+                        'mag_z': old_particle['mag_z'] + np.random.normal(0, self.motion_noise),
+                        'weight': 1.0 / self.num_particles
+                    }
+                    new_particles.append(new_particle)
+            else:
+                # With probability 0.05, add completely random particles to avoid getting stuck
+                self.reset_particles()
+                new_particles = self.particles
+        else:
+            # If all weights are zero, reset the particles
+            self.reset_particles()
+            new_particles = self.particles
+            
+        # Update particles
+        self.particles = new_particles
+        self.weights = [1.0 / self.num_particles] * len(self.particles)
@@ -0,0 +1,160 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Low-overhead sampling profiler for selected threads of the running process
+
+    A daemon thread wakes up every ``interval`` seconds, takes the current
+    frame of every watched thread from ``sys._current_frames()`` and counts the
+    call stack. Nothing is installed as a trace or profile hook, so the
+    watched threads run at full speed; the cost is one stack walk per thread
+    per sample on the profiler thread. Results are written as collapsed stacks
+    (one ``thread;outer;...;inner count`` line per stack, the input format of
+    flamegraph.pl and speedscope) and a per-function summary.
+    """
+
+    def __init__(self, threads, interval=0.005, on_finished=None):
+        """Initialize the profiler
+
+        Args:
+            threads: Callable returning {label: threading.Thread} of the threads to sample,
+                called on every sample so restarted threads are picked up
+            interval: Seconds between two samples
+            on_finished: Called with the output paths, or None if writing failed (see ``error``),
+                from the profiler thread after stop
+        """
+        self.threads = threads
+        self.interval = interval
+        self.on_finished = on_finished
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+        self.output_prefix = None
+        # Why the last profile could not be written, if it couldn't
+        self.error = None
+
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, output_prefix, duration=None):
+        """Start sampling, stopping by itself after duration seconds (None: until stop())"""
+        if self.running:
+            return
+        self.output_prefix = output_prefix
+        self.stacks = Counter()
+        self.samples = 0
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, join=False, timeout=5.0):
+        """Stop sampling; the results are written by the profiler thread
+
+        Args:
+            join: Wait (up to timeout seconds) until the results are written, e.g. before exiting
+            timeout: Seconds to wait when joining
+        """
+        self._stop.set()
+        if join and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self, duration):
+        self.started = time.time()
+        clock = time.perf_counter
+        start = clock()
+        deadline = None if duration is None else start + duration
+        while not self._stop.is_set() and (deadline is None or clock() < deadline):
+            self._sample()
+            self._stop.wait(self.interval)
+        self.elapsed = clock() - start
+
+        try:
+            paths = self.write(self.output_prefix)
+        except Exception as e:
+            # Still report back, so the caller doesn't wait for a profile forever
+            self.error = str(e)
+            paths = None
+        if self.on_finished is not None:
+            self.on_finished(paths)
+
+    def _sample(self):
+        """Count the current stack of every watched thread"""
+        idents = {}
+        for label, thread in self.threads().items():
+            if thread is not None and thread.ident is not None:
+                idents[thread.ident] = label
+        if not idents:
+            return
+
+        frames = sys._current_frames()
+        for ident, label in idents.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(label)
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def _label(self, code):
+        """'function (file:line)' of a code object, cached"""
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def function_summary(self):
+        """Per-function self and total (inclusive) sample counts
+
+        Returns:
+            List of (function, self samples, total samples), most expensive (self) first
+        """
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            # Count recursive functions once per stack
+            for function in set(stack[1:]):
+                total_counts[function] += count
+        return sorted(
+            ((function, self_counts[function], total) for function, total in total_counts.items()),
+            key=lambda row: (row[1], row[2]), reverse=True,
+        )
+
+    def write(self, output_prefix):
+        """Write <prefix>.collapsed and <prefix>.txt
+
+        Returns:
+            Tuple (collapsed stack path, summary path)
+        """
+        collapsed_path = output_prefix + ".collapsed"
+        summary_path = output_prefix + ".txt"
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(";".join(part.replace(";", ":") for part in stack) + f" {count}\n")
+
+        total = sum(self.stacks.values()) or 1
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(f"{self.samples} samples every {self.interval * 1000:g} ms over {self.elapsed:.1f} s\n\n")
+            f.write(f"{'self %':>7}{'total %':>9}{'self':>8}{'total':>8}  function\n")
+            for function, self_count, total_count in self.function_summary():
+                f.write(f"{100 * self_count / total:7.1f}{100 * total_count / total:9.1f}"
+                        f"{self_count:8}{total_count:8}  {function}\n")
+        return collapsed_path, summary_path
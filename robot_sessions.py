@@ -0,0 +1,268 @@
+import queue
+import threading
+import time
+
+import pandas as pd
+import serial
+
+from tile_models import MODEL_ALGORITHMS
+from window_matcher import WindowMatcher
+
+# Single-byte drive commands understood by the robots
+FORWARD_COMMAND = b"1"
+REVERSE_COMMAND = b"2"
+STOP_COMMAND = b"5"
+
+# Marker colors handed out to the robots in order
+ROBOT_COLORS = ["red", "blue", "green", "orange", "purple", "brown", "magenta", "teal"]
+
+
+class RobotSession:
+    """One robot: its serial link, localization state and command queue
+
+    The map index (location table, fingerprint matcher, template windows,
+    tile models) is not copied; every session reads the manager's active map
+    under the shared map lock. Only the per-robot state lives here: the last
+    matched location, the particle filter and the outgoing commands.
+    """
+
+    def __init__(self, manager, name, port, baud=9600, color="red", algorithm="Euclidean Distance",
+                 template_size=5, start_location=None, target_location=None):
+        """Initialize the session
+
+        Args:
+            manager: RobotSessionManager owning the session
+            name: Robot name shown on the map
+            port: Serial port of the robot
+            baud: Baud rate of the serial port
+            color: Marker color on the map
+            algorithm: Localization algorithm of this robot
+            template_size: Template window half size around the last match
+            start_location: Location the robot starts at, if known
+            target_location: Location at which the robot is stopped
+        """
+        self.manager = manager
+        self.name = name
+        self.port = port
+        self.baud = baud
+        self.color = color
+        self.algorithm = algorithm
+        self.template_size = template_size
+        self.target_location = target_location
+
+        # Localization state
+        self.matched_location = start_location or ''
+        self.previous_location = None
+        self.particle_filter = None
+        self.last_filtered_data_size = 0
+        self.vector = [0, 0, 0]
+        # Resident template window of this robot, per map
+        self.window_matcher = None
+
+        # Counters
+        self.frame_seq = 0
+        self.parse_errors = 0
+        self.errors = 0
+
+        # Commands are written by the session thread, so writes to a port never interleave
+        self.commands = queue.Queue(maxsize=64)
+
+        self.serial_port = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Open the serial port and start the session thread"""
+        self.serial_port = self.manager.serial_factory(port=self.port, baudrate=self.baud, timeout=1)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"RobotSession-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stop the session thread and close the serial port"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        if self.serial_port is not None and self.serial_port.is_open:
+            self.serial_port.close()
+
+    def send_command(self, command):
+        """Queue a command for the robot (any thread)
+
+        Returns:
+            False if the queue is full and the command was dropped
+        """
+        try:
+            self.commands.put_nowait(command)
+            return True
+        except queue.Full:
+            return False
+
+    def reset_filter(self):
+        """Forget the filter state, e.g. after the map changed"""
+        self.particle_filter = None
+        self.last_filtered_data_size = 0
+
+    def localize(self, vector):
+        """Match a measurement against the shared map, updating this robot's filter state
+
+        Returns:
+            Name of the matched location, or None
+        """
+        manager = self.manager
+        with manager.map_lock:
+            loaded = manager.get_map()
+
+            # Template window around this robot's last match (its rows are only selected if a consumer needs them)
+            window = None
+            if self.matched_location:
+                window = loaded.template_service.window(self.matched_location, self.template_size)
+
+            if self.algorithm == "Particle Filter":
+                filtered_data = window.fingerprints if window is not None else loaded.ref_data
+                if self.particle_filter is None or len(filtered_data) != self.last_filtered_data_size:
+                    self.particle_filter = manager.particle_filter_factory(filtered_data)
+                    self.last_filtered_data_size = len(filtered_data)
+                location = self.particle_filter.update(vector)
+            elif self.algorithm in MODEL_ALGORITHMS:
+                names = pd.unique(loaded.matcher.locations[window.rows]) if window is not None else None
+                location = loaded.tile_models.closest(vector, self.algorithm, names)
+            elif window is not None:
+                if self.window_matcher is None or self.window_matcher.matcher is not loaded.matcher:
+                    self.window_matcher = WindowMatcher(loaded.location_table, loaded.matcher)
+                location = self.window_matcher.closest(vector, self.algorithm, window.center_x, window.center_y,
+                                                       window.size)
+            else:
+                location = loaded.matcher.closest(vector, self.algorithm)
+
+        if location is not None:
+            self.matched_location = location
+        return location
+
+    def _write_pending_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            self.serial_port.write(command)
+
+    def _run(self):
+        """Read, localize and stop at the target until stopped"""
+        manager = self.manager
+        while not self._stop.is_set():
+            try:
+                self._write_pending_commands()
+                if self.serial_port.in_waiting > 0:
+                    t_read = time.perf_counter_ns()
+                    self.frame_seq += 1
+                    data = self.serial_port.readline().decode('utf-8').strip()
+                    if not data:
+                        continue
+
+                    values = manager.parse_line(data)
+                    if len(values) < 3:
+                        self.parse_errors += 1
+                        continue
+                    self.vector = values[:3]
+
+                    location = self.localize(self.vector)
+                    if location is None or location == self.previous_location:
+                        continue
+                    self.previous_location = location
+                    manager.on_position(self, location)
+
+                    # Stop right away, without going through the command queue
+                    if location == self.target_location:
+                        self.serial_port.write(STOP_COMMAND)
+                        manager.on_target_reached(self, location, self.frame_seq, time.perf_counter_ns() - t_read)
+            except Exception as e:
+                self.errors += 1
+                manager.log(f"Robot {self.name}: {str(e)}", "error")
+                self._stop.wait(0.5)
+
+            self._stop.wait(0.01)
+
+
+class RobotSessionManager:
+    """Runs independent localization sessions for a fleet of robots over one shared map index"""
+
+    def __init__(self, get_map, map_lock, parse_line, particle_filter_factory,
+                 on_position=None, on_target_reached=None, log=None, serial_factory=serial.Serial):
+        """Initialize the manager
+
+        Args:
+            get_map: Callable returning the active LoadedMap (called under map_lock)
+            map_lock: Lock held while the active map is swapped or edited
+            parse_line: Callable parsing a serial line into a list of floats
+            particle_filter_factory: Callable building a particle filter for a fingerprint frame
+            on_position: Called with (session, location) when a robot's matched location changes
+            on_target_reached: Called with (session, location, frame seq, latency ns) after the stop command
+            log: Callable (message, level) for errors and events
+            serial_factory: Opens a serial port (port=, baudrate=, timeout=)
+        """
+        self.get_map = get_map
+        self.map_lock = map_lock
+        self.parse_line = parse_line
+        self.particle_filter_factory = particle_filter_factory
+        self.on_position = on_position or (lambda session, location: None)
+        self.on_target_reached = on_target_reached or (lambda session, location, seq, latency_ns: None)
+        self.log = log or (lambda message, level="info": None)
+        self.serial_factory = serial_factory
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+
+    def get(self, name):
+        return self.sessions.get(name)
+
+    def add(self, name, port, baud=9600, **kwargs):
+        """Create and start a session for a robot
+
+        Raises:
+            ValueError: If the name or the port is already in use
+        """
+        with self._lock:
+            if name in self.sessions:
+                raise ValueError(f"A robot named '{name}' already exists")
+            if any(session.port == port for session in self.sessions.values()):
+                raise ValueError(f"Port {port} is already used by another robot")
+            kwargs.setdefault("color", ROBOT_COLORS[len(self.sessions) % len(ROBOT_COLORS)])
+            session = RobotSession(self, name, port, baud, **kwargs)
+            session.start()
+            self.sessions[name] = session
+        self.log(f"Robot {name} connected on {port} at {baud} baud")
+        return session
+
+    def remove(self, name):
+        """Stop and forget a session"""
+        with self._lock:
+            session = self.sessions.pop(name, None)
+        if session is not None:
+            session.stop()
+            self.log(f"Robot {name} disconnected")
+        return session
+
+    def send_all(self, command):
+        """Queue a command for every robot"""
+        for session in self:
+            session.send_command(command)
+
+    def reset_filters(self):
+        """Drop the filter state of every robot (after a map switch or reload)"""
+        for session in self:
+            session.reset_filter()
+
+    def stop_all(self):
+        """Stop every session"""
+        for name in list(self.sessions):
+            self.remove(name)
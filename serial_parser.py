@@ -0,0 +1,49 @@
+import re
+
+
+def parse_serial_line(data):
+    """Parse a serial line into float values, repairing numbers that ran together"""
+    # Clean up the data: replace multiple commas with a single comma
+    # and ensure proper separation of numbers
+    cleaned_data = data
+    
+    # Handle case where values are run together without commas (e.g., '50.050.09')
+    # This regex looks for patterns like digit.digit.digit and adds a comma
+    cleaned_data = re.sub(r'(\d+\.\d+)(\d+\.\d+)', r'\1,\2', cleaned_data)
+    
+    # Split by comma and filter out any empty parts
+    parts = [part.strip() for part in cleaned_data.split(',') if part.strip()]
+    
+    # Extract valid float values
+    values = []
+    for part in parts:
+        try:
+            # Try to convert to float
+            values.append(float(part))
+        except ValueError:
+            # If part contains multiple numbers without separator, try to split
+            if '.' in part:
+                # Count number of decimal points
+                decimal_count = part.count('.')
+                if decimal_count > 1:
+                    # This might be multiple values stuck together
+                    # Split at each decimal point after the first
+                    decimal_positions = [pos for pos, char in enumerate(part) if char == '.']
+    
+                    # Process first number (up to the second decimal)
+                    if decimal_positions[0] > 0:
+                        first_num_end = decimal_positions[1]
+                        try:
+                            first_value = float(part[:first_num_end])
+                            values.append(first_value)
+                        except ValueError:
+                            pass
+    
+                    # Process second number (from the second decimal)
+                    try:
+                        second_value = float(part[decimal_positions[1]-1:])
+                        values.append(second_value)
+                    except ValueError:
+                        pass
+    
+    return values
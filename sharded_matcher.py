@@ -0,0 +1,281 @@
+"""Sharded nearest-fingerprint search over a pool of worker processes
+
+For building-scale maps a full scan of millions of fingerprints costs tens of
+milliseconds on one core. ShardedMatcher copies a snapshot of the fingerprints
+(sorted by tile, so every shard is a spatial stripe of the map) into one
+shared memory block and starts one worker process per shard. Queries are sent
+to the shards whose bounding box meets the query window, each worker returns
+its local top k and the results are merged in the parent. Batches of
+measurements (e.g. one per robot) travel in a single message per worker, so
+the fan-out cost is paid once per batch instead of once per measurement.
+"""
+import multiprocessing as mp
+import os
+import threading
+from collections import Counter
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from fingerprint_matcher import METRICS
+
+# Seconds to wait for a worker before the query is given up
+WORKER_TIMEOUT = 10.0
+
+# Seconds a spawned worker may take to import and attach to the snapshot
+WORKER_START_TIMEOUT = 60.0
+
+
+def _worker_main(conn, shm_name, count, start, stop):
+    """Answer top-k queries over the rows [start, stop) of the shared snapshot"""
+    # Spawned workers share the parent's resource tracker, the parent alone unlinks the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    vectors = np.ndarray((count, 3), dtype=np.float64, buffer=shm.buf)[start:stop]
+    tiles = np.ndarray((count, 2), dtype=np.float64, buffer=shm.buf, offset=count * 3 * 8)[start:stop]
+    tile_x, tile_y = tiles[:, 0], tiles[:, 1]
+    spaces = {}
+    conn.send("ready")
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            queries, transform, manhattan, k, boxes = message
+
+            # Whitened copy of the shard per metric, made on first use
+            if transform is None:
+                space = vectors
+            else:
+                key = transform.tobytes()
+                space = spaces.get(key)
+                if space is None:
+                    space = spaces[key] = vectors @ transform.T
+                queries = queries @ transform.T
+
+            distances = np.full((len(queries), k), np.inf)
+            indices = np.full((len(queries), k), -1, dtype=np.int64)
+            for q, query in enumerate(queries):
+                box = boxes[q]
+                if box is None:
+                    candidates = None
+                    diff = space - query
+                else:
+                    min_x, max_x, min_y, max_y = box
+                    candidates = np.flatnonzero(
+                        (tile_x >= min_x) & (tile_x <= max_x) & (tile_y >= min_y) & (tile_y <= max_y)
+                    )
+                    if len(candidates) == 0:
+                        continue
+                    diff = space[candidates] - query
+                d = np.abs(diff).sum(axis=1) if manhattan else np.einsum('ij,ij->i', diff, diff)
+
+                # Local top k, best first
+                n = min(k, len(d))
+                best = np.argpartition(d, n - 1)[:n] if len(d) > n else np.arange(len(d))
+                best = best[np.argsort(d[best], kind='stable')]
+                distances[q, :n] = d[best]
+                local = best if candidates is None else candidates[best]
+                indices[q, :n] = local + start
+            conn.send((distances, indices))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shm.close()
+
+
+class ShardedMatcher:
+    """Read-only snapshot of a FingerprintMatcher searched by a process pool"""
+
+    def __init__(self, matcher, location_table, workers=None, lock=None):
+        """Snapshot the fingerprints and start the workers
+
+        Args:
+            matcher: FingerprintMatcher to snapshot
+            location_table: LocationTable with the tiles of the fingerprint locations
+            workers: Number of shards and worker processes (default: CPU count)
+            lock: Lock held while the snapshot is taken (the map lock of the app)
+        """
+        workers = max(1, workers or os.cpu_count() or 1)
+        # One query at a time on the pipes; reentrant so a failing query can close the pool
+        self._lock = threading.RLock()
+        if lock is not None:
+            with lock:
+                self._snapshot(matcher, location_table)
+        else:
+            self._snapshot(matcher, location_table)
+
+        count = len(self.rows)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, count * 5 * 8))
+        shared_vectors = np.ndarray((count, 3), dtype=np.float64, buffer=self.shm.buf)
+        shared_tiles = np.ndarray((count, 2), dtype=np.float64, buffer=self.shm.buf, offset=count * 3 * 8)
+        shared_vectors[:] = self._vectors
+        shared_tiles[:] = self._tiles
+        del self._vectors, self._tiles, shared_vectors, shared_tiles
+
+        # Contiguous spatial shards and their tile bounding boxes
+        bounds = np.linspace(0, count, min(workers, max(count, 1)) + 1).astype(int)
+        tiles = np.ndarray((count, 2), dtype=np.float64, buffer=self.shm.buf, offset=count * 3 * 8)
+        self.shards = []
+        context = mp.get_context("spawn")
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            shard_tiles = tiles[start:stop]
+            tiled = shard_tiles[~np.isnan(shard_tiles[:, 0])]
+            bbox = (tiled[:, 0].min(), tiled[:, 0].max(), tiled[:, 1].min(), tiled[:, 1].max()) if len(tiled) else None
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child_conn, self.shm.name, count, start, stop),
+                                      name=f"ShardedMatcher-{start}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.shards.append({"conn": parent_conn, "process": process, "bbox": bbox})
+        del tiles, shard_tiles, tiled
+        self.closed = False
+
+        # Wait until every worker is up, so the first query doesn't pay for the process start
+        for shard in self.shards:
+            if not shard["conn"].poll(WORKER_START_TIMEOUT) or shard["conn"].recv() != "ready":
+                self.close()
+                raise RuntimeError(f"Matcher worker {shard['process'].name} did not start")
+
+    def _snapshot(self, matcher, location_table):
+        """Copy the live fingerprints sorted by tile (x, then y)"""
+        rows = matcher.live_rows()
+        locations = matcher.locations[rows]
+        table_tiles = pd.DataFrame(
+            {"X": location_table.tile_x, "Y": location_table.tile_y}, index=location_table.names
+        )
+        tiles = table_tiles.reindex(pd.Index(locations)).to_numpy(dtype=float)
+
+        # Untiled fingerprints sort last and are only found by full-map queries
+        order = np.lexsort((tiles[:, 1], tiles[:, 0]))
+        self.rows = rows[order]
+        self.locations = locations[order]
+        self._vectors = matcher.fingerprints[self.rows]
+        self._tiles = tiles[order]
+        self.version = (location_table.version, matcher.version)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self, matcher, location_table):
+        """Whether the snapshot still matches the live data"""
+        return self.version == (location_table.version, matcher.version)
+
+    def top_k(self, vectors, algorithm, k=1, windows=None):
+        """The k nearest fingerprints of every measurement
+
+        Args:
+            vectors: (M, 3) measurements
+            algorithm: Distance-based algorithm name of the GUI
+            k: Number of neighbours per measurement
+            windows: Optional (center_x, center_y, size) square tile window per measurement (None: whole map)
+
+        Returns:
+            Tuple (distances (M, k), matcher rows (M, k)); missing neighbours have inf and -1
+        """
+        distances, positions = self._query(vectors, algorithm, k, windows)
+        return distances, np.where(positions >= 0, self.rows[np.maximum(positions, 0)], -1)
+
+    def closest_batch(self, vectors, algorithm, windows=None):
+        """Best matching location name of every measurement (None where nothing is in the window)"""
+        knn = algorithm == "KNN (K=3)"
+        _, positions = self._query(vectors, algorithm, 3 if knn else 1, windows)
+
+        names = []
+        for found in positions:
+            found = found[found >= 0]
+            if len(found) == 0:
+                names.append(None)
+            elif knn and len(found) >= 3:
+                # Most common location among the 3 nearest neighbours
+                names.append(Counter(self.locations[found]).most_common(1)[0][0])
+            else:
+                names.append(self.locations[found[0]])
+        return names
+
+    def closest(self, vector, algorithm, window=None):
+        """Best matching location name of a measurement, or None"""
+        return self.closest_batch([vector], algorithm, [window])[0]
+
+    def _query(self, vectors, algorithm, k, windows):
+        """Fan a batch out to the shards and merge their top k (positions in the snapshot)"""
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("ShardedMatcher is closed")
+            return self._query_locked(vectors, algorithm, k, windows)
+
+    def _query_locked(self, vectors, algorithm, k, windows):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=float))
+        windows = list(windows) if windows is not None else [None] * len(vectors)
+        boxes = [None if w is None else (w[0] - w[2], w[0] + w[2], w[1] - w[2], w[1] + w[2]) for w in windows]
+
+        metric = METRICS.get(algorithm)
+        transform = metric.transform if metric is not None else None
+        manhattan = algorithm == "Manhattan Distance"
+
+        # Only shards that can hold a neighbour of some query are asked
+        distances = [np.full((len(vectors), k), np.inf)]
+        positions = [np.full((len(vectors), k), -1, dtype=np.int64)]
+        try:
+            pending = []
+            for shard in self.shards:
+                if any(self._meets(shard, box) for box in boxes):
+                    shard["conn"].send((vectors, transform, manhattan, k, boxes))
+                    pending.append(shard)
+
+            for shard in pending:
+                if not shard["conn"].poll(WORKER_TIMEOUT):
+                    raise RuntimeError(f"Matcher worker {shard['process'].name} did not answer")
+                shard_distances, shard_positions = shard["conn"].recv()
+                distances.append(shard_distances)
+                positions.append(shard_positions)
+        except (EOFError, OSError, RuntimeError) as e:
+            # Replies of the other shards may still be in their pipes and would answer the next query
+            self.close()
+            raise RuntimeError(f"Matcher pool closed: {str(e)}") from e
+
+        # Merge the local top k lists
+        distances = np.concatenate(distances, axis=1)
+        positions = np.concatenate(positions, axis=1)
+        best = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, best, axis=1)
+        positions = np.take_along_axis(positions, best, axis=1)
+        if not manhattan:
+            distances = np.sqrt(distances)
+        return distances, positions
+
+    @staticmethod
+    def _meets(shard, box):
+        if box is None:
+            return True
+        bbox = shard["bbox"]
+        if bbox is None:
+            return False
+        min_x, max_x, min_y, max_y = box
+        return not (bbox[1] < min_x or bbox[0] > max_x or bbox[3] < min_y or bbox[2] > max_y)
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        for shard in self.shards:
+            try:
+                shard["conn"].send(None)
+            except (OSError, ValueError):
+                pass
+        for shard in self.shards:
+            shard["process"].join(timeout=2.0)
+            if shard["process"].is_alive():
+                shard["process"].terminate()
+            shard["conn"].close()
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,198 @@
+"""Survey mode: record fingerprints from the live serial stream
+
+While the operator stands on a tile, every incoming measurement is appended
+to an in-memory buffer (O(1), no pause in the serial ingestion). When the
+operator moves on, the samples of the tile are outlier-filtered (modified
+z-score on the median absolute deviation) and averaged into one fingerprint,
+which is appended to a CSV store. The store is only ever appended to, so an
+interrupted survey keeps every finished tile, and a tile surveyed twice
+simply gets two fingerprints.
+
+Compile a store into a map bundle with:
+
+    python survey.py compile survey.csv --tiles Locations_&_Tile_Coordinates.csv \\
+        --pixels Map_Image_Pixel_Coordinates_for_Locations.csv -o maps/survey.magmap
+"""
+import argparse
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from map_bundle import write_bundle
+
+STORE_COLUMNS = ['Location', 'M_X', 'M_Y', 'M_Z', 'Samples', 'Rejected', 'Std', 'Timestamp']
+
+# Result of finishing a tile
+TileSummary = namedtuple("TileSummary", ["location", "fingerprint", "std", "samples", "rejected"])
+
+
+def robust_mean(samples, threshold=3.5):
+    """Mean of the samples after dropping outliers
+
+    A sample is an outlier if the modified z-score of any axis exceeds the
+    threshold (0.6745 * |x - median| / MAD, Iglewicz and Hoaglin).
+
+    Returns:
+        Tuple (mean, std, inlier mask)
+    """
+    median = np.median(samples, axis=0)
+    deviation = np.abs(samples - median)
+    mad = np.median(deviation, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(mad > 0, 0.6745 * deviation / mad, 0.0)
+    inliers = (z <= threshold).all(axis=1)
+    kept = samples[inliers]
+    return kept.mean(axis=0), kept.std(axis=0), inliers
+
+
+class SurveyStore:
+    """Append-only CSV store of surveyed fingerprints"""
+
+    def __init__(self, path):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        if new_file:
+            self._file.write(",".join(STORE_COLUMNS) + "\n")
+            self._file.flush()
+
+    def append(self, summary):
+        """Write one fingerprint record and flush it to disk"""
+        x, y, z = summary.fingerprint
+        self._file.write(
+            f"{summary.location},{x:.6f},{y:.6f},{z:.6f},{summary.samples},{summary.rejected},"
+            f"{float(np.linalg.norm(summary.std)):.6f},{time.strftime('%Y-%m-%dT%H:%M:%S')}\n"
+        )
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def read(path):
+        """All records of a store as a DataFrame"""
+        return pd.read_csv(path)
+
+
+class SurveyRecorder:
+    """Collects the samples of the current tile and writes them to a store when the tile is done"""
+
+    def __init__(self, store, min_samples=20, outlier_threshold=3.5):
+        """Initialize the recorder
+
+        Args:
+            store: SurveyStore the fingerprints are appended to
+            min_samples: Samples a tile needs (after outlier removal) to be stored
+            outlier_threshold: Modified z-score above which a sample is dropped
+        """
+        self.store = store
+        self.min_samples = min_samples
+        self.outlier_threshold = outlier_threshold
+        self.current_location = None
+        # Number of stored fingerprints per location
+        self.surveyed = {}
+
+        self._lock = threading.Lock()
+        self._buffer = np.empty((1024, 3))
+        self._count = 0
+
+    @property
+    def sample_count(self):
+        return self._count
+
+    def add_sample(self, vector):
+        """Add a measurement to the current tile (called from the serial thread)"""
+        with self._lock:
+            if self.current_location is None:
+                return
+            if self._count == len(self._buffer):
+                grown = np.empty((len(self._buffer) * 2, 3))
+                grown[:self._count] = self._buffer
+                self._buffer = grown
+            self._buffer[self._count] = vector[:3]
+            self._count += 1
+
+    def start_tile(self, location):
+        """Finish the current tile and start collecting for another one
+
+        Returns:
+            TileSummary of the finished tile, or None
+        """
+        summary = self.finish_tile()
+        with self._lock:
+            self.current_location = location
+        return summary
+
+    def finish_tile(self):
+        """Aggregate and store the samples of the current tile
+
+        Returns:
+            TileSummary, or None if there was no tile or too few samples
+        """
+        with self._lock:
+            location = self.current_location
+            samples = self._buffer[:self._count].copy()
+            self.current_location = None
+            self._count = 0
+        if location is None or len(samples) == 0:
+            return None
+
+        mean, std, inliers = robust_mean(samples, self.outlier_threshold)
+        summary = TileSummary(location, mean, std, int(inliers.sum()), int((~inliers).sum()))
+        if summary.samples < self.min_samples:
+            return summary._replace(fingerprint=None)
+
+        self.store.append(summary)
+        self.surveyed[location] = self.surveyed.get(location, 0) + 1
+        return summary
+
+    def close(self):
+        """Finish the current tile and close the store"""
+        summary = self.finish_tile()
+        self.store.close()
+        return summary
+
+
+def compile_survey(store_path, tile_coordinates, pixel_coordinates, output, metadata=None):
+    """Compile a survey store into a map bundle (every record becomes a fingerprint)
+
+    Returns:
+        Number of fingerprints written
+    """
+    records = SurveyStore.read(store_path)
+    magnetic_data = records[['Location', 'M_X', 'M_Y', 'M_Z']]
+    metadata = dict(metadata or {})
+    metadata.setdefault("name", os.path.splitext(os.path.basename(output))[0])
+    metadata["sources"] = {"survey": os.path.basename(store_path)}
+    write_bundle(output, tile_coordinates, pixel_coordinates, magnetic_data, metadata)
+    return len(magnetic_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Survey store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="Compile a survey store into a map bundle")
+    compile_parser.add_argument("store", help="Survey CSV store")
+    compile_parser.add_argument("--tiles", required=True, help="Locations_&_Tile_Coordinates.csv")
+    compile_parser.add_argument("--pixels", required=True, help="Map_Image_Pixel_Coordinates_for_Locations.csv")
+    compile_parser.add_argument("--name", help="Map name stored in the metadata")
+    compile_parser.add_argument("--image", help="Map image path stored in the metadata")
+    compile_parser.add_argument("-o", "--output", required=True, help="Output bundle path")
+
+    args = parser.parse_args()
+    metadata = {}
+    if args.name:
+        metadata["name"] = args.name
+    if args.image:
+        metadata["image"] = args.image
+    count = compile_survey(args.store, pd.read_csv(args.tiles), pd.read_csv(args.pixels), args.output, metadata)
+    print(f"Wrote {args.output}: {count} fingerprints")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+
+
+class TemplateWindow:
+    """A template window around a matched location
+
+    Looking a window up only resolves its center tile. The locations inside it
+    and their fingerprints are selected the first time a consumer (the particle
+    filter, the tile models, the template views) asks for them, so matching on
+    the resident window (WindowMatcher), which only needs the center and size,
+    never builds them.
+
+    Attributes:
+        names: Names of the locations inside the window
+        rows: Sorted matcher rows of their fingerprints
+        locations: Rows of the tile coordinate table inside the window (Location, X, Y)
+        fingerprints: Rows of the magnetic reference data for those locations
+    """
+
+    def __init__(self, location_table, matcher, center, size, center_x, center_y):
+        self.location_table = location_table
+        self.matcher = matcher
+        self.center = center
+        self.size = size
+        self.center_x = center_x
+        self.center_y = center_y
+
+        # Selected on first use
+        self._names = None
+        self._rows = None
+        self._locations = None
+        self._fingerprints = None
+
+    @property
+    def materialized(self):
+        """Whether the locations of the window have been selected"""
+        return self._names is not None
+
+    @property
+    def names(self):
+        if self._names is None:
+            # Range query over the tile cells of the window
+            self._names = frozenset(self.location_table.names_within(self.center_x, self.center_y, self.size))
+        return self._names
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self.matcher.rows_for(self.names)
+        return self._rows
+
+    @property
+    def locations(self):
+        if self._locations is None:
+            self._locations = self.location_table.tile_frame(sorted(self.names))
+        return self._locations
+
+    @property
+    def fingerprints(self):
+        if self._fingerprints is None:
+            self._fingerprints = self.matcher.frame(self.rows)
+        return self._fingerprints
+
+
+class TemplateService:
+    """Computes template windows once and shares them between the matcher and the views
+
+    Windows are cached in an LRU keyed by (matched location, template size).
+    A lookup only resolves the center tile; the window's rows are selected
+    lazily (see TemplateWindow) and stay cached with it.
+    Edits are picked up from the change logs of the location table and the
+    matcher: a cached window is dropped only if an edited location is its
+    center, lies in it, or (after a move) now lies in its tile box, so editing
+    one location keeps the windows elsewhere on the map.
+    """
+
+    def __init__(self, location_table, matcher, maxsize=256):
+        """Initialize the service
+
+        Args:
+            location_table: LocationTable with the tile coordinates of every location
+            matcher: FingerprintMatcher holding the reference fingerprints
+            maxsize: Number of windows kept in the LRU cache
+        """
+        self.location_table = location_table
+        self.matcher = matcher
+        self.maxsize = maxsize
+
+        # (center, size) -> window (None for unknown centers), least recently used first
+        self._windows = OrderedDict()
+        self._seen_version = self.version
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    @property
+    def version(self):
+        return self.location_table.version, self.matcher.version
+
+    def window(self, center, size):
+        """Template window around a location, or None if the location is unknown"""
+        key = (center, int(size))
+        with self._lock:
+            self._sync()
+            if key in self._windows:
+                self._windows.move_to_end(key)
+                self.hits += 1
+                return self._windows[key]
+
+            self.misses += 1
+            window = self._compute_window(*key)
+            self._windows[key] = window
+            if len(self._windows) > self.maxsize:
+                self._windows.popitem(last=False)
+            return window
+
+    def cache_info(self):
+        """Hit/miss statistics of the window cache"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "maxsize": self.maxsize,
+            "currsize": len(self._windows),
+        }
+
+    def clear(self):
+        """Drop all cached windows"""
+        with self._lock:
+            self._windows.clear()
+
+    def _sync(self):
+        """Drop the cached windows touched by the edits since the last lookup"""
+        version = self.version
+        if version == self._seen_version:
+            return
+        table_version, matcher_version = self._seen_version
+        self._seen_version = version
+        table_changes = self.location_table.changes_since(table_version)
+        matcher_changes = self.matcher.changes_since(matcher_version)
+        if table_changes is None or matcher_changes is None:
+            self.invalidated += len(self._windows)
+            self._windows.clear()
+            return
+
+        changed = table_changes | matcher_changes
+        tiles = [tile for tile in map(self.location_table.tile, changed) if tile is not None]
+        for key, window in list(self._windows.items()):
+            if key[0] in changed or window is not None and _touched(window, changed, tiles):
+                del self._windows[key]
+                self.invalidated += 1
+
+    def _compute_window(self, center, size):
+        """Window of `size` tiles around the center, its rows are selected on first use"""
+        center_tile = self.location_table.tile(center)
+        if center_tile is None:
+            return None
+        return TemplateWindow(self.location_table, self.matcher, center, size, *center_tile)
+
+
+def _touched(window, changed, tiles):
+    """Whether edits of the given locations (now at the given tiles) make a window stale"""
+    # A window whose rows were never selected only depends on its center tile
+    if not window.materialized:
+        return False
+    if not window.names.isdisjoint(changed):
+        return True
+    return any(abs(x - window.center_x) <= window.size and abs(y - window.center_y) <= window.size
+               for x, y in tiles)
@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+LOG_2PI = np.log(2.0 * np.pi)
+
+# Algorithms answered by the per-tile models instead of the raw fingerprints
+MODEL_ALGORITHMS = ("Mahalanobis Distance", "Max Likelihood")
+
+
+class TileModels:
+    """Per-location statistical models of the surveyed fingerprints
+
+    All survey samples of a location are summarized at load time into a mean
+    and a covariance (optionally a small Gaussian mixture). Covariances are
+    shrunk towards an isotropic sensor noise prior, so locations with a single
+    sample still get a usable model. Inverse covariances and normalizers are
+    precomputed, matching is one vectorized pass over the models.
+    """
+
+    def __init__(self, fingerprints, locations, prior_variance=4.0, prior_strength=1.0,
+                 gmm_components=0, gmm_min_samples=8):
+        """Build the models
+
+        Args:
+            fingerprints: (N, 3) array of survey samples
+            locations: Location name of every sample
+            prior_variance: Variance per axis assumed for the sensor noise (uT^2)
+            prior_strength: Weight of the prior in samples
+            gmm_components: Mixture components per location, 0 for a single Gaussian
+            gmm_min_samples: Samples per component a location needs to get a mixture
+        """
+        fingerprints = np.asarray(fingerprints, dtype=float).reshape(-1, 3)
+        codes, names = pd.factorize(np.asarray(locations, dtype=object))
+        self.names = np.asarray(names, dtype=object)
+        self.index_of = {name: i for i, name in enumerate(self.names)}
+        self.prior_variance = prior_variance
+        self.prior_strength = prior_strength
+        self.gmm_components = gmm_components
+
+        count = len(self.names)
+        self.counts = np.bincount(codes, minlength=count)
+        self.means = np.zeros((count, 3))
+        np.add.at(self.means, codes, fingerprints)
+        self.means /= np.maximum(self.counts, 1)[:, None]
+
+        centered = fingerprints - self.means[codes]
+        scatter = np.zeros((count, 3, 3))
+        np.add.at(scatter, codes, centered[:, :, None] * centered[:, None, :])
+        self.covariances = self._regularize(scatter, self.counts)
+
+        # One component per location unless a mixture is fitted below
+        component_means = [[mean] for mean in self.means]
+        component_covs = [[cov] for cov in self.covariances]
+        component_weights = [[1.0] for _ in range(count)]
+        if gmm_components > 1:
+            order = np.argsort(codes, kind='stable')
+            bounds = np.concatenate(([0], np.cumsum(self.counts)))
+            for i in np.flatnonzero(self.counts >= gmm_components * gmm_min_samples):
+                samples = fingerprints[order[bounds[i]:bounds[i + 1]]]
+                weights, means, covs = self._fit_gmm(samples, gmm_components)
+                component_weights[i], component_means[i], component_covs[i] = weights, means, covs
+
+        # Flat component arrays, the components of a location are contiguous
+        self.component_counts = np.array([len(w) for w in component_weights])
+        self.component_starts = np.concatenate(([0], np.cumsum(self.component_counts)[:-1]))
+        self.component_means = np.concatenate([np.asarray(m) for m in component_means]).reshape(-1, 3)
+        covariances = np.concatenate([np.asarray(c) for c in component_covs]).reshape(-1, 3, 3)
+        chol = np.linalg.cholesky(covariances)
+        log_det = 2.0 * np.log(np.diagonal(chol, axis1=1, axis2=2)).sum(axis=1)
+        self.component_inv_covs = np.linalg.inv(covariances)
+        self.component_log_norms = (
+            np.log(np.concatenate(component_weights)) - 0.5 * (log_det + 3 * LOG_2PI)
+        )
+
+        # Single Gaussian per location for the Mahalanobis distance
+        self.inv_covariances = np.linalg.inv(self.covariances)
+
+    @classmethod
+    def from_matcher(cls, matcher, **kwargs):
+        """Models of all fingerprints held by a FingerprintMatcher"""
+        rows = matcher.live_rows()
+        return cls(matcher.fingerprints[rows], matcher.locations[rows], **kwargs)
+
+    def __len__(self):
+        return len(self.names)
+
+    def refit(self, matcher, names):
+        """Refit the single-Gaussian models of some locations in place
+
+        Returns:
+            False (nothing changed) if a location was added or removed or uses a mixture;
+            the caller then builds new models
+        """
+        if self.gmm_components > 1:
+            return False
+        refits = []
+        for name in names:
+            i = self.index_of.get(name)
+            rows = matcher.rows_by_location.get(name)
+            if i is None or not rows:
+                return False
+            refits.append((i, sorted(rows)))
+
+        for i, rows in refits:
+            samples = matcher.fingerprints[rows]
+            mean = samples.mean(axis=0)
+            centered = samples - mean
+            covariance = self._regularize((centered.T @ centered)[None], np.array([len(rows)]))[0]
+            inv_covariance = np.linalg.inv(covariance)
+            log_det = 2.0 * np.log(np.diagonal(np.linalg.cholesky(covariance))).sum()
+
+            self.counts[i] = len(rows)
+            self.means[i] = mean
+            self.covariances[i] = covariance
+            self.inv_covariances[i] = inv_covariance
+            component = self.component_starts[i]
+            self.component_means[component] = mean
+            self.component_inv_covs[component] = inv_covariance
+            self.component_log_norms[component] = -0.5 * (log_det + 3 * LOG_2PI)
+        return True
+
+    def indices(self, names):
+        """Model indices of the given locations (unknown names are skipped)"""
+        return np.array([self.index_of[n] for n in names if n in self.index_of], dtype=np.intp)
+
+    def mahalanobis(self, vector, indices=None):
+        """Squared Mahalanobis distance of a measurement to every (selected) location model"""
+        means = self.means if indices is None else self.means[indices]
+        inv_covs = self.inv_covariances if indices is None else self.inv_covariances[indices]
+        diff = np.asarray(vector, dtype=float) - means
+        return np.einsum('li,lij,lj->l', diff, inv_covs, diff)
+
+    def log_likelihood(self, vector, indices=None):
+        """Log-likelihood of a measurement under every (selected) location model"""
+        if indices is None:
+            indices = np.arange(len(self.names))
+        counts = self.component_counts[indices]
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        # Component rows of the selected locations
+        components = np.repeat(self.component_starts[indices] - offsets, counts) + np.arange(counts.sum())
+        diff = np.asarray(vector, dtype=float) - self.component_means[components]
+        d2 = np.einsum('ci,cij,cj->c', diff, self.component_inv_covs[components], diff)
+        component_ll = self.component_log_norms[components] - 0.5 * d2
+
+        # Log-sum-exp over the components of each location
+        peak = np.maximum.reduceat(component_ll, offsets)
+        return peak + np.log(np.add.reduceat(np.exp(component_ll - np.repeat(peak, counts)), offsets))
+
+    def closest(self, vector, algorithm, names=None):
+        """Name of the best matching location for a measurement, or None"""
+        indices = np.arange(len(self.names)) if names is None else self.indices(names)
+        if len(indices) == 0:
+            return None
+        if algorithm == "Max Likelihood":
+            return self.names[indices[int(np.argmax(self.log_likelihood(vector, indices)))]]
+        return self.names[indices[int(np.argmin(self.mahalanobis(vector, indices)))]]
+
+    def _regularize(self, scatter, counts):
+        """Covariances shrunk towards the isotropic prior (valid for a single sample too)"""
+        prior = self.prior_strength * self.prior_variance * np.eye(3)
+        return (scatter + prior) / (np.maximum(counts - 1, 0) + self.prior_strength)[:, None, None]
+
+    def _fit_gmm(self, samples, components, iterations=20):
+        """Fit a small full-covariance Gaussian mixture with EM"""
+        # Deterministic start: split the samples along their main axis
+        centered = samples - samples.mean(axis=0)
+        axis = np.linalg.svd(centered, full_matrices=False)[2][0]
+        order = np.argsort(centered @ axis)
+        groups = np.array_split(order, components)
+        means = np.array([samples[g].mean(axis=0) for g in groups])
+        covs = np.array([np.cov(samples[g].T) for g in groups]).reshape(-1, 3, 3)
+        weights = np.full(components, 1.0 / components)
+
+        for _ in range(iterations):
+            # E step: responsibilities
+            diff = samples[:, None, :] - means[None, :, :]
+            inv_covs = np.linalg.inv(covs)
+            log_det = np.linalg.slogdet(covs)[1]
+            d2 = np.einsum('nki,kij,nkj->nk', diff, inv_covs, diff)
+            log_resp = np.log(weights) - 0.5 * (d2 + log_det + 3 * LOG_2PI)
+            log_resp -= log_resp.max(axis=1, keepdims=True)
+            resp = np.exp(log_resp)
+            resp /= resp.sum(axis=1, keepdims=True)
+
+            # M step, with the same prior as the single Gaussians
+            totals = resp.sum(axis=0)
+            weights = totals / totals.sum()
+            means = (resp.T @ samples) / totals[:, None]
+            diff = samples[:, None, :] - means[None, :, :]
+            scatter = np.einsum('nk,nki,nkj->kij', resp, diff, diff)
+            covs = (scatter + self.prior_strength * self.prior_variance * np.eye(3)) / \
+                (totals + self.prior_strength)[:, None, None]
+
+        return weights, means, covs
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import tkinter as tk
+from collections import OrderedDict
+
+from PIL import Image, ImageTk
+
+# Large floor plans are expected, don't treat them as decompression bombs
+Image.MAX_IMAGE_PIXELS = None
+
+
+def build_pyramid(image_path, cache_dir, tile_size=256):
+    """Precompute a multi-resolution tile pyramid for an image on disk
+
+    Level 0 is the native resolution, every next level halves both sides until
+    the whole image fits in a single tile. The pyramid is cached under a key
+    derived from the image path, modification time and size, so it is only
+    rebuilt when the image changes.
+
+    Args:
+        image_path: Path of the source map image
+        cache_dir: Directory that holds all pyramid caches
+        tile_size: Width and height of one tile in pixels
+
+    Returns:
+        Dict with the pyramid directory, tile size and (width, height, cols, rows) per level
+    """
+    stat = os.stat(image_path)
+    key_source = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{tile_size}"
+    key = hashlib.sha1(key_source.encode("utf-8")).hexdigest()[:16]
+    pyramid_dir = os.path.join(cache_dir, key)
+    meta_path = os.path.join(pyramid_dir, "meta.json")
+
+    # Reuse an existing pyramid
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["dir"] = pyramid_dir
+        return meta
+
+    image = Image.open(image_path)
+    image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+
+    levels = []
+    level = 0
+    while True:
+        width, height = image.size
+        cols = (width + tile_size - 1) // tile_size
+        rows = (height + tile_size - 1) // tile_size
+        level_dir = os.path.join(pyramid_dir, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+
+        for row in range(rows):
+            for col in range(cols):
+                box = (col * tile_size, row * tile_size,
+                       min((col + 1) * tile_size, width), min((row + 1) * tile_size, height))
+                image.crop(box).save(os.path.join(level_dir, f"{col}_{row}.png"), compress_level=1)
+
+        levels.append([width, height, cols, rows])
+        if cols <= 1 and rows <= 1:
+            break
+
+        image = image.reduce(2)
+        level += 1
+
+    meta = {"version": 1, "source": os.path.abspath(image_path), "tile_size": tile_size, "levels": levels}
+    # Write the metadata last so a half-built pyramid is never reused
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    meta["dir"] = pyramid_dir
+    return meta
+
+
+class TiledMapViewer:
+    """Tk canvas viewer that only renders the visible tiles of a map pyramid
+
+    Overlay items (markers, labels, templates) are drawn in native image pixel
+    coordinates and then passed to :meth:`reproject`, which scales them to the
+    current zoom. Changing the zoom rescales every overlay item in place.
+    """
+
+    TILE_TAG = "map_tile"
+
+    def __init__(self, canvas, cache_dir, tile_size=256, max_cached_tiles=256, max_zoom=2.0):
+        """Initialize the viewer
+
+        Args:
+            canvas: Tk canvas the tiles are drawn on
+            cache_dir: Directory for the on-disk pyramid cache
+            tile_size: Width and height of one tile in pixels
+            max_cached_tiles: Number of decoded tiles kept in memory
+            max_zoom: Largest zoom factor (native resolution is 1.0)
+        """
+        self.canvas = canvas
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.max_cached_tiles = max_cached_tiles
+        self.max_zoom = max_zoom
+
+        self.meta = None
+        self.width = 0
+        self.height = 0
+        self.zoom = 1.0
+        self.zoom_levels = [1.0]
+
+        # (level, upscale, col, row) -> PhotoImage, least recently used first
+        self._photo_cache = OrderedDict()
+        # (level, upscale, col, row) -> canvas item id for tiles currently on the canvas
+        self._tile_items = {}
+        self._render_pending = None
+
+    def load(self, image_path):
+        """Load (building if needed) the pyramid for an image and show it at native size
+
+        Returns:
+            Tuple (width, height) of the image at native resolution
+        """
+        self.meta = build_pyramid(image_path, self.cache_dir, self.tile_size)
+        self.width, self.height = self.meta["levels"][0][:2]
+
+        # Zoom steps: every pyramid level plus upscaled native tiles up to max_zoom
+        level_count = len(self.meta["levels"])
+        self.zoom_levels = [1.0 / (2 ** level) for level in range(level_count - 1, -1, -1)]
+        zoom = 2.0
+        while zoom <= self.max_zoom:
+            self.zoom_levels.append(zoom)
+            zoom *= 2
+
+        self.zoom = 1.0
+        self._photo_cache.clear()
+        self._forget_tiles()
+        self._update_scrollregion()
+        self.render()
+        return self.width, self.height
+
+    def to_canvas(self, x, y):
+        """Convert native image pixel coordinates to canvas coordinates"""
+        return x * self.zoom, y * self.zoom
+
+    def to_image(self, x, y):
+        """Convert canvas coordinates to native image pixel coordinates"""
+        return x / self.zoom, y / self.zoom
+
+    def reproject(self, tag):
+        """Scale items drawn in native image coordinates to the current zoom"""
+        if self.zoom != 1.0:
+            self.canvas.scale(tag, 0, 0, self.zoom, self.zoom)
+
+    def zoom_in(self):
+        self._step_zoom(1)
+
+    def zoom_out(self):
+        self._step_zoom(-1)
+
+    def set_zoom(self, zoom):
+        """Zoom to a factor from zoom_levels, keeping the view centered"""
+        if self.meta is None or zoom == self.zoom:
+            return
+
+        # Remember the image point at the center of the view
+        view_w = self.canvas.winfo_width()
+        view_h = self.canvas.winfo_height()
+        center_x, center_y = self.to_image(
+            self.canvas.canvasx(view_w / 2), self.canvas.canvasy(view_h / 2)
+        )
+
+        # Tiles are re-rendered for the new level, everything else is rescaled
+        factor = zoom / self.zoom
+        self._forget_tiles()
+        self.canvas.scale("all", 0, 0, factor, factor)
+        self.zoom = zoom
+        self._update_scrollregion()
+
+        # Scroll so the same image point stays in the center
+        scaled_w, scaled_h = self.width * zoom, self.height * zoom
+        if scaled_w > view_w:
+            self.canvas.xview_moveto(max(0.0, (center_x * zoom - view_w / 2) / scaled_w))
+        if scaled_h > view_h:
+            self.canvas.yview_moveto(max(0.0, (center_y * zoom - view_h / 2) / scaled_h))
+
+        self.render()
+
+    def schedule_render(self, *args):
+        """Render visible tiles once the Tk event loop is idle"""
+        if self._render_pending is None:
+            self._render_pending = self.canvas.after_idle(self._deferred_render)
+
+    def _deferred_render(self):
+        self._render_pending = None
+        self.render()
+
+    def render(self):
+        """Draw the tiles in view and drop the ones that scrolled out of view"""
+        if self.meta is None:
+            return
+
+        level, upscale = self._source_for_zoom(self.zoom)
+        level_w, level_h, cols, rows = self.meta["levels"][level]
+        display_tile = self.tile_size * upscale
+
+        # Visible region in canvas coordinates (fall back to the requested size before mapping)
+        view_w = max(self.canvas.winfo_width(), int(float(self.canvas.cget("width"))))
+        view_h = max(self.canvas.winfo_height(), int(float(self.canvas.cget("height"))))
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+
+        first_col = max(0, int(x0 // display_tile))
+        last_col = min(cols - 1, int((x0 + view_w) // display_tile))
+        first_row = max(0, int(y0 // display_tile))
+        last_row = min(rows - 1, int((y0 + view_h) // display_tile))
+
+        wanted = set()
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                wanted.add((level, upscale, col, row))
+
+        # Remove tiles that are no longer visible
+        for key in list(self._tile_items):
+            if key not in wanted:
+                self.canvas.delete(self._tile_items.pop(key))
+
+        # Add the newly visible ones
+        added = False
+        for key in wanted:
+            if key in self._tile_items:
+                continue
+            photo = self._tile_photo(key)
+            if photo is None:
+                continue
+            _, _, col, row = key
+            self._tile_items[key] = self.canvas.create_image(
+                col * display_tile, row * display_tile, anchor=tk.NW, image=photo, tags=self.TILE_TAG
+            )
+            added = True
+
+        # Tiles always stay below every overlay
+        if added:
+            self.canvas.tag_lower(self.TILE_TAG)
+
+    def _step_zoom(self, direction):
+        """Move one step through zoom_levels"""
+        if self.zoom not in self.zoom_levels:
+            return
+        index = self.zoom_levels.index(self.zoom) + direction
+        if 0 <= index < len(self.zoom_levels):
+            self.set_zoom(self.zoom_levels[index])
+
+    def _source_for_zoom(self, zoom):
+        """Pyramid level and upscale factor that produce a zoom"""
+        if zoom >= 1.0:
+            return 0, int(zoom)
+        level = 0
+        while 1.0 / (2 ** level) > zoom:
+            level += 1
+        return level, 1
+
+    def _tile_photo(self, key):
+        """Decoded tile image, loaded from the pyramid on a cache miss"""
+        photo = self._photo_cache.get(key)
+        if photo is not None:
+            self._photo_cache.move_to_end(key)
+            return photo
+
+        level, upscale, col, row = key
+        path = os.path.join(self.meta["dir"], str(level), f"{col}_{row}.png")
+        try:
+            tile = Image.open(path)
+            if upscale > 1:
+                tile = tile.resize((tile.width * upscale, tile.height * upscale), Image.NEAREST)
+            photo = ImageTk.PhotoImage(tile)
+        except OSError:
+            return None
+
+        self._photo_cache[key] = photo
+        # Evict the least recently used tiles, but never ones on the canvas (Tk would blank them)
+        for cached_key in list(self._photo_cache):
+            if len(self._photo_cache) <= self.max_cached_tiles:
+                break
+            if cached_key not in self._tile_items and cached_key != key:
+                del self._photo_cache[cached_key]
+        return photo
+
+    def _forget_tiles(self):
+        """Remove all tile items from the canvas"""
+        self.canvas.delete(self.TILE_TAG)
+        self._tile_items.clear()
+
+    def _update_scrollregion(self):
+        self.canvas.config(scrollregion=(0, 0, self.width * self.zoom, self.height * self.zoom))
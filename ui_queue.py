@@ -0,0 +1,120 @@
+import threading
+from collections import deque
+
+
+class UIUpdateQueue:
+    """Bounded, coalescing queue that hands work from background threads to the Tk thread
+
+    Producers (e.g. the serial reader thread) only enqueue. A Tk ``after`` pump
+    running on the main thread drains the queue and calls the registered
+    handlers, so widgets are never touched from another thread.
+
+    Three kinds of updates are supported:
+        latest:  only the most recent value per key is kept (vector readouts, robot marker)
+        batch:   values are collected and handed to the handler as one list (log lines)
+        event:   ordered one-shot events (message boxes), bounded with drop-oldest
+    """
+
+    def __init__(self, max_events=256, max_batch=1000, interval_ms=50):
+        """Initialize the queue
+
+        Args:
+            max_events: Maximum number of pending ordered events
+            max_batch: Maximum number of pending values per batch key
+            interval_ms: Delay between two pump runs on the Tk thread
+        """
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._batches = {}
+        self._events = deque(maxlen=max_events)
+        self._handlers = {}
+
+        # Counters for values that were overwritten or dropped before being shown
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._root = None
+        self._after_id = None
+
+    def register(self, key, handler):
+        """Register the Tk-thread handler that is called for a key"""
+        self._handlers[key] = handler
+
+    def set_latest(self, key, *args):
+        """Store a value for a key, replacing any value not yet shown"""
+        with self._lock:
+            if key in self._latest:
+                self.coalesced += 1
+            self._latest[key] = args
+
+    def add_to_batch(self, key, value):
+        """Append a value to the batch for a key"""
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = deque(maxlen=self.max_batch)
+            if len(batch) == batch.maxlen:
+                self.dropped += 1
+            batch.append(value)
+
+    def post_event(self, key, *args):
+        """Queue an ordered one-shot event for a key"""
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append((key, args))
+
+    def start(self, root):
+        """Start draining the queue from the Tk event loop"""
+        self._root = root
+        if self._after_id is None:
+            self._after_id = root.after(self.interval_ms, self._pump)
+
+    def stop(self):
+        """Stop the pump"""
+        if self._root is not None and self._after_id is not None:
+            try:
+                self._root.after_cancel(self._after_id)
+            except Exception:
+                pass
+        self._after_id = None
+
+    def drain(self):
+        """Run the handlers for everything queued so far (Tk thread only)"""
+        # Swap the pending state out under the lock and run handlers without it
+        with self._lock:
+            latest, self._latest = self._latest, {}
+            batches, self._batches = self._batches, {}
+            events = list(self._events)
+            self._events.clear()
+
+        for key, args in latest.items():
+            self._dispatch(key, args)
+
+        for key, values in batches.items():
+            if values:
+                self._dispatch(key, (list(values),))
+
+        for key, args in events:
+            self._dispatch(key, args)
+
+    def _dispatch(self, key, args):
+        """Call the handler registered for a key"""
+        handler = self._handlers.get(key)
+        if handler is None:
+            return
+        try:
+            handler(*args)
+        except Exception as e:
+            print(f"UI update '{key}' failed: {str(e)}")
+
+    def _pump(self):
+        """Drain the queue and reschedule"""
+        try:
+            self.drain()
+        finally:
+            if self._root is not None and self._after_id is not None:
+                self._after_id = self._root.after(self.interval_ms, self._pump)
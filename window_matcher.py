@@ -0,0 +1,254 @@
+from collections import Counter
+
+import numpy as np
+
+from fingerprint_matcher import METRICS
+
+
+class WindowMatcher:
+    """Nearest-fingerprint search over a resident, incrementally maintained template window
+
+    Consecutive samples mostly keep the same matched location, and when the
+    window moves it usually slides by a tile. Instead of gathering the window's
+    rows out of the full fingerprint array for every sample, the fingerprints
+    of the current window are kept in a contiguous buffer:
+
+    * same window: the buffer is matched as is, no gather and no setup
+    * window slid (old and new window overlap): only the locations in the
+      strips that leave or enter the window are looked up in the tile cells,
+      leaving rows are swapped out and entering rows appended, so the update
+      costs O(window edge) instead of O(window area)
+    * otherwise (jump, size change, edit of a location in the window): the
+      buffer is rebuilt; edits elsewhere on the map keep it
+
+    Results are identical to FingerprintMatcher.closest over the same
+    window's rows, ties included (they go to the lowest row).
+    """
+
+    def __init__(self, location_table, matcher):
+        """Initialize the matcher
+
+        Args:
+            location_table: LocationTable with the tile coordinates of every location
+            matcher: FingerprintMatcher holding the reference fingerprints
+        """
+        self.location_table = location_table
+        self.matcher = matcher
+
+        # Resident window: box (min_x, max_x, min_y, max_y) and data version it was built for
+        self.box = None
+        self.version = None
+        self.count = 0
+        self.vectors = np.zeros((0, 3), dtype=float)
+        self.rows = np.zeros(0, dtype=np.intp)
+        self.locations = np.empty(0, dtype=object)
+        # Matcher row -> position in the buffer, and the resident locations
+        self.positions = {}
+        self.names = set()
+
+        # Buffer in a metric's whitened space, kept in sync while that metric is in use
+        self._metric = None
+        self._space = None
+
+        # Counters
+        self.hits = 0
+        self.slides = 0
+        self.rebuilds = 0
+        self.rows_moved = 0
+
+    def stats(self):
+        """How the resident window was reused"""
+        return {
+            "hits": self.hits,
+            "slides": self.slides,
+            "rebuilds": self.rebuilds,
+            "rows_moved": self.rows_moved,
+            "resident_rows": self.count,
+        }
+
+    def closest(self, vector, algorithm, center_x, center_y, size):
+        """Name of the best matching location within `size` tiles of a tile position
+
+        Args:
+            vector: Measured [x, y, z] magnetic field
+            algorithm: One of the distance-based algorithm names of the GUI
+            center_x: Tile x of the window center
+            center_y: Tile y of the window center
+            size: Template window half size
+
+        Returns:
+            Location name, or None if the window holds no fingerprints
+        """
+        self.move_to(center_x, center_y, size)
+        return self.match(vector, algorithm)
+
+    def match(self, vector, algorithm):
+        """Name of the best matching location in the resident window (see move_to)"""
+        count = self.count
+        if count == 0:
+            return None
+
+        metric = METRICS.get(algorithm)
+        if metric is not None:
+            diff = self._metric_space(metric)[:count] - metric.apply(vector)
+        else:
+            diff = self.vectors[:count] - np.asarray(vector, dtype=float)
+        if algorithm == "Manhattan Distance":
+            distances = np.abs(diff).sum(axis=1)
+        else:
+            # Squared Euclidean distance ranks like the Euclidean distance
+            distances = np.einsum('ij,ij->i', diff, diff)
+
+        rows = self.rows[:count]
+        if algorithm == "KNN (K=3)" and count >= 3:
+            # The buffer is unordered: take everything up to the 3rd smallest distance, ties by row
+            third = distances[np.argpartition(distances, 2)[2]]
+            candidates = np.flatnonzero(distances <= third)
+            nearest = candidates[np.lexsort((rows[candidates], distances[candidates]))[:3]]
+            return Counter(self.locations[nearest]).most_common(1)[0][0]
+
+        best = np.flatnonzero(distances == distances.min())
+        return self.locations[best[np.argmin(rows[best])]] if len(best) > 1 else self.locations[best[0]]
+
+    def move_to(self, center_x, center_y, size):
+        """Make the window around a tile position resident"""
+        box = (center_x - size, center_x + size, center_y - size, center_y + size)
+        version = (self.location_table.version, self.matcher.version)
+        if version != self.version and self.box is not None and self._untouched_since(self.version):
+            self.version = version
+        if box == self.box and version == self.version:
+            self.hits += 1
+            return
+
+        old = self.box
+        if version != self.version or old is None or not _overlaps(old, box) or \
+                old[1] - old[0] != box[1] - box[0] or old[3] - old[2] != box[3] - box[2]:
+            self._rebuild(box, version)
+            return
+
+        # Slide: only the strips that differ between the two boxes are visited
+        table = self.location_table
+        leaving = {name for name in _strip_names(table, old, box) if not _inside(table, name, box)}
+        entering = {name for name in _strip_names(table, box, old) if not _inside(table, name, old)}
+        rows_by_location = self.matcher.rows_by_location
+        for name in leaving:
+            for row in rows_by_location.get(name, ()):
+                self._remove(row)
+        entering_rows = [row for name in entering for row in rows_by_location.get(name, ())]
+        self._append(np.array(entering_rows, dtype=np.intp))
+        self.names -= leaving
+        self.names |= entering
+        self.box = box
+        self.slides += 1
+
+    def _untouched_since(self, version):
+        """Whether the edits after a (table, matcher) version left the resident window alone"""
+        table_changes = self.location_table.changes_since(version[0])
+        matcher_changes = self.matcher.changes_since(version[1])
+        if table_changes is None or matcher_changes is None:
+            return False
+        changed = table_changes | matcher_changes
+        if not self.names.isdisjoint(changed):
+            return False
+        min_x, max_x, min_y, max_y = self.box
+        for name in changed:
+            tile = self.location_table.tile(name)
+            if tile is not None and min_x <= tile[0] <= max_x and min_y <= tile[1] <= max_y:
+                return False
+        return True
+
+    def _rebuild(self, box, version):
+        """Load the whole window into the buffer"""
+        names = self.location_table.names_in_box(*box)
+        rows = self.matcher.rows_for(names)
+        self.count = 0
+        self.positions = {}
+        self.names = names
+        self._append(rows)
+        self.box = box
+        self.version = version
+        self.rebuilds += 1
+
+    def _append(self, rows):
+        if len(rows) == 0:
+            return
+        start, end = self.count, self.count + len(rows)
+        if end > len(self.rows):
+            self._grow(end)
+        self.vectors[start:end] = self.matcher.fingerprints[rows]
+        self.rows[start:end] = rows
+        self.locations[start:end] = self.matcher.locations[rows]
+        if self._metric is not None:
+            self._space[start:end] = self._metric.apply(self.vectors[start:end])
+        self.positions.update(zip(rows.tolist(), range(start, end)))
+        self.count = end
+        self.rows_moved += len(rows)
+
+    def _remove(self, row):
+        """Swap a row out with the last resident row"""
+        position = self.positions.pop(int(row))
+        last = self.count - 1
+        if position != last:
+            moved = int(self.rows[last])
+            self.vectors[position] = self.vectors[last]
+            self.rows[position] = moved
+            self.locations[position] = self.locations[last]
+            if self._metric is not None:
+                self._space[position] = self._space[last]
+            self.positions[moved] = position
+        self.locations[last] = None
+        self.count = last
+        self.rows_moved += 1
+
+    def _grow(self, needed):
+        """Double the buffer capacity until `needed` rows fit"""
+        capacity = max(64, len(self.rows))
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.zeros((capacity, 3), dtype=float)
+        vectors[:self.count] = self.vectors[:self.count]
+        rows = np.zeros(capacity, dtype=np.intp)
+        rows[:self.count] = self.rows[:self.count]
+        locations = np.empty(capacity, dtype=object)
+        locations[:self.count] = self.locations[:self.count]
+        self.vectors, self.rows, self.locations = vectors, rows, locations
+        if self._metric is not None:
+            space = np.zeros((capacity, 3), dtype=float)
+            space[:self.count] = self._space[:self.count]
+            self._space = space
+
+    def _metric_space(self, metric):
+        """Resident window in a metric's whitened space, transformed when the metric changes"""
+        if metric is not self._metric:
+            self._metric = metric
+            self._space = np.zeros_like(self.vectors)
+            self._space[:self.count] = metric.apply(self.vectors[:self.count])
+        return self._space
+
+
+def _overlaps(a, b):
+    return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+
+def _inside(table, name, box):
+    entry = table.entries[name]
+    return box[0] <= entry.tile_x <= box[1] and box[2] <= entry.tile_y <= box[3]
+
+
+def _strip_names(table, box, other):
+    """Candidate names of `box` outside `other`: the (up to four) strips of box beyond other's edges
+
+    Strips include their inner edge, callers drop the names that lie inside `other`.
+    """
+    min_x, max_x, min_y, max_y = box
+    names = set()
+    if min_x < other[0]:
+        names |= table.names_in_box(min_x, min(max_x, other[0]), min_y, max_y)
+    if max_x > other[1]:
+        names |= table.names_in_box(max(min_x, other[1]), max_x, min_y, max_y)
+    inner_min_x, inner_max_x = max(min_x, other[0]), min(max_x, other[1])
+    if min_y < other[2]:
+        names |= table.names_in_box(inner_min_x, inner_max_x, min_y, min(max_y, other[2]))
+    if max_y > other[3]:
+        names |= table.names_in_box(inner_min_x, inner_max_x, max(min_y, other[3]), max_y)
+    return names